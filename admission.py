@@ -0,0 +1,107 @@
+""" Admission control: a fixed number of slots for expensive requests """
+import threading
+from typing import Iterator
+
+from flask import Response
+
+
+class Slots:
+  """
+  A fixed number of slots for expensive requests. A request that finds no free
+  slot is rejected at once instead of waiting in a queue, so the server stays
+  responsive and the client can retry later.
+  """
+
+  def __init__(self, size: int):
+    self.size = size
+    self.lock = threading.Lock()
+    self.used = 0
+
+  def acquire(self) -> bool:
+    """
+    Takes a slot if one is free.
+
+    Returns:
+        bool: True if a slot was taken; it must be given back with release.
+    """
+    with self.lock:
+      if self.used >= self.size:
+        return False
+      self.used += 1
+      return True
+
+  def release(self) -> None:
+    """
+    Gives a slot back.
+    """
+    with self.lock:
+      self.used -= 1
+
+  def inuse(self) -> int:
+    """
+    Returns the number of slots taken.
+
+    Returns:
+        int: The number of requests holding a slot.
+    """
+    with self.lock:
+      return self.used
+
+  def hold(self, iterator: Iterator) -> Iterator:
+    """
+    Keeps a taken slot until a streamed response is finished.
+
+    Args:
+        iterator (Iterator): The body of the streamed response.
+
+    Returns:
+        Iterator: The same body, giving the slot back when it is exhausted,
+        fails or is closed by the server.
+    """
+    return HeldIterator(self, iterator)
+
+
+class HeldIterator:
+  """
+  An iterator that gives a slot back exactly once when it ends or is closed,
+  also when the server closes it before the first item.
+  """
+
+  def __init__(self, slots: Slots, iterator: Iterator):
+    self.slots = slots
+    self.iterator = iterator
+    self.held = True
+
+  def __iter__(self) -> Iterator:
+    return self
+
+  def __next__(self):
+    try:
+      return next(self.iterator)
+    except BaseException:
+      self.close()
+      raise
+
+  def close(self) -> None:
+    """
+    Closes the wrapped iterator and gives the slot back.
+    """
+    if self.held:
+      self.held = False
+      self.slots.release()
+      close = getattr(self.iterator, 'close', None)
+      if close is not None:
+        close()
+
+
+def busy(retryafter: int) -> Response:
+  """
+  Returns the answer to a request that is rejected because the server is full.
+
+  Args:
+      retryafter (int): The number of seconds after which the client may retry.
+
+  Returns:
+      Response: 503 Service Unavailable with a Retry-After header.
+  """
+  return Response('Too busy, retry later', status=503, headers={'Retry-After': str(retryafter)})
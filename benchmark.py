@@ -0,0 +1,494 @@
+""" Benchmark: measures the SSL-checker against local stand-ins for DNS and TLS/HTTPS servers """
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import socket
+import socketserver
+import ssl
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, NamedTuple, Optional
+
+import requests
+import urllib3
+from waitress import create_server, wasyncore
+
+import dnsquery
+import dnsresolver
+import httpprobe
+import ratelimit
+import sslcheck
+import tlsprobe
+
+HOST = 'localhost'
+DNSRESOLVERS = 4
+
+
+class Scenario(NamedTuple):
+  """
+  The behaviour of the stand-in servers.
+
+  latency: seconds the TLS server waits before every handshake and HTTP response.
+  dnslatency: seconds the DNS server waits before every answer.
+  failurerate: fraction of TLS connections that are closed before the handshake.
+  tlsversions: the TLS versions the TLS server accepts, keys of tlsprobe.TLSVERSIONS.
+  """
+  latency: float = 0.0
+  dnslatency: float = 0.0
+  failurerate: float = 0.0
+  tlsversions: tuple[str, ...] = ('TLSv1_2', 'TLSv1_3')
+
+
+SCENARIOS = {
+  'baseline': Scenario(),
+  'latency': Scenario(latency=0.02, dnslatency=0.005),
+  'failures': Scenario(failurerate=0.25),
+  'tls12': Scenario(tlsversions=('TLSv1_2',)),
+}
+
+
+class StubDNSHandler(socketserver.BaseRequestHandler):
+  """
+  Answers every A query with 127.0.0.1, every AAAA query with ::1 when the
+  TLS server listens on IPv6, and every other query with an empty answer.
+  """
+
+  def handle(self):
+    data, sock = self.request
+    time.sleep(self.server.latency)
+    qid = struct.unpack_from('!H', data)[0]
+    (_, qtype), offset = dnsresolver.readquestion(data, 1)
+    if qtype == dnsresolver.RECORDTYPES['A']:
+      rdata = socket.inet_aton('127.0.0.1')
+    elif qtype == dnsresolver.RECORDTYPES['AAAA'] and self.server.ipv6:
+      rdata = socket.inet_pton(socket.AF_INET6, '::1')
+    else:
+      rdata = b''
+    response = struct.pack('!HHHHHH', qid, 0x8180, 1, 1 if rdata else 0, 0, 0) + data[12:offset]
+    if rdata:
+      response += b'\xc0\x0c' + struct.pack('!HHIH', qtype, 1, 60, len(rdata)) + rdata
+    sock.sendto(response, self.client_address)
+
+
+class StubTLSHandler(socketserver.BaseRequestHandler):
+  """
+  Completes the TLS handshake with the certificate of the server and answers
+  every HTTP request on the connection with 200 OK.
+  """
+
+  def handle(self):
+    server = self.server
+    time.sleep(server.scenario.latency)
+    with server.lock:
+      fail = server.random.random() < server.scenario.failurerate
+    if fail:
+      return
+    try:
+      conn = server.context.wrap_socket(self.request, server_side=True)
+    except OSError:
+      return
+    with conn:
+      reader = conn.makefile('rb')
+      while True:
+        try:
+          line = reader.readline()
+          while line not in (b'\r\n', b'\n', b''):
+            line = reader.readline()
+        except OSError:
+          return
+        if not line:
+          return
+        time.sleep(server.scenario.latency)
+        conn.sendall(b'HTTP/1.1 200 OK\r\nContent-Length: 2\r\nConnection: keep-alive\r\n\r\nOK')
+
+
+class StubTLSServer(socketserver.ThreadingTCPServer):
+  """
+  A TLS/HTTPS server with the latency, failures and TLS versions of a scenario.
+  """
+  daemon_threads = True
+  allow_reuse_address = True
+
+  def __init__(self, address: tuple, scenario: Scenario, context: ssl.SSLContext, seed: int):
+    self.scenario = scenario
+    self.context = context
+    self.random = random.Random(seed)
+    self.lock = threading.Lock()
+    super().__init__(address, StubTLSHandler)
+
+
+class StubTLSServer6(StubTLSServer):
+  """
+  StubTLSServer on IPv6.
+  """
+  address_family = socket.AF_INET6
+
+
+def makecert(directory: str) -> tuple[str, str]:
+  """
+  Creates a self-signed certificate for localhost with openssl.
+
+  Args:
+      directory (str): The directory to write the certificate and key to.
+
+  Returns:
+      tuple[str, str]: The paths of the certificate and the key.
+  """
+  certfile = os.path.join(directory, 'cert.pem')
+  keyfile = os.path.join(directory, 'key.pem')
+  subprocess.run(['openssl', 'req', '-x509', '-newkey', 'ec',
+                  '-pkeyopt', 'ec_paramgen_curve:prime256v1', '-nodes', '-days', '30',
+                  '-subj', f'/CN={HOST}', '-keyout', keyfile, '-out', certfile,
+                  '-addext', f'subjectAltName=DNS:{HOST},IP:127.0.0.1,IP:::1'],
+                 check=True, capture_output=True)
+  return certfile, keyfile
+
+
+def servercontext(certfile: str, keyfile: str, tlsversions: tuple[str, ...]) -> ssl.SSLContext:
+  """
+  Returns the server context for a set of accepted TLS versions.
+
+  Args:
+      certfile (str): The path of the certificate.
+      keyfile (str): The path of the key.
+      tlsversions (tuple[str, ...]): The accepted TLS versions, keys of tlsprobe.TLSVERSIONS.
+
+  Returns:
+      ssl.SSLContext: The context.
+  """
+  context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+  context.load_cert_chain(certfile, keyfile)
+  versions = sorted(tlsprobe.TLSVERSIONS[ver] for ver in tlsversions)
+  context.minimum_version = versions[0]
+  context.maximum_version = versions[-1]
+  return context
+
+
+def ipv6available() -> bool:
+  """
+  Tells whether localhost resolves to ::1, so the IPv6 probes can reach the TLS server.
+
+  Returns:
+      bool: True if IPv6 can be benchmarked.
+  """
+  try:
+    socket.getaddrinfo(HOST, None, socket.AF_INET6)
+  except socket.gaierror:
+    return False
+  return socket.has_ipv6
+
+
+def startservers(scenario: Scenario, certfile: str, keyfile: str, seed: int) -> list:
+  """
+  Starts the stand-in servers for a scenario and points sslcheck at them.
+
+  Args:
+      scenario (Scenario): The behaviour of the servers.
+      certfile (str): The path of the certificate.
+      keyfile (str): The path of the key.
+      seed (int): The seed of the random failures.
+
+  Returns:
+      list: The servers, to be shut down with stopservers.
+  """
+  context = servercontext(certfile, keyfile, scenario.tlsversions)
+  servers = [StubTLSServer(('127.0.0.1', 0), scenario, context, seed)]
+  port = servers[0].server_address[1]
+  ipv6 = ipv6available()
+  if ipv6:
+    try:
+      servers.append(StubTLSServer6(('::1', port), scenario, context, seed))
+    except OSError:
+      ipv6 = False
+  resolvers = []
+  for _ in range(DNSRESOLVERS):
+    dnsserver = socketserver.ThreadingUDPServer(('127.0.0.1', 0), StubDNSHandler)
+    dnsserver.daemon_threads = True
+    dnsserver.latency = scenario.dnslatency
+    dnsserver.ipv6 = ipv6
+    servers.append(dnsserver)
+    resolvers.append(f'127.0.0.1#{dnsserver.server_address[1]}')
+  for server in servers:
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+  tlsprobe.TLSPORT = port
+  dnsquery.dnsbackend = 'wire'
+  dnsquery.dnsserver = resolvers[0]
+  sslcheck.digservers = resolvers
+  return servers
+
+
+def stopservers(servers: list) -> None:
+  """
+  Shuts the stand-in servers down.
+
+  Args:
+      servers (list): The servers returned by startservers.
+  """
+  for server in servers:
+    server.shutdown()
+    server.server_close()
+
+
+def stopapi(api, thread: threading.Thread) -> None:
+  """
+  Stops the waitress server of the API. Its sockets are closed by the serving
+  thread itself, between two polls, so the loop never polls a closed socket;
+  the loop then ends and the thread is joined.
+
+  Args:
+      api: The server returned by waitress.create_server.
+      thread (threading.Thread): The thread that runs api.run.
+  """
+  # pylint: disable-next=protected-access
+  api.trigger.pull_trigger(lambda: wasyncore.close_all(api._map))
+  thread.join()
+  api.task_dispatcher.shutdown()
+
+
+def resetstate(certfile: str) -> None:
+  """
+  Empties the caches, connection pools and resolver health of sslcheck, turns
+  the rate limits off (all stand-ins share 127.0.0.1) and makes its TLS contexts
+  trust the self-signed certificate.
+
+  Args:
+      certfile (str): The path of the certificate.
+  """
+  dnsquery.dnscache.clear()
+  sslcheck.probecache.clear()
+  dnsquery.health.clear()
+  ratelimit.limiter = ratelimit.RateLimiter({})
+  tlsprobe.tlssessions.clear()
+  tlsprobe.tlscontexts.clear()
+  for version in [None, *tlsprobe.TLSVERSIONS]:
+    tlsprobe.tlscontext(version).load_verify_locations(certfile)
+  with httpprobe.httpsessionslock:
+    for session in httpprobe.httpsessions.values():
+      session.close()
+    httpprobe.httpsessions.clear()
+
+
+def percentile(values: list[float], fraction: float) -> float:
+  """
+  Returns a percentile of sorted values with the nearest-rank method.
+
+  Args:
+      values (list[float]): The sorted values.
+      fraction (float): The percentile as a fraction, such as 0.99.
+
+  Returns:
+      float: The value at the percentile, 0 for no values.
+  """
+  if not values:
+    return 0.0
+  return values[min(len(values) - 1, max(0, math.ceil(fraction * len(values)) - 1))]
+
+
+def measure(func: Callable[[], object], count: int, concurrency: int) -> dict:
+  """
+  Calls a function count times from concurrency threads and summarizes the latencies.
+
+  Args:
+      func (Callable[[], object]): The function to measure.
+      count (int): The number of calls.
+      concurrency (int): The number of calls at the same time.
+
+  Returns:
+      dict: The number of calls and errors, the p50, p99, mean and maximum latency
+      in seconds and the throughput in calls per second.
+  """
+  def timed(_: int) -> Optional[float]:
+    start = time.perf_counter()
+    try:
+      func()
+    except Exception:  # pylint: disable=broad-exception-caught
+      return None
+    return time.perf_counter() - start
+
+  start = time.perf_counter()
+  with ThreadPoolExecutor(max_workers=concurrency) as executor:
+    results = list(executor.map(timed, range(count)))
+  elapsed = time.perf_counter() - start
+  latencies = sorted(result for result in results if result is not None)
+  return {'count': count,
+          'errors': count - len(latencies),
+          'p50': round(percentile(latencies, 0.5), 6),
+          'p99': round(percentile(latencies, 0.99), 6),
+          'mean': round(sum(latencies) / len(latencies), 6) if latencies else 0.0,
+          'max': round(latencies[-1], 6) if latencies else 0.0,
+          'throughput': round(count / elapsed, 2) if elapsed > 0 else 0.0}
+
+
+def apicalls(baseurl: str) -> dict[str, Callable[[], object]]:
+  """
+  Returns the HTTP API calls to measure against a running server.
+
+  Args:
+      baseurl (str): The URL of the server, such as http://127.0.0.1:8082.
+
+  Returns:
+      dict[str, Callable[[], object]]: The calls by benchmark name.
+  """
+  local = threading.local()
+
+  def session() -> requests.Session:
+    if not hasattr(local, 'session'):
+      local.session = requests.Session()
+    return local.session
+
+  def post() -> None:
+    response = session().post(f'{baseurl}/sslcheck',
+                              headers={'Apikey': sslcheck.secretapikey, 'Hostname': HOST,
+                                       'Cache-Control': 'no-cache'}, timeout=60)
+    response.raise_for_status()
+
+  def digall() -> None:
+    response = session().get(f'{baseurl}/sslcheck/digall/{HOST}',
+                             headers={'Cache-Control': 'no-cache'}, timeout=60)
+    response.raise_for_status()
+
+  return {'api_sslcheckpost': post, 'api_sslcheckdigallget': digall}
+
+
+def runscenario(scenario: Scenario, count: int, concurrency: int, seed: int,
+                certfile: str, keyfile: str) -> dict[str, dict]:
+  """
+  Measures the probe functions and the HTTP API in one scenario.
+
+  The caches are bypassed, so every call probes the stand-in servers.
+
+  Args:
+      scenario (Scenario): The behaviour of the stand-in servers.
+      count (int): The number of calls per benchmark.
+      concurrency (int): The number of calls at the same time.
+      seed (int): The seed of the random failures.
+      certfile (str): The path of the certificate.
+      keyfile (str): The path of the key.
+
+  Returns:
+      dict[str, dict]: The results of measure by benchmark name.
+  """
+  # pylint: disable=too-many-arguments,too-many-positional-arguments
+  servers = startservers(scenario, certfile, keyfile, seed)
+  api = create_server(sslcheck.app, host='127.0.0.1', port=0, threads=concurrency)
+  apithread = threading.Thread(target=api.run, daemon=True)
+  apithread.start()
+  try:
+    resetstate(certfile)
+    calls = {
+      'dodigall': lambda: dnsquery.dodigall(HOST, sslcheck.digtypes, usecache=False),
+      'getsslinfo': lambda: sslcheck.getsslinfo(HOST, 'ipv4', None, '127.0.0.1'),
+      'gethttpstatus': lambda: sslcheck.gethttpstatus(HOST, '127.0.0.1'),
+      'getinfo': lambda: sslcheck.getinfo(HOST, usecache=False),
+      **apicalls(f'http://127.0.0.1:{api.effective_port}'),
+    }
+    results = {}
+    for name, func in calls.items():
+      func()
+      results[name] = measure(func, count, concurrency)
+    return results
+  finally:
+    stopapi(api, apithread)
+    stopservers(servers)
+
+
+def gitcommit() -> Optional[str]:
+  """
+  Returns the commit of the working tree, so results can be compared across commits.
+
+  Returns:
+      Optional[str]: The commit hash, or None outside a git checkout.
+  """
+  try:
+    result = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                            check=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+  except (OSError, subprocess.CalledProcessError):
+    return None
+  return result.stdout.strip()
+
+
+def compare(baseline: dict, current: dict, threshold: float) -> list[str]:
+  """
+  Compares the p50 and p99 latencies of two benchmark results.
+
+  Args:
+      baseline (dict): The earlier result of the benchmark.
+      current (dict): The new result.
+      threshold (float): The ratio new/old above which a latency is a regression.
+
+  Returns:
+      list[str]: A line per regression.
+  """
+  regressions = []
+  for scenario, benchmarks in current['results'].items():
+    for name, stats in benchmarks.items():
+      old = baseline.get('results', {}).get(scenario, {}).get(name)
+      if old is None:
+        continue
+      for key in ('p50', 'p99'):
+        if old[key] > 0 and stats[key] / old[key] > threshold:
+          regressions.append(f'{scenario}/{name} {key}: {old[key]:.6f}s -> {stats[key]:.6f}s')
+  return regressions
+
+
+def main(argv: list[str] = None) -> int:
+  """
+  Parses the command line, runs the benchmarks and writes the results as JSON.
+
+  Args:
+      argv (list[str]): The command line arguments, defaults to sys.argv[1:].
+
+  Returns:
+      int: The exit code, 1 when --compare finds a regression.
+  """
+  parser = argparse.ArgumentParser(description='Benchmark the SSL-checker against local servers.')
+  parser.add_argument('-s', '--scenario', action='append', choices=sorted(SCENARIOS),
+                      help='scenario to run, can be repeated (default all)')
+  parser.add_argument('-n', '--count', type=int, default=200,
+                      help='number of calls per benchmark (default 200)')
+  parser.add_argument('-c', '--concurrency', type=int, default=8,
+                      help='number of calls at the same time (default 8)')
+  parser.add_argument('--seed', type=int, default=1, help='seed of the random failures (default 1)')
+  parser.add_argument('-o', '--output', help='file to write the JSON results to (default stdout)')
+  parser.add_argument('--compare',
+                      help='earlier JSON results to compare the p50 and p99 latencies with')
+  parser.add_argument('--threshold', type=float, default=1.25,
+                      help='ratio new/old that counts as a regression (default 1.25)')
+  args = parser.parse_args(argv)
+  urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+  result = {'commit': gitcommit(),
+            'python': platform.python_version(),
+            'timestamp': int(time.time()),
+            'settings': {'count': args.count, 'concurrency': args.concurrency, 'seed': args.seed},
+            'results': {}}
+  with tempfile.TemporaryDirectory() as directory:
+    certfile, keyfile = makecert(directory)
+    for name in args.scenario or SCENARIOS:
+      print(f'scenario {name}', file=sys.stderr)
+      result['results'][name] = runscenario(SCENARIOS[name], args.count, args.concurrency,
+                                            args.seed, certfile, keyfile)
+  text = json.dumps(result, indent=2)
+  if args.output:
+    with open(args.output, 'w', encoding='utf-8') as outputfile:
+      outputfile.write(text + '\n')
+  else:
+    print(text)
+  if args.compare:
+    with open(args.compare, encoding='utf-8') as baselinefile:
+      regressions = compare(json.load(baselinefile), result, args.threshold)
+    for line in regressions:
+      print(f'regression {line}', file=sys.stderr)
+    return 1 if regressions else 0
+  return 0
+
+
+if __name__ == '__main__':
+  sys.exit(main())
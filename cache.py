@@ -0,0 +1,107 @@
+""" In-memory cache with a time-to-live per entry and LRU eviction """
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+
+from cachestore import CacheStore
+
+
+class TTLCache:
+  """
+  A thread-safe cache where every entry expires after its own time-to-live.
+
+  The cache holds at most `maxsize` entries; when it is full the least recently
+  used entry is evicted. A `maxsize` of 0 disables the cache. Lookups are
+  counted as hits or misses. With persist the entries are also kept in a
+  CacheStore, so they survive a restart.
+  """
+
+  def __init__(self, maxsize: int):
+    self.maxsize = maxsize
+    self.entries: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+    self.lock = threading.Lock()
+    self.hits = 0
+    self.misses = 0
+    self.store: Optional[CacheStore] = None
+    self.name = ''
+
+  def persist(self, store: CacheStore, name: str) -> int:
+    """
+    Loads the fresh entries of this cache from a store and writes every later
+    entry to it.
+
+    Args:
+        store (CacheStore): The store.
+        name (str): The name of this cache in the store.
+
+    Returns:
+        int: The number of entries loaded.
+    """
+    entries = store.load(name)
+    for key, value, ttl in entries:
+      self.put(key, value, ttl)
+    self.store, self.name = store, name
+    return len(entries)
+
+  def get(self, key: Hashable) -> tuple[bool, Any]:
+    """
+    Looks up a key. Expired entries count as a miss and are removed.
+
+    Args:
+        key (Hashable): The key to look up.
+
+    Returns:
+        tuple[bool, Any]: Whether a fresh entry was found, and its value.
+    """
+    with self.lock:
+      entry = self.entries.get(key)
+      if entry is not None and entry[0] > time.monotonic():
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return True, entry[1]
+      if entry is not None:
+        del self.entries[key]
+      self.misses += 1
+      return False, None
+
+  def put(self, key: Hashable, value: Any, ttl: float) -> None:
+    """
+    Stores a value for ttl seconds. Values with a ttl of 0 or less are not stored.
+
+    Args:
+        key (Hashable): The key to store the value under.
+        value (Any): The value to store.
+        ttl (float): The number of seconds the value stays fresh.
+    """
+    if self.maxsize <= 0 or ttl <= 0:
+      return
+    with self.lock:
+      self.entries[key] = (time.monotonic() + ttl, value)
+      self.entries.move_to_end(key)
+      while len(self.entries) > self.maxsize:
+        self.entries.popitem(last=False)
+    if self.store is not None:
+      self.store.put(self.name, key, value, ttl)
+
+  def clear(self) -> None:
+    """
+    Removes all entries, also from the store, and resets the counters.
+    """
+    with self.lock:
+      self.entries.clear()
+      self.hits = 0
+      self.misses = 0
+    if self.store is not None:
+      self.store.clear(self.name)
+
+  def stats(self) -> dict[str, int]:
+    """
+    Returns the counters of the cache.
+
+    Returns:
+        dict[str, int]: The number of hits, misses and entries, and the maximum size.
+    """
+    with self.lock:
+      return {'hits': self.hits, 'misses': self.misses,
+              'size': len(self.entries), 'maxsize': self.maxsize}
@@ -0,0 +1,164 @@
+""" On-disk snapshot of the caches in SQLite, so a restarted process starts warm """
+import json
+import sqlite3
+import threading
+import time
+from typing import Any, Hashable, Optional
+
+
+def encodekey(key: Hashable) -> str:
+  """
+  Encodes a cache key as JSON.
+
+  Args:
+      key (Hashable): The key, a string or a tuple of strings.
+
+  Returns:
+      str: The JSON text of the key.
+  """
+  return json.dumps(key)
+
+
+def decodekey(text: str) -> Hashable:
+  """
+  Decodes a cache key stored by encodekey; JSON arrays become tuples again.
+
+  Args:
+      text (str): The JSON text of the key.
+
+  Returns:
+      Hashable: The key.
+  """
+  key = json.loads(text)
+  return tuple(key) if isinstance(key, list) else key
+
+
+class BackgroundWriter:
+  """
+  A SQLite database in WAL mode whose writes are collected in memory and written
+  every `interval` seconds by a background thread. Subclasses implement flush,
+  which writes the queued writes in one transaction.
+  """
+  # The name of the background thread.
+  threadname = 'writer'
+
+  def __init__(self, dbpath: str, interval: float = 1.0):
+    self.interval = interval
+    self.lock = threading.Lock()
+    self.dblock = threading.Lock()
+    self.db = sqlite3.connect(dbpath, check_same_thread=False)
+    self.db.execute('PRAGMA journal_mode=WAL')
+    self.db.execute('PRAGMA synchronous=NORMAL')
+    self.stopping = threading.Event()
+    self.thread: Optional[threading.Thread] = None
+
+  def flush(self) -> None:
+    """
+    Writes the queued writes in one transaction.
+    """
+    raise NotImplementedError
+
+  def run(self) -> None:
+    """
+    Writes the queued writes every `interval` seconds until stop is called.
+    """
+    while not self.stopping.wait(self.interval):
+      self.flush()
+    self.flush()
+
+  def start(self) -> None:
+    """
+    Starts the background writer.
+    """
+    self.thread = threading.Thread(target=self.run, name=self.threadname, daemon=True)
+    self.thread.start()
+
+  def stop(self) -> None:
+    """
+    Stops the background writer after a last write and closes the database.
+    """
+    self.stopping.set()
+    if self.thread is not None:
+      self.thread.join()
+    else:
+      self.flush()
+    self.db.close()
+
+
+class CacheStore(BackgroundWriter):
+  """
+  Keeps the entries of one or more TTLCaches in a SQLite database.
+
+  Writes are collected in memory and written every `interval` seconds in one
+  transaction by a background thread, so a cache hit or miss never waits for the
+  disk. The database runs in WAL mode: a transaction is either completely in the
+  file or not at all, so a `kill -9` loses at most the writes of the last
+  interval and never corrupts the snapshot. Entries store their expiry as a UNIX
+  timestamp, so after a restart only the remaining time-to-live is used.
+  """
+
+  threadname = 'cachestore'
+
+  def __init__(self, dbpath: str, interval: float = 1.0):
+    super().__init__(dbpath, interval)
+    self.pending: dict[tuple[str, str], tuple[float, str]] = {}
+    self.db.execute('CREATE TABLE IF NOT EXISTS cache (name TEXT, key TEXT, expires REAL, '
+                    'value TEXT, PRIMARY KEY (name, key))')
+    self.db.commit()
+
+  def load(self, name: str) -> list[tuple[Hashable, Any, float]]:
+    """
+    Reads the entries of a cache that have not expired.
+
+    Args:
+        name (str): The name of the cache.
+
+    Returns:
+        list[tuple[Hashable, Any, float]]: The key, value and remaining
+        time-to-live in seconds of every entry, the longest-lived last.
+    """
+    now = time.time()
+    with self.dblock:
+      rows = self.db.execute('SELECT key, expires, value FROM cache WHERE name = ? AND expires > ? '
+                             'ORDER BY expires', (name, now)).fetchall()
+    return [(decodekey(key), json.loads(value), expires - now) for key, expires, value in rows]
+
+  def put(self, name: str, key: Hashable, value: Any, ttl: float) -> None:
+    """
+    Queues an entry for the next write.
+
+    Args:
+        name (str): The name of the cache.
+        key (Hashable): The key of the entry.
+        value (Any): The value, which must be JSON serializable; tuples come back as lists.
+        ttl (float): The number of seconds the value stays fresh.
+    """
+    text = json.dumps(value)
+    with self.lock:
+      self.pending[(name, encodekey(key))] = (time.time() + ttl, text)
+
+  def flush(self) -> None:
+    """
+    Writes the queued entries in one transaction and removes expired entries.
+    New entries can be queued while the transaction runs.
+    """
+    with self.dblock, self.db:
+      with self.lock:
+        pending, self.pending = self.pending, {}
+      self.db.executemany('INSERT OR REPLACE INTO cache (name, key, expires, value) '
+                          'VALUES (?, ?, ?, ?)',
+                          [(name, key, expires, value)
+                           for (name, key), (expires, value) in pending.items()])
+      self.db.execute('DELETE FROM cache WHERE expires <= ?', (time.time(),))
+
+  def clear(self, name: str) -> None:
+    """
+    Removes all entries of a cache, queued and written.
+
+    Args:
+        name (str): The name of the cache.
+    """
+    with self.dblock, self.db:
+      with self.lock:
+        self.pending = {entry: value for entry, value in self.pending.items() if entry[0] != name}
+      self.db.execute('DELETE FROM cache WHERE name = ?', (name,))
@@ -0,0 +1,213 @@
+""" Content hashes per host and section, and a feed of the sections that changed """
+import json
+import time
+from typing import Iterable, Iterator, Optional
+
+from cachestore import BackgroundWriter
+from deadline import TIMEDOUT
+from recordset import etag, normalize
+from resolverhealth import SKIPPED
+
+# Sections with these markers are incomplete; they are not compared or stored.
+INCOMPLETE = (TIMEDOUT, SKIPPED)
+
+
+def complete(data) -> bool:
+  """
+  Tells whether a section is complete, i.e. nothing in it timed out or was skipped.
+
+  Args:
+      data: The content of the section.
+
+  Returns:
+      bool: False if a 'timed out' or 'skipped' marker occurs anywhere in it.
+  """
+  if isinstance(data, dict):
+    return all(complete(value) for value in data.values())
+  if isinstance(data, list):
+    return all(complete(value) for value in data)
+  return data not in INCOMPLETE
+
+
+def infosections(result: dict) -> dict[str, dict]:
+  """
+  Splits a getinfo result into the sections of the change feed.
+
+  Args:
+      result (dict): The result of getinfo.
+
+  Returns:
+      dict[str, dict]: 'addresses' with the sorted addresses per IP version,
+      'cert' and 'tls' with the certificate and TLS versions per address. A
+      failed check or an IP version that timed out gives no sections.
+  """
+  ipresponses = result.get('ipresponses', {})
+  if 'error' in result or any('error' in ipdata for ipdata in ipresponses.values()):
+    return {}
+  sections: dict[str, dict] = {'addresses': {}, 'cert': {}, 'tls': {}}
+  for ipversion, ipdata in sorted(ipresponses.items()):
+    addresses = ipdata.get('addresses', [])
+    sections['addresses'][ipversion] = sorted(address['ip'] for address in addresses)
+    for address in addresses:
+      sections['cert'][address['ip']] = address['cert']
+      sections['tls'][address['ip']] = address['tls']
+  return sections
+
+
+def dnssection(resolver: Optional[str]) -> str:
+  """
+  Returns the name of the section with the DNS records of a resolver.
+
+  Args:
+      resolver (Optional[str]): The resolver, None for the default resolver.
+
+  Returns:
+      str: 'dns/' followed by the resolver or 'default'.
+  """
+  return f'dns/{resolver or "default"}'
+
+
+class ChangeFeed(BackgroundWriter):
+  """
+  Keeps in SQLite the content hash of every section of every host, and the
+  content itself.
+
+  A section whose hash differs from the stored one gets the next sequence
+  number. A client passes the last sequence number it has seen as cursor and
+  gets only the sections that changed since; a cursor of 0 gives the current
+  state of all hosts. Only the newest version of a section is kept, so a client
+  that polls rarely does not get every version in between.
+
+  The hashes are compared in memory. Changes, and the time a section was last
+  seen, are collected and written every `interval` seconds in one transaction
+  by a background thread (see BackgroundWriter), so a check never waits for the
+  disk.
+  Sections that were not seen for `retention` seconds are removed (0 keeps
+  them); a host that is checked again after that shows up as changed.
+  """
+  threadname = 'changefeed'
+
+  def __init__(self, dbpath: str, interval: float = 1.0, retention: float = 0):
+    super().__init__(dbpath, interval)
+    self.retention = retention
+    self.pending: dict[tuple[str, str], tuple] = {}
+    self.seen: dict[tuple[str, str], float] = {}
+    self.db.execute('CREATE TABLE IF NOT EXISTS changes (host TEXT, section TEXT, hash TEXT, '
+                    'seq INTEGER, changed REAL, seen REAL, data TEXT, PRIMARY KEY (host, section))')
+    self.db.execute('CREATE INDEX IF NOT EXISTS changes_seq ON changes (seq)')
+    self.db.commit()
+    self.seq = self.db.execute('SELECT COALESCE(MAX(seq), 0) FROM changes').fetchone()[0]
+    self.hashes = {(host, section): digest for host, section, digest
+                   in self.db.execute('SELECT host, section, hash FROM changes')}
+
+  def record(self, host: str, sections: dict[str, dict]) -> list[str]:
+    """
+    Compares the sections of a host with the stored hashes and queues the ones
+    that changed. Incomplete sections are ignored, so a timeout is no change.
+
+    Args:
+        host (str): The hostname.
+        sections (dict[str, dict]): The content per section.
+
+    Returns:
+        list[str]: The sections that changed.
+    """
+    host = host.lower()
+    hashes = {section: etag(data) for section, data in sections.items() if complete(data)}
+    if not hashes:
+      return []
+    now = time.time()
+    changed = []
+    with self.lock:
+      for section, digest in hashes.items():
+        key = (host, section)
+        if self.hashes.get(key) == digest:
+          self.seen[key] = now
+          continue
+        self.seq += 1
+        self.hashes[key] = digest
+        self.pending[key] = (digest, self.seq, now, json.dumps(sections[section]))
+        self.seen.pop(key, None)
+        changed.append(section)
+    return changed
+
+  def flush(self) -> None:
+    """
+    Writes the queued changes and times last seen in one transaction and removes
+    the sections that were not seen within the retention. New changes can be
+    queued while the transaction runs.
+    """
+    with self.dblock, self.db:
+      with self.lock:
+        pending, self.pending = self.pending, {}
+        seen, self.seen = self.seen, {}
+      self.db.executemany('INSERT OR REPLACE INTO changes (host, section, hash, seq, changed, '
+                          'seen, data) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                          [(host, section, digest, seq, changed, changed, data)
+                           for (host, section), (digest, seq, changed, data) in pending.items()])
+      self.db.executemany('UPDATE changes SET seen = ? WHERE host = ? AND section = ?',
+                          [(when, host, section) for (host, section), when in seen.items()])
+      if self.retention > 0:
+        cutoff = time.time() - self.retention
+        expired = self.db.execute('SELECT host, section FROM changes WHERE seen < ?',
+                                  (cutoff,)).fetchall()
+        self.db.execute('DELETE FROM changes WHERE seen < ?', (cutoff,))
+        with self.lock:
+          for key in expired:
+            if key not in self.pending and key not in self.seen:
+              self.hashes.pop(key, None)
+
+  def recordinfo(self, result: dict) -> list[str]:
+    """
+    Records the sections of a getinfo result.
+
+    Args:
+        result (dict): The result of getinfo.
+
+    Returns:
+        list[str]: The sections that changed.
+    """
+    return self.record(result['host'], infosections(result))
+
+  def recorddns(self, host: str,
+                answers: Iterable[tuple[Optional[str], dict[str, list[str]]]]
+                ) -> Iterator[tuple[Optional[str], dict[str, list[str]]]]:
+    """
+    Records the DNS records of every resolver while passing them on.
+
+    Args:
+        host (str): The hostname.
+        answers (Iterable[tuple[Optional[str], dict[str, list[str]]]]): The
+            records per resolver as yielded by digresolvers.
+
+    Returns:
+        Iterator[tuple[Optional[str], dict[str, list[str]]]]: The same answers.
+    """
+    for resolver, records in answers:
+      self.record(host, {dnssection(resolver): normalize(records)})
+      yield resolver, records
+
+  def changes(self, cursor: int = 0, limit: int = 1000) -> dict:
+    """
+    Returns the sections that changed after a cursor, after writing the queued
+    changes.
+
+    Args:
+        cursor (int): The sequence number the client has seen. Defaults to 0.
+        limit (int): The maximum number of sections. Defaults to 1000.
+
+    Returns:
+        dict: 'changes' with per changed section the host, section, hash, time
+        of change (UNIX timestamp) and content, in order of change; 'cursor' to
+        pass next time; and 'more', True when more changes are waiting.
+    """
+    self.flush()
+    with self.dblock:
+      rows = self.db.execute('SELECT seq, host, section, hash, changed, data FROM changes '
+                             'WHERE seq > ? ORDER BY seq LIMIT ?', (cursor, limit + 1)).fetchall()
+    more = len(rows) > limit
+    rows = rows[:limit]
+    return {'cursor': rows[-1][0] if rows else cursor, 'more': more,
+            'changes': [{'host': host, 'section': section, 'hash': digest, 'changed': changed,
+                         'data': json.loads(data)}
+                        for _, host, section, digest, changed, data in rows]}
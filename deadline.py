@@ -0,0 +1,57 @@
+""" Deadline for a whole check, shared by all its parts """
+import math
+import time
+from typing import Optional
+
+TIMEDOUT = 'timed out'
+
+
+class Deadline:
+  """
+  The moment a check has to be finished, shared by all its threads.
+
+  Parts of the check wait for each other at most until the deadline and limit
+  their socket timeouts to the time that is left, so unfinished work ends
+  around the deadline. A deadline of 0 seconds or less never expires.
+  """
+
+  def __init__(self, seconds: float = 0):
+    self.end = time.monotonic() + seconds if seconds > 0 else math.inf
+
+  def remaining(self, grace: float = 0.0) -> Optional[float]:
+    """
+    Returns the time left, as a timeout for waiting on futures.
+
+    Args:
+        grace (float): Extra seconds to wait after the deadline, for work that
+            itself stops at the deadline.
+
+    Returns:
+        Optional[float]: The number of seconds left, at least 0, or None
+        for a deadline that never expires.
+    """
+    if self.end == math.inf:
+      return None
+    return max(self.end - time.monotonic() + grace, 0.0)
+
+  def expired(self) -> bool:
+    """
+    Tells whether the deadline has passed.
+
+    Returns:
+        bool: True if no time is left.
+    """
+    return time.monotonic() >= self.end
+
+  def timeout(self, limit: float) -> float:
+    """
+    Returns a socket timeout that ends at the deadline at the latest.
+
+    Args:
+        limit (float): The usual timeout in seconds.
+
+    Returns:
+        float: The smaller of the limit and the time left, at least 1 ms.
+    """
+    remaining = self.remaining()
+    return limit if remaining is None else max(min(limit, remaining), 0.001)
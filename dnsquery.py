@@ -0,0 +1,363 @@
+""" DNS queries with a cache, coalescing and resolver health """
+import math
+import os
+import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from ipaddress import ip_address
+from typing import Iterator, Optional
+
+import pydig
+from dotenv import load_dotenv
+
+import dnsresolver
+import metrics
+import profiling
+import ratelimit
+from cache import TTLCache
+from deadline import TIMEDOUT, Deadline
+from resolverhealth import SKIPPED, ResolverHealth
+from singleflight import SingleFlight
+
+load_dotenv()
+
+digworkers = int(os.getenv('DIGWORKERS', default='16'))
+dnsbackend = os.getenv('DNSBACKEND', default='pydig')
+dnsserver = os.getenv('DNSSERVER', default=dnsresolver.systemnameserver())
+dnstimeout = float(os.getenv('DNSTIMEOUT', default='5'))
+dnscachettl = int(os.getenv('DNSCACHETTL', default='60'))
+dnsnegativettl = int(os.getenv('DNSNEGATIVETTL', default='60'))
+dnscachemaxttl = int(os.getenv('DNSCACHEMAXTTL', default='3600'))
+health = ResolverHealth(float(os.getenv('RESOLVERFAILURERATE', default='0.5')),
+                        float(os.getenv('RESOLVERCOOLDOWN', default='60')), dnstimeout)
+dnscache = TTLCache(int(os.getenv('DNSCACHESIZE', default='10000')))
+
+DNSIPVERSIONS = {'A': 'ipv4', 'AAAA': 'ipv6'}
+
+digpool = ThreadPoolExecutor(max_workers=digworkers, thread_name_prefix='dig')
+# Identical DNS queries that run at the same time are done once.
+dnsflights = SingleFlight('dns')
+
+
+def querydns(host: str, types: list[str], resolver: str = None,
+             timeout: float = None) -> dict[str, dnsresolver.Answer]:
+  """
+  Executes DNS queries with the configured backend, without using the cache.
+
+  With the 'wire' backend all queries are pipelined on one UDP socket to the
+  resolver (or DNSSERVER) and the TTLs of the answers are used. With the
+  'pydig' backend dig is run per type; dig +short shows no TTLs, so answers get
+  DNSCACHETTL and empty answers DNSNEGATIVETTL.
+
+  A query to a given resolver first waits for the rate limit of the resolver
+  (one token per record type, see ratelimit), at most the timeout; when that
+  passes, the query is not sent, the types are ['timed out'] and the resolver
+  health is released without counting it. The duration and outcome of a sent
+  query are recorded in the resolver health; a resolver that fails to answer
+  gives empty answers.
+
+  Args:
+      host (str): The hostname or domain to query.
+      types (list[str]): The types of DNS records to query.
+      resolver (str): The IP-address of the DNS-resolver, optionally followed by
+          #port. Defaults to the system resolver.
+      timeout (float): The time in seconds to wait per try. Defaults to DNSTIMEOUT;
+          dig with the system resolver uses its own timeout.
+
+  Returns:
+      dict[str, dnsresolver.Answer]: The answer per record type.
+  """
+  if resolver is not None and ratelimit.limiter.acquire('resolver', resolver, host, len(types),
+                                                        timeout or dnstimeout) is None:
+    health.release(resolver)
+    return {rectype: dnsresolver.Answer([TIMEDOUT], 0, False) for rectype in types}
+  start = time.perf_counter()
+  answers = {}
+  try:
+    with metrics.stage('dns', DNSIPVERSIONS.get(','.join(types), ''), host=host,
+                       resolver=resolver or dnsserver, types=','.join(types)):
+      if dnsbackend == 'wire':
+        address, port = dnsresolver.splitresolver(resolver or dnsserver)
+        answers = dnsresolver.query(host, types, address, port, timeout or dnstimeout)
+      else:
+        answers = {rectype: querypydig(host, rectype, resolver, timeout or dnstimeout)
+                   for rectype in types}
+    return answers
+  finally:
+    if resolver is not None:
+      health.record(resolver, time.perf_counter() - start,
+                    bool(answers) and all(answer.answered for answer in answers.values()))
+
+
+def querypydig(host: str, rectype: str, resolver: Optional[str],
+               timeout: float) -> dnsresolver.Answer:
+  """
+  Executes one DNS query with dig.
+
+  Args:
+      host (str): The hostname or domain to query.
+      rectype (str): The type of DNS record to query.
+      resolver (Optional[str]): The IP-address of the DNS-resolver, None for the
+          system resolver.
+      timeout (float): The time in seconds dig waits per try at the resolver,
+          rounded up to whole seconds.
+
+  Returns:
+      dnsresolver.Answer: The answer; not answered when dig fails.
+  """
+  if resolver is None:
+    values = pydig.query(host, rectype)
+  else:
+    digargs = [f'+time={math.ceil(timeout)}', f'+tries={dnsresolver.TRIES}']
+    try:
+      values = pydig.Resolver(nameservers=[resolver], additional_args=digargs).query(host, rectype)
+    except subprocess.CalledProcessError:
+      return dnsresolver.Answer([], 0, False)
+  return dnsresolver.Answer(values, dnscachettl if values else dnsnegativettl)
+
+
+def dodigall(host: str, types: list[str], resolver: str = None,
+             usecache: bool = True, deadline: Deadline = None) -> dict[str, list[str]]:
+  """
+  Executes DNS queries for several record types of a host at once.
+
+  Answers are taken from the DNS cache, keyed by (resolver, host, record type),
+  while their TTL (capped at DNSCACHEMAXTTL) has not expired; only the missing
+  types are queried. Empty answers are cached as well. A query for the same
+  resolver, host and types that is already running is waited for instead of
+  being sent again.
+
+  A given resolver gets the adaptive timeout of its health, and is not queried
+  while its circuit breaker is open: the missing types are then ['skipped'].
+
+  Args:
+      host (str): The hostname or domain to query.
+      types (list[str]): The types of DNS records to query.
+      resolver (str): The IP-address of the DNS-resolver, optionally followed by
+          #port. Defaults to the system resolver.
+      usecache (bool): Whether cached answers may be used. Fresh answers are
+          always stored in the cache.
+      deadline (Deadline): Limits the timeout of the query. Defaults to no deadline.
+
+  Returns:
+      dict[str, list[str]]: The DNS query results per record type.
+  """
+  records = {}
+  missing = []
+  for rectype in types:
+    found, values = dnscache.get((resolver or dnsserver, host.lower(), rectype)) \
+      if usecache else (False, None)
+    if found:
+      records[rectype] = values
+    else:
+      missing.append(rectype)
+  if missing and resolver is not None and not health.allow(resolver):
+    records.update({rectype: [SKIPPED] for rectype in missing})
+  elif missing:
+    timeout = (deadline or Deadline()).timeout(health.timeout(resolver) if resolver else dnstimeout)
+    flightkey = (resolver or dnsserver, host.lower(), tuple(missing))
+    for rectype, answer in dnsflights.do(flightkey, querydns, host, missing, resolver,
+                                         timeout).items():
+      dnscache.put((resolver or dnsserver, host.lower(), rectype), answer.values,
+                   min(answer.ttl, dnscachemaxttl))
+      records[rectype] = answer.values
+  return {rectype: records[rectype] for rectype in types}
+
+
+def dodig(host: str, recordtype: str, usecache: bool = True,
+          deadline: Deadline = None) -> list[str]:
+  """
+  Executes a DNS query for a specified host and record type and returns the DNS
+  query result.
+
+  This function enables querying DNS records based on a given host and record
+  type, facilitating DNS resolution and record retrieval. It leverages the
+  pydig library to perform the query, or the in-process resolver at DNSSERVER
+  when DNSBACKEND is 'wire'. Answers come from the DNS cache when possible.
+
+  Args:
+      host (str): The hostname or domain to query.
+      recordtype (str): The type of DNS record to query, such as 'A', 'MX', 'TXT', etc.
+      usecache (bool): Whether a cached answer may be used. Defaults to True.
+      deadline (Deadline): The deadline of the check. Defaults to no deadline.
+
+  Returns:
+      list[str]: A list of DNS query results related to the specified host and
+      record type.
+  """
+  return dodigall(host, [recordtype], usecache=usecache, deadline=deadline)[recordtype]
+
+
+def dodigresolver(host: str, recordtype: str, resolver: str, usecache: bool = True,
+                  deadline: Deadline = None) -> list[str]:
+  """
+  Executes a DNS query for a specified host and record type and returns the DNS
+  query result from the supplied resolver.
+
+  This function enables querying DNS records based on a given host and record
+  type, facilitating DNS resolution and record retrieval. It leverages the
+  pydig library to perform the query, or the in-process resolver when
+  DNSBACKEND is 'wire'. Answers come from the DNS cache when possible.
+
+  Args:
+      host (str): The hostname or domain to query.
+      recordtype (str): The type of DNS record to query, such as 'A', 'MX', 'TXT', etc.
+      resolver (str): The IP-address from the DNS-resolver.
+      usecache (bool): Whether a cached answer may be used. Defaults to True.
+      deadline (Deadline): The deadline of the query. Defaults to no deadline.
+
+  Returns:
+      list[str]: A list of DNS query results related to the specified host and record type.
+  """
+  return dodigall(host, [recordtype], resolver, usecache, deadline)[recordtype]
+
+
+def digresolvers(host: str, resolvers: list[Optional[str]], types: list[str],
+                 usecache: bool = True,
+                 deadline: Deadline = None) -> Iterator[tuple[str, dict[str, list[str]]]]:
+  """
+  Queries all record types at all resolvers concurrently and yields the results
+  per resolver as soon as all queries for that resolver are finished.
+
+  The queries run in the dig pool, whose size is set with DIGWORKERS. When the
+  deadline passes, the queries that did not start yet are cancelled and the
+  unfinished resolvers are yielded with ['timed out'] for every unfinished type.
+
+  Args:
+      host (str): The hostname or domain to query.
+      resolvers (list[Optional[str]]): The IP-addresses of the DNS-resolvers, None
+          for the system resolver.
+      types (list[str]): The types of DNS records to query.
+      usecache (bool): Whether cached answers may be used. Defaults to True.
+      deadline (Deadline): The deadline of all queries. Defaults to no deadline.
+
+  Returns:
+      Iterator[tuple[str, dict[str, list[str]]]]: Tuples of the resolver and its
+      non-empty records per record type, in order of completion.
+  """
+  deadline = deadline or Deadline()
+  futures = {}
+  for resolver in resolvers:
+    if dnsbackend == 'wire':
+      future = profiling.submit(digpool, dodigall, host, types, resolver, usecache, deadline)
+      futures[future] = (resolver, None)
+      continue
+    for rectype in types:
+      future = profiling.submit(digpool, dodigresolver, host, rectype, resolver, usecache, deadline)
+      futures[future] = (resolver, rectype)
+  results: dict[str, dict[str, list[str]]] = {resolver: {} for resolver in resolvers}
+  remaining = {resolver: len(types) for resolver in resolvers}
+  try:
+    for future in as_completed(futures, timeout=deadline.remaining()):
+      resolver, rectype = futures[future]
+      if rectype is None:
+        results[resolver] = future.result()
+        remaining[resolver] = 0
+      else:
+        results[resolver][rectype] = future.result()
+        remaining[resolver] -= 1
+      if remaining[resolver] == 0:
+        records = results.pop(resolver)
+        yield resolver, {rectype: records[rectype] for rectype in types if records[rectype]}
+  except FutureTimeoutError:
+    for future in futures:
+      future.cancel()
+    for resolver, records in list(results.items()):
+      yield resolver, {rectype: records.get(rectype, [TIMEDOUT]) for rectype in types
+                       if records.get(rectype, [TIMEDOUT])}
+
+
+def getip4(host: str, usecache: bool = True, deadline: Deadline = None) -> list[str]:
+  """
+  Resolves and retrieves the IPv4 address for a given host.
+
+  Determines the IPv4 address associated with the specified host by using
+  a dedicated function to perform an 'A' record DNS query.
+
+  Parameters:
+      host: str
+          The host for which the IPv4 address is to be resolved.
+      usecache: bool
+          Whether a cached answer may be used. Defaults to True.
+      deadline: Deadline
+          The deadline of the check. Defaults to no deadline.
+
+  Returns:
+      list[str]
+          The IPv4 address for the provided host.
+
+  Raises:
+      Any exceptions that may occur during DNS resolution.
+  """
+  return dodig(host, 'A', usecache, deadline)
+
+
+def getip6(host: str, usecache: bool = True, deadline: Deadline = None) -> list[str]:
+  """
+  Resolves the IPv6 address for a given host.
+
+  This function retrieves the IPv6 address associated with the specified host by
+  performing a DNS query for the 'AAAA' record.
+
+  Args:
+      host (str): The hostname for which the IPv6 address is to be resolved.
+      usecache (bool): Whether a cached answer may be used. Defaults to True.
+      deadline (Deadline): The deadline of the check. Defaults to no deadline.
+
+  Returns:
+      list[str]: List with the IPv6 addresses of the given host.
+  """
+  return dodig(host, 'AAAA', usecache, deadline)
+
+
+def getip(host: str, ipversion: str = 'ipv4', usecache: bool = True,
+          deadline: Deadline = None) -> tuple[bool, list[str]]:
+  """
+  Resolves the IP addresses of a given host based on the specified IP version.
+
+  This function retrieves IP addresses for a hostname based on whether the user
+  requests IPv4 or IPv6 addresses. Only IP literals of the requested version are
+  kept: the CNAME targets that the query returns for an alias are dropped.
+
+  Parameters:
+      host: str
+          The hostname for which to resolve IP addresses.
+      ipversion: str
+          Specifies the IP version, either 'ipv4' or 'ipv6'. Defaults to 'ipv4'.
+      usecache: bool
+          Whether cached answers may be used. Defaults to True.
+      deadline: Deadline
+          The deadline of the check. Defaults to no deadline.
+
+  Returns:
+      tuple[bool, list[str]]
+          A tuple where the first element is a boolean indicating success or
+          failure. The second element is a list of resolved IP addresses. For
+          'ipv4', it contains IPv4 addresses. For 'ipv6', it contains IPv6
+          addresses.
+  """
+  if ipversion == 'ipv4':
+    hostlist = getip4(host, usecache, deadline)
+  elif ipversion == 'ipv6':
+    hostlist = getip6(host, usecache, deadline)
+  else:
+    return False, []
+  return True, [ipaddress for ipaddress in hostlist if isipaddress(ipaddress, ipversion)]
+
+
+def isipaddress(value: str, ipversion: str) -> bool:
+  """
+  Tells whether a value is an IP literal of the given IP version.
+
+  Args:
+      value (str): A value of an A or AAAA answer, such as '192.0.2.1' or a CNAME target.
+      ipversion (str): The IP version, 'ipv4' or 'ipv6'.
+
+  Returns:
+      bool: True for an address of the IP version.
+  """
+  try:
+    return ip_address(value).version == (4 if ipversion == 'ipv4' else 6)
+  except ValueError:
+    return False
@@ -0,0 +1,470 @@
+""" In-process DNS resolver that speaks the DNS wire protocol """
+import base64
+import random
+import socket
+import struct
+import time
+from typing import NamedTuple, Optional
+
+RECORDTYPES = {'A': 1, 'NS': 2, 'CNAME': 5, 'SOA': 6, 'PTR': 12, 'MX': 15, 'TXT': 16,
+               'AAAA': 28, 'DS': 43, 'DNSKEY': 48, 'CAA': 257, }
+EDNSPAYLOAD = 1232
+NEGATIVETTL = 300
+# Response codes with a real answer: NOERROR and NXDOMAIN.
+ANSWERRCODES = (0, 3)
+TRIES = 2
+
+
+class Answer(NamedTuple):
+  """
+  The answer to one DNS query.
+
+  Attributes:
+      values (list[str]): The records formatted like `dig +short` does.
+      ttl (int): The number of seconds the answer may be cached. For an empty
+          answer this is the negative caching time from the SOA record.
+      answered (bool): False when the nameserver did not answer at all.
+  """
+  values: list[str]
+  ttl: int
+  answered: bool = True
+
+
+class Response(NamedTuple):
+  """
+  A parsed DNS response message.
+
+  Attributes:
+      qid (int): The message ID.
+      question (tuple[str, int]): The queried name (lower case) and record type.
+      truncated (bool): Whether the TC bit is set and the query must be retried over TCP.
+      answer (Answer): The formatted records of the answer section.
+  """
+  qid: int
+  question: tuple[str, int]
+  truncated: bool
+  answer: Answer
+
+
+def systemnameserver(resolvconf: str = '/etc/resolv.conf') -> str:
+  """
+  Returns the first nameserver from resolv.conf, or 127.0.0.1 when none is found.
+
+  Args:
+      resolvconf (str): The path of the resolver configuration file.
+
+  Returns:
+      str: The IP-address of the nameserver.
+  """
+  try:
+    with open(resolvconf, encoding='utf-8') as conf:
+      for line in conf:
+        fields = line.split()
+        if len(fields) >= 2 and fields[0] == 'nameserver':
+          return fields[1]
+  except OSError:
+    pass
+  return '127.0.0.1'
+
+
+def splitresolver(resolver: str, port: int = 53) -> tuple[str, int]:
+  """
+  Splits a resolver in the `address#port` notation of dig into address and port.
+
+  Args:
+      resolver (str): The IP-address of the resolver, optionally followed by #port.
+      port (int): The port to use when the resolver has none.
+
+  Returns:
+      tuple[str, int]: The IP-address and the port.
+  """
+  address, _, resolverport = resolver.partition('#')
+  return address, int(resolverport) if resolverport else port
+
+
+def encodename(name: str) -> bytes:
+  """
+  Encodes a domain name as a sequence of length-prefixed labels.
+
+  Args:
+      name (str): The domain name, with or without the trailing dot.
+
+  Returns:
+      bytes: The wire format of the name.
+  """
+  ret = b''
+  for label in name.rstrip('.').split('.'):
+    if label:
+      encoded = label.encode('idna')
+      ret += bytes([len(encoded)]) + encoded
+  return ret + b'\x00'
+
+
+def buildquery(qid: int, host: str, rectype: str) -> bytes:
+  """
+  Builds a recursive query message with an EDNS0 record for larger UDP answers.
+
+  Args:
+      qid (int): The message ID.
+      host (str): The hostname to query.
+      rectype (str): The type of DNS record to query, such as 'A' or 'MX'.
+
+  Returns:
+      bytes: The query message.
+  """
+  header = struct.pack('!HHHHHH', qid, 0x0100, 1, 0, 0, 1)
+  question = encodename(host) + struct.pack('!HH', RECORDTYPES[rectype], 1)
+  opt = b'\x00' + struct.pack('!HHIH', 41, EDNSPAYLOAD, 0, 0)
+  return header + question + opt
+
+
+def readname(data: bytes, offset: int) -> tuple[str, int]:
+  """
+  Reads a possibly compressed domain name from a message.
+
+  Args:
+      data (bytes): The complete message.
+      offset (int): The offset of the name in the message.
+
+  Returns:
+      tuple[str, int]: The name with a trailing dot and the offset after the name.
+  """
+  labels = []
+  end = None
+  jumps = 0
+  while True:
+    length = data[offset]
+    if length & 0xC0 == 0xC0:
+      if end is None:
+        end = offset + 2
+      jumps += 1
+      if jumps > 64:
+        raise ValueError('Compression loop in DNS message')
+      offset = struct.unpack_from('!H', data, offset)[0] & 0x3FFF
+      continue
+    offset += 1
+    if length == 0:
+      break
+    label = data[offset:offset + length].decode('ascii', errors='replace')
+    labels.append(label.replace('.', '\\.'))
+    offset += length
+  return '.'.join(labels) + '.', offset if end is None else end
+
+
+def quotetext(text: bytes) -> str:
+  """
+  Formats a character-string the way dig shows it: quoted and escaped.
+
+  Args:
+      text (bytes): The raw character-string.
+
+  Returns:
+      str: The quoted string.
+  """
+  ret = ''
+  for char in text:
+    if char in (0x22, 0x5C):
+      ret += '\\' + chr(char)
+    elif 0x20 <= char < 0x7F:
+      ret += chr(char)
+    else:
+      ret += f'\\{char:03d}'
+  return f'"{ret}"'
+
+
+def splitchunks(text: str, size: int = 56) -> str:
+  """
+  Splits long hexadecimal or base64 data into space separated chunks like dig.
+
+  Args:
+      text (str): The data to split.
+      size (int): The length of each chunk.
+
+  Returns:
+      str: The chunks separated by spaces.
+  """
+  return ' '.join(text[pos:pos + size] for pos in range(0, len(text), size))
+
+
+def formattxt(rdata: bytes) -> str:
+  """
+  Formats the character-strings of a TXT record.
+
+  Args:
+      rdata (bytes): The record data.
+
+  Returns:
+      str: The quoted strings separated by spaces.
+  """
+  texts = []
+  pos = 0
+  while pos < len(rdata):
+    texts.append(quotetext(rdata[pos + 1:pos + 1 + rdata[pos]]))
+    pos += 1 + rdata[pos]
+  return ' '.join(texts)
+
+
+def formatsoa(data: bytes, offset: int) -> str:
+  """
+  Formats a SOA record as mname, rname and the five timer values.
+
+  Args:
+      data (bytes): The complete message, needed for compressed names.
+      offset (int): The offset of the record data in the message.
+
+  Returns:
+      str: The formatted record data.
+  """
+  mname, pos = readname(data, offset)
+  rname, pos = readname(data, pos)
+  numbers = struct.unpack_from('!IIIII', data, pos)
+  return ' '.join([mname, rname] + [str(number) for number in numbers])
+
+
+def formatrdata(rtype: int, data: bytes, offset: int, rdlength: int) -> str:
+  """
+  Formats the data of a resource record like `dig +short` does.
+
+  Args:
+      rtype (int): The numeric record type.
+      data (bytes): The complete message, needed for compressed names.
+      offset (int): The offset of the record data in the message.
+      rdlength (int): The length of the record data.
+
+  Returns:
+      str: The formatted record data.
+  """
+  # pylint: disable=too-many-return-statements
+  rdata = data[offset:offset + rdlength]
+  if rtype == 1:
+    return socket.inet_ntop(socket.AF_INET, rdata)
+  if rtype == 28:
+    return socket.inet_ntop(socket.AF_INET6, rdata)
+  if rtype in (2, 5, 12):
+    return readname(data, offset)[0]
+  if rtype == 15:
+    return f'{struct.unpack_from("!H", rdata)[0]} {readname(data, offset + 2)[0]}'
+  if rtype == 16:
+    return formattxt(rdata)
+  if rtype == 6:
+    return formatsoa(data, offset)
+  if rtype == 257:
+    taglength = rdata[1]
+    tag = rdata[2:2 + taglength].decode('ascii', errors='replace')
+    return f'{rdata[0]} {tag} {quotetext(rdata[2 + taglength:])}'
+  if rtype == 43:
+    keytag, algorithm, digesttype = struct.unpack_from('!HBB', rdata)
+    return f'{keytag} {algorithm} {digesttype} {splitchunks(rdata[4:].hex().upper())}'
+  if rtype == 48:
+    flags, protocol, algorithm = struct.unpack_from('!HBB', rdata)
+    publickey = splitchunks(base64.b64encode(rdata[4:]).decode())
+    return f'{flags} {protocol} {algorithm} {publickey}'
+  return f'\\# {rdlength} {rdata.hex().upper()}'
+
+
+def readquestion(data: bytes, qdcount: int) -> tuple[tuple[str, int], int]:
+  """
+  Reads the question section of a message.
+
+  Args:
+      data (bytes): The complete message.
+      qdcount (int): The number of questions in the message.
+
+  Returns:
+      tuple[tuple[str, int], int]: The name (lower case) and record type of the
+      last question, and the offset after the question section.
+  """
+  offset = 12
+  question = ('', 0)
+  for _ in range(qdcount):
+    qname, offset = readname(data, offset)
+    question = (qname.lower(), struct.unpack_from('!H', data, offset)[0])
+    offset += 4
+  return question, offset
+
+
+def parseresponse(data: bytes) -> Response:
+  """
+  Parses a DNS response message.
+
+  All records in the answer section are formatted, so a query for an A record of
+  an alias also returns the CNAME records, just like `dig +short`. The TTL of
+  the answer is the lowest TTL of its records; an empty answer gets the
+  negative caching TTL of the SOA record in the authority section. A response
+  code other than NOERROR or NXDOMAIN, such as SERVFAIL or REFUSED, gives an
+  empty answer that is marked as not answered and has a TTL of 0.
+
+  Args:
+      data (bytes): The response message.
+
+  Returns:
+      Response: The parsed response.
+  """
+  qid, flags, qdcount, ancount, nscount, _ = struct.unpack_from('!HHHHHH', data)
+  question, offset = readquestion(data, qdcount)
+  values = []
+  ttls = []
+  for index in range(ancount + nscount):
+    _, offset = readname(data, offset)
+    rtype, _, ttl, rdlength = struct.unpack_from('!HHIH', data, offset)
+    offset += 10
+    if index < ancount:
+      values.append(formatrdata(rtype, data, offset, rdlength))
+      ttls.append(ttl)
+    elif rtype == 6 and not values:
+      ttls.append(min(ttl, struct.unpack_from('!I', data, offset + rdlength - 4)[0]))
+    offset += rdlength
+  if flags & 0x000F not in ANSWERRCODES:
+    answer = Answer([], 0, False)
+  else:
+    answer = Answer(values, min(ttls) if ttls else NEGATIVETTL)
+  return Response(qid, question, bool(flags & 0x0200), answer)
+
+
+def addressfamily(nameserver: str) -> int:
+  """
+  Returns the socket address family of a nameserver address.
+
+  Args:
+      nameserver (str): The IP-address of the nameserver.
+
+  Returns:
+      int: socket.AF_INET6 for IPv6 addresses, socket.AF_INET otherwise.
+  """
+  return socket.AF_INET6 if ':' in nameserver else socket.AF_INET
+
+
+def tcpquery(host: str, rectype: str, nameserver: str, port: int = 53,
+             timeout: float = 5.0) -> Answer:
+  """
+  Queries a single record type over TCP, used when a UDP answer is truncated.
+
+  Args:
+      host (str): The hostname to query.
+      rectype (str): The type of DNS record to query.
+      nameserver (str): The IP-address of the nameserver.
+      port (int): The port of the nameserver.
+      timeout (float): The socket timeout in seconds.
+
+  Returns:
+      Answer: The answer of the nameserver.
+  """
+  message = buildquery(random.randrange(0x10000), host, rectype)
+  with socket.socket(addressfamily(nameserver), socket.SOCK_STREAM) as sock:
+    sock.settimeout(timeout)
+    sock.connect((nameserver, port))
+    sock.sendall(struct.pack('!H', len(message)) + message)
+    length = struct.unpack('!H', recvexact(sock, 2))[0]
+    return parseresponse(recvexact(sock, length)).answer
+
+
+def recvexact(sock: socket.socket, length: int) -> bytes:
+  """
+  Receives exactly length bytes from a stream socket.
+
+  Args:
+      sock (socket.socket): The connected socket.
+      length (int): The number of bytes to receive.
+
+  Returns:
+      bytes: The received bytes.
+
+  Raises:
+      ConnectionError: If the connection closes early.
+  """
+  data = b''
+  while len(data) < length:
+    chunk = sock.recv(length - len(data))
+    if not chunk:
+      raise ConnectionError('DNS connection closed')
+    data += chunk
+  return data
+
+
+def query(host: str, rectypes: list[str], nameserver: str, port: int = 53,
+          timeout: float = 5.0) -> dict[str, Answer]:
+  """
+  Queries several record types for a host with pipelined queries on one UDP socket.
+
+  All queries are sent at once and the answers are collected in any order.
+  Unanswered queries are sent again up to TRIES times; truncated answers are
+  fetched again over TCP. Types that stay unanswered, also when the TCP query
+  fails, get an empty answer that is marked as not answered and has a TTL of 0,
+  so it is not cached. A host that cannot be encoded, such as one with a label
+  longer than 63 characters, is not sent and gives such answers for all types.
+
+  Args:
+      host (str): The hostname to query.
+      rectypes (list[str]): The types of DNS records to query.
+      nameserver (str): The IP-address of the nameserver.
+      port (int): The port of the nameserver.
+      timeout (float): The time in seconds to wait for answers per try.
+
+  Returns:
+      dict[str, Answer]: The answer per record type.
+  """
+  answers: dict[str, Optional[Answer]] = {}
+  pending: dict[int, str] = {}
+  for rectype in dict.fromkeys(rectypes):
+    qid = random.randrange(0x10000)
+    while qid in pending:
+      qid = random.randrange(0x10000)
+    pending[qid] = rectype
+  try:
+    messages = {qid: buildquery(qid, host, rectype) for qid, rectype in pending.items()}
+  except UnicodeError:
+    return {rectype: Answer([], 0, False) for rectype in pending.values()}
+  qname = host.rstrip('.').lower() + '.'
+  with socket.socket(addressfamily(nameserver), socket.SOCK_DGRAM) as sock:
+    sock.connect((nameserver, port))
+    for _ in range(TRIES):
+      for qid in pending:
+        sock.send(messages[qid])
+      receiveanswers(sock, qname, pending, answers, time.monotonic() + timeout)
+      if not pending:
+        break
+  for rectype in pending.values():
+    answers[rectype] = Answer([], 0, False)
+  ret = {}
+  for rectype, answer in answers.items():
+    if answer is None:
+      try:
+        answer = tcpquery(host, rectype, nameserver, port, timeout)
+      except (OSError, struct.error, ValueError, IndexError):
+        answer = Answer([], 0, False)
+    ret[rectype] = answer
+  return ret
+
+
+def receiveanswers(sock: socket.socket, qname: str, pending: dict[int, str],
+                   answers: dict[str, Optional[Answer]], deadline: float) -> None:
+  """
+  Receives answers for pending queries until all are answered or the deadline passes.
+
+  Answered queries are removed from `pending` and stored in `answers`; a
+  truncated answer is stored as None so the caller retries it over TCP.
+
+  Args:
+      sock (socket.socket): The connected UDP socket.
+      qname (str): The queried name in lower case with a trailing dot.
+      pending (dict[int, str]): The record type per unanswered message ID.
+      answers (dict[str, Answer]): The answers received so far.
+      deadline (float): The time.monotonic() value to stop waiting.
+  """
+  while pending:
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+      return
+    sock.settimeout(remaining)
+    try:
+      data = sock.recv(65535)
+      response = parseresponse(data)
+    except socket.timeout:
+      return
+    except (OSError, struct.error, ValueError, IndexError):
+      continue
+    rectype = pending.get(response.qid)
+    if rectype is None or response.question != (qname, RECORDTYPES[rectype]):
+      continue
+    del pending[response.qid]
+    answers[rectype] = None if response.truncated else response.answer
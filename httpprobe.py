@@ -0,0 +1,123 @@
+""" HTTP status probe over pooled sessions per address and host """
+import os
+import threading
+from collections import OrderedDict
+
+import requests
+from dotenv import load_dotenv
+
+import metrics
+import ratelimit
+import tlsprobe
+from deadline import TIMEDOUT, Deadline
+
+load_dotenv()
+
+httpprobemethod = os.getenv('HTTPPROBEMETHOD', default='GET')
+httpdrainlimit = int(os.getenv('HTTPDRAINLIMIT', default='65536'))
+httppoolsize = int(os.getenv('HTTPPOOLSIZE', default='2'))
+httpsessionsmax = int(os.getenv('HTTPSESSIONS', default='256'))
+httpsessions: OrderedDict[tuple[str, str], requests.Session] = OrderedDict()
+httpsessionslock = threading.Lock()
+
+HTTPTIMEOUT = 6.0
+
+
+def httpsession(ipaddress: str, host: str) -> requests.Session:
+  """
+  Returns the pooled HTTP session for an IP address and host.
+
+  At most HTTPSESSIONS sessions are kept; the least recently used one is closed
+  when a new one is needed. Every session keeps at most HTTPPOOLSIZE idle
+  connections to its IP address.
+
+  Parameters:
+  ipaddress: str
+      The IP address the requests are sent to.
+  host: str
+      The host/domain set in the request headers.
+
+  Returns:
+  requests.Session
+      The session.
+  """
+  key = (ipaddress, host.lower())
+  with httpsessionslock:
+    session = httpsessions.get(key)
+    if session is not None:
+      httpsessions.move_to_end(key)
+      return session
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=httppoolsize)
+    session.mount('https://', adapter)
+    httpsessions[key] = session
+    while len(httpsessions) > httpsessionsmax:
+      httpsessions.popitem(last=False)[1].close()
+    return session
+
+
+def gethttpstatus(host: str, ipaddress: str, deadline: Deadline = None) -> str:
+  """
+  Get the HTTP status code for a specified host and IP address.
+
+  This function sends an HTTP request (HTTPPROBEMETHOD, GET by default) to the
+  provided IP address and specifies the `Host` in the headers for the request. It
+  disables SSL verification and applies a timeout of 6 seconds, along with preventing
+  automatic redirects. If the request is successful, it returns the HTTP status code.
+  Otherwise, it handles connection errors and returns a failure message.
+
+  The request first waits for the rate limit of the address (see ratelimit), at
+  most the timeout, so a probe does not hold a worker of the probe pool longer than
+  its request would. The timeout is shortened to the time left before the
+  deadline; a request that times out at the deadline, or is not allowed to start
+  in time, returns 'timed out'.
+
+  Only the status line and headers are read. A body of at most HTTPDRAINLIMIT bytes
+  is read so the connection goes back to the pool of httpsession; a larger or
+  unknown body closes the connection instead of being downloaded.
+
+  Parameters:
+  host: str
+      The host/domain to be set in the request headers.
+  ipaddress: str
+      The IP address where the HTTP GET request is to be sent.
+  deadline: Deadline
+      The deadline of the check. Defaults to no deadline.
+
+  Returns:
+  int or str
+      Returns the HTTP status code as an integer on a successful connection, or the
+      string 'failed to connect' if there is a connection error.
+  """
+  deadline = deadline or Deadline()
+  if deadline.expired():
+    return TIMEDOUT
+  if ratelimit.limiter.acquire('ip', ipaddress.strip('[]'), host,
+                               timeout=deadline.timeout(HTTPTIMEOUT)) is None:
+    return TIMEDOUT
+  with metrics.stage('http', 'ipv6' if ':' in ipaddress else 'ipv4', host=host,
+                     ip=ipaddress) as span:
+    try:
+      headers = {'Host': f'{host}'}
+      url = f'https://{ipaddress}'
+      if tlsprobe.TLSPORT != 443:
+        url += f':{tlsprobe.TLSPORT}'
+      timeout = deadline.timeout(HTTPTIMEOUT)
+      req = httpsession(ipaddress, host).request(httpprobemethod, url, headers=headers,
+                                                 verify=False, timeout=timeout,
+                                                 allow_redirects=False, stream=True)
+    except requests.Timeout:
+      span.outcome = 'timeout'
+      return TIMEDOUT if deadline.expired() else 'failed to connect'
+    except requests.ConnectionError:
+      span.outcome = 'error'
+      return 'failed to connect'
+    try:
+      contentlength = req.headers.get('Content-Length', '')
+      if contentlength.isdigit() and int(contentlength) <= httpdrainlimit:
+        _ = req.content
+    except requests.RequestException:
+      pass
+    finally:
+      req.close()
+    return f'{req.status_code}'
@@ -0,0 +1,108 @@
+""" Background jobs for checks whose result is fetched later """
+import json
+import threading
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Optional
+
+from flask import Response
+
+from cache import TTLCache
+
+PENDING = 'pending'
+DONE = 'done'
+
+
+class JobQueue:
+  """
+  Runs submitted calls in a fixed pool of worker threads, so slow checks do not
+  occupy the request threads of the server. At most `maxjobs` jobs wait or run
+  at once; more are refused. Results are kept for `ttl` seconds to be fetched.
+  """
+
+  def __init__(self, workers: int, maxjobs: int, ttl: float, keep: int = 10000):
+    self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='job')
+    self.maxjobs = maxjobs
+    self.ttl = ttl
+    self.lock = threading.Lock()
+    self.pending: dict[str, Future] = {}
+    self.results = TTLCache(keep)
+
+  def submit(self, func: Callable[..., Any], *args: Any) -> Optional[str]:
+    """
+    Starts a job, unless the queue is full.
+
+    Args:
+        func (Callable[..., Any]): The function to call.
+        *args (Any): The arguments of the call.
+
+    Returns:
+        Optional[str]: The id of the job, or None when the queue is full.
+    """
+    with self.lock:
+      if len(self.pending) >= self.maxjobs:
+        return None
+      jobid = uuid.uuid4().hex
+      future = self.pending[jobid] = self.executor.submit(func, *args)
+    future.add_done_callback(lambda done: self.finish(jobid, done))
+    return jobid
+
+  def finish(self, jobid: str, future: Future) -> None:
+    """
+    Moves the result of a finished job from the pending jobs to the results.
+
+    Args:
+        jobid (str): The id of the job.
+        future (Future): The finished call.
+    """
+    try:
+      result = future.result()
+    except Exception as exc:  # pylint: disable=broad-exception-caught
+      result = {'error': f'{type(exc).__name__}: {exc}'}
+    with self.lock:
+      self.results.put(jobid, result, self.ttl)
+      self.pending.pop(jobid, None)
+
+  def status(self, jobid: str) -> tuple[Optional[str], Any]:
+    """
+    Returns the state of a job.
+
+    Args:
+        jobid (str): The id of the job.
+
+    Returns:
+        tuple[Optional[str], Any]: PENDING and None for a job that waits or runs,
+        DONE and the result for a finished job, and None and None for an unknown
+        or expired job.
+    """
+    with self.lock:
+      if jobid in self.pending:
+        return PENDING, None
+      found, result = self.results.get(jobid)
+    return (DONE, result) if found else (None, None)
+
+  def load(self) -> int:
+    """
+    Returns the number of jobs that wait or run.
+
+    Returns:
+        int: The number of pending jobs.
+    """
+    with self.lock:
+      return len(self.pending)
+
+
+def pendingresponse(jobid: str) -> Response:
+  """
+  Returns the answer for a job that is not finished yet.
+
+  Args:
+      jobid (str): The id of the job.
+
+  Returns:
+      Response: 202 Accepted with the job as JSON, its URL in the Location
+      header and a Retry-After header for polling.
+  """
+  return Response(json.dumps({'job': jobid, 'status': PENDING}), status=202,
+                  mimetype='application/json',
+                  headers={'Location': f'/sslcheck/jobs/{jobid}', 'Retry-After': '1'})
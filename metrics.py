@@ -0,0 +1,246 @@
+""" Prometheus-style metrics for the stages of a check """
+import socket
+import threading
+import time
+from contextlib import contextmanager
+from typing import Iterator
+
+import profiling
+
+DEFAULTBUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class Metric:
+  """
+  Base class of a metric with a fixed set of labels.
+  """
+  kind = ''
+
+  def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()):
+    self.name = name
+    self.documentation = documentation
+    self.labelnames = labelnames
+    self.lock = threading.Lock()
+    self.values: dict[tuple[str, ...], float] = {}
+    REGISTRY.append(self)
+
+  def key(self, labels: dict[str, str]) -> tuple[str, ...]:
+    """
+    Returns the label values in the order of the label names.
+
+    Args:
+        labels (dict[str, str]): The label values by name.
+
+    Returns:
+        tuple[str, ...]: The label values.
+    """
+    return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+  def labeltext(self, key: tuple[str, ...], extra: str = '') -> str:
+    """
+    Formats label values for the exposition format.
+
+    Args:
+        key (tuple[str, ...]): The label values.
+        extra (str): An extra formatted label, such as the le label of a bucket.
+
+    Returns:
+        str: The labels between braces, or an empty string without labels.
+    """
+    pairs = [f'{name}="{value}"' for name, value in zip(self.labelnames, key)]
+    if extra:
+      pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+  def samples(self) -> list[str]:
+    """
+    Returns the sample lines of the metric.
+
+    Returns:
+        list[str]: The lines in the Prometheus text exposition format.
+    """
+    with self.lock:
+      return [f'{self.name}{self.labeltext(key)} {value}'
+              for key, value in sorted(self.values.items())]
+
+  def render(self) -> list[str]:
+    """
+    Returns the HELP, TYPE and sample lines of the metric.
+
+    Returns:
+        list[str]: The lines in the Prometheus text exposition format.
+    """
+    return [f'# HELP {self.name} {self.documentation}',
+            f'# TYPE {self.name} {self.kind}'] + self.samples()
+
+
+class Counter(Metric):
+  """
+  A value that only goes up.
+  """
+  kind = 'counter'
+
+  def inc(self, amount: float = 1, **labels: str) -> None:
+    """
+    Increases the counter.
+
+    Args:
+        amount (float): The amount to add.
+        **labels (str): The label values.
+    """
+    key = self.key(labels)
+    with self.lock:
+      self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Counter):
+  """
+  A value that goes up and down.
+  """
+  kind = 'gauge'
+
+  def dec(self, amount: float = 1, **labels: str) -> None:
+    """
+    Decreases the gauge.
+
+    Args:
+        amount (float): The amount to subtract.
+        **labels (str): The label values.
+    """
+    self.inc(-amount, **labels)
+
+
+def bucketlabel(bound: float or str) -> str:
+  """
+  Formats the le label of a histogram bucket.
+
+  Args:
+      bound (float or str): The upper bound of the bucket, or '+Inf'.
+
+  Returns:
+      str: The formatted label.
+  """
+  return f'le="{bound}"'
+
+
+class Histogram(Metric):
+  """
+  Counts observations in cumulative buckets and keeps their sum and count.
+  """
+  kind = 'histogram'
+
+  def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = (),
+               buckets: tuple[float, ...] = DEFAULTBUCKETS):
+    super().__init__(name, documentation, labelnames)
+    self.buckets = buckets
+    self.counts: dict[tuple[str, ...], list[int]] = {}
+
+  def observe(self, value: float, **labels: str) -> None:
+    """
+    Records an observation.
+
+    Args:
+        value (float): The observed value.
+        **labels (str): The label values.
+    """
+    key = self.key(labels)
+    with self.lock:
+      counts = self.counts.setdefault(key, [0] * (len(self.buckets) + 1))
+      for index, bound in enumerate(self.buckets):
+        if value <= bound:
+          counts[index] += 1
+      counts[-1] += 1
+      self.values[key] = self.values.get(key, 0) + value
+
+  def samples(self) -> list[str]:
+    lines = []
+    with self.lock:
+      for key, counts in sorted(self.counts.items()):
+        for bound, count in zip(self.buckets, counts):
+          lines.append(f'{self.name}_bucket{self.labeltext(key, bucketlabel(bound))} {count}')
+        lines.append(f'{self.name}_bucket{self.labeltext(key, bucketlabel("+Inf"))} {counts[-1]}')
+        lines.append(f'{self.name}_sum{self.labeltext(key)} {self.values[key]}')
+        lines.append(f'{self.name}_count{self.labeltext(key)} {counts[-1]}')
+    return lines
+
+
+REGISTRY: list[Metric] = []
+
+STAGESECONDS = Histogram('sslcheck_stage_duration_seconds', 'Duration of a stage of a check.',
+                         ('stage', 'ipversion', 'outcome'))
+INFLIGHT = Gauge('sslcheck_stage_inflight', 'Number of stages of checks in progress.', ('stage',))
+ERRORS = Counter('sslcheck_stage_errors_total', 'Number of failed stages of checks.',
+                 ('stage', 'ipversion', 'outcome'))
+COALESCED = Counter('sslcheck_coalesced_total',
+                    'Number of calls that waited for an identical call in flight.', ('operation',))
+RATELIMITWAIT = Histogram('sslcheck_ratelimit_wait_seconds',
+                          'Time outgoing probes waited for a rate limit.', ('limit',))
+RATELIMITTIMEOUTS = Counter('sslcheck_ratelimit_timeouts_total',
+                            'Number of outgoing probes that gave up waiting for a rate limit.',
+                            ('limit',))
+
+
+class Span:  # pylint: disable=too-few-public-methods
+  """
+  The outcome of a stage; the code in the stage can set it to 'error' or 'timeout'.
+  """
+
+  def __init__(self):
+    self.outcome = 'ok'
+
+
+@contextmanager
+def stage(name: str, ipversion: str = '', **attrs: str) -> Iterator[Span]:
+  """
+  Measures a stage of a check: its duration, whether it is in progress and its outcome.
+
+  An exception in the stage sets the outcome to 'timeout' for socket timeouts and
+  to 'error' otherwise; the code in the stage can also set the outcome itself.
+  While a request is profiled the stage is also added to its span trace.
+
+  Args:
+      name (str): The name of the stage, such as 'dns', 'connect', 'handshake' or 'http'.
+      ipversion (str): The IP version, 'ipv4' or 'ipv6', or empty when not applicable.
+      **attrs (str): More about the stage for the span trace, such as the host;
+          not used as labels.
+
+  Returns:
+      Iterator[Span]: The span whose outcome is recorded.
+  """
+  span = Span()
+  INFLIGHT.inc(stage=name)
+  start = time.perf_counter()
+  try:
+    yield span
+  except socket.timeout:
+    span.outcome = 'timeout'
+    raise
+  except Exception:
+    span.outcome = 'error'
+    raise
+  finally:
+    seconds = time.perf_counter() - start
+    INFLIGHT.dec(stage=name)
+    STAGESECONDS.observe(seconds, stage=name, ipversion=ipversion, outcome=span.outcome)
+    if span.outcome != 'ok':
+      ERRORS.inc(stage=name, ipversion=ipversion, outcome=span.outcome)
+    profiler = profiling.current.get()
+    if profiler is not None:
+      profiler.span(name, start, seconds, ipversion=ipversion, outcome=span.outcome, **attrs)
+
+
+def render(extra: list[str] = None) -> str:
+  """
+  Returns all metrics in the Prometheus text exposition format.
+
+  Args:
+      extra (list[str]): Extra lines to add, such as cache counters.
+
+  Returns:
+      str: The metrics.
+  """
+  lines = []
+  for metric in REGISTRY:
+    lines.extend(metric.render())
+  lines.extend(extra or [])
+  return '\n'.join(lines) + '\n'
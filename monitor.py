@@ -0,0 +1,260 @@
+""" Background certificate monitor with an expiry-ordered scheduler """
+import heapq
+import json
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Callable, Optional
+
+
+def addresses(result: dict) -> list[dict]:
+  """
+  Returns the probed addresses of all IP versions in a getinfo result.
+
+  Args:
+      result (dict): The result of getinfo.
+
+  Returns:
+      list[dict]: The address entries, each with its own certificate.
+  """
+  return [address for ipdata in result.get('ipresponses', {}).values()
+          for address in ipdata.get('addresses', [])]
+
+
+def validuntil(result: dict) -> Optional[float]:
+  """
+  Returns the earliest end of validity of the certificates of all addresses in
+  a getinfo result.
+
+  Args:
+      result (dict): The result of getinfo.
+
+  Returns:
+      Optional[float]: The end of validity as a UNIX timestamp, or None when no
+      certificate was found.
+  """
+  timestamps = []
+  for address in addresses(result):
+    cert = address.get('cert', {})
+    if 'validuntil' in cert:
+      validdate = datetime.strptime(cert['validuntil'], '%Y-%m-%d %H:%M:%S')
+      timestamps.append(validdate.replace(tzinfo=timezone.utc).timestamp())
+  return min(timestamps) if timestamps else None
+
+
+def failed(result: dict) -> bool:
+  """
+  Tells whether a getinfo result contains a failed probe.
+
+  An IP version without addresses is not a failure; an address without a
+  certificate is, and so is an IP version that timed out.
+
+  Args:
+      result (dict): The result of getinfo.
+
+  Returns:
+      bool: True if the check failed.
+  """
+  if 'error' in result:
+    return True
+  if any('error' in ipdata for ipdata in result.get('ipresponses', {}).values()):
+    return True
+  return any('error' in address.get('cert', {}) for address in addresses(result))
+
+
+class Monitor:
+  """
+  Keeps a registry of watched hosts in SQLite and rechecks them in the background.
+
+  The next check of a host depends on its risk: a failed check is retried after
+  `retry` seconds, doubling with every further failure up to `maxinterval`, and a
+  valid certificate is rechecked after a tenth of its remaining validity, between
+  `mininterval` and `maxinterval` seconds. The scheduler keeps the hosts in a
+  priority queue on their next check time, so probe volume follows risk instead
+  of fleet size.
+  """
+  # pylint: disable=too-many-instance-attributes
+
+  def __init__(self, dbpath: str, probe: Callable[[str], dict], workers: int = 4,
+               mininterval: float = 600, maxinterval: float = 86400, retry: float = 300):
+    # pylint: disable=too-many-arguments,too-many-positional-arguments
+    self.probe = probe
+    self.mininterval = mininterval
+    self.maxinterval = maxinterval
+    self.retry = retry
+    self.lock = threading.Lock()
+    self.wakeup = threading.Condition(self.lock)
+    self.db = sqlite3.connect(dbpath, check_same_thread=False)
+    self.db.execute('PRAGMA journal_mode=WAL')
+    self.db.execute('CREATE TABLE IF NOT EXISTS monitor (host TEXT PRIMARY KEY, '
+                    'nextcheck REAL, lastcheck REAL, failures INTEGER, result TEXT)')
+    self.db.commit()
+    self.nextchecks = dict(self.db.execute('SELECT host, nextcheck FROM monitor'))
+    self.queue = [(nextcheck, host) for host, nextcheck in self.nextchecks.items()]
+    heapq.heapify(self.queue)
+    self.running: set[str] = set()
+    self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='monitor')
+    self.thread: Optional[threading.Thread] = None
+    self.stopping = False
+
+  def add(self, host: str) -> None:
+    """
+    Starts watching a host; it is checked as soon as possible.
+
+    Args:
+        host (str): The hostname.
+    """
+    host = host.lower()
+    with self.lock:
+      if host in self.nextchecks:
+        return
+      now = time.time()
+      self.db.execute('INSERT INTO monitor (host, nextcheck, failures) VALUES (?, ?, 0)',
+                      (host, now))
+      self.db.commit()
+      self.nextchecks[host] = now
+      heapq.heappush(self.queue, (now, host))
+      self.wakeup.notify()
+
+  def remove(self, host: str) -> None:
+    """
+    Stops watching a host and forgets its results.
+
+    Args:
+        host (str): The hostname.
+    """
+    host = host.lower()
+    with self.lock:
+      self.db.execute('DELETE FROM monitor WHERE host = ?', (host,))
+      self.db.commit()
+      self.nextchecks.pop(host, None)
+
+  def hosts(self) -> list[dict]:
+    """
+    Returns the watched hosts with their schedule.
+
+    Returns:
+        list[dict]: Per host the hostname, the times of the last and next check
+        and the number of consecutive failures.
+    """
+    with self.lock:
+      rows = self.db.execute('SELECT host, lastcheck, nextcheck, failures FROM monitor '
+                             'ORDER BY nextcheck').fetchall()
+    return [{'host': host, 'lastcheck': lastcheck, 'nextcheck': nextcheck, 'failures': failures}
+            for host, lastcheck, nextcheck, failures in rows]
+
+  def result(self, host: str) -> Optional[dict]:
+    """
+    Returns the stored result of the last check of a watched host.
+
+    Args:
+        host (str): The hostname.
+
+    Returns:
+        Optional[dict]: The getinfo result with under 'checked' the time of the
+        check (UNIX timestamp), or None if the host is not watched or not checked yet.
+    """
+    with self.lock:
+      row = self.db.execute('SELECT result, lastcheck FROM monitor WHERE host = ?',
+                            (host.lower(),)).fetchone()
+    if row is None or row[0] is None:
+      return None
+    return dict(json.loads(row[0]), checked=row[1])
+
+  def interval(self, result: dict, failures: int, now: float) -> float:
+    """
+    Returns the number of seconds until the next check of a host.
+
+    Args:
+        result (dict): The result of the last check.
+        failures (int): The number of consecutive failed checks, including this one.
+        now (float): The current UNIX timestamp.
+
+    Returns:
+        float: The number of seconds until the next check.
+    """
+    if failures > 0:
+      return min(self.retry * 2 ** (failures - 1), self.maxinterval)
+    until = validuntil(result)
+    if until is None:
+      return self.maxinterval
+    return min(max((until - now) / 10, self.mininterval), self.maxinterval)
+
+  def check(self, host: str) -> None:
+    """
+    Checks a host, stores the result and schedules the next check.
+
+    Args:
+        host (str): The hostname.
+    """
+    try:
+      result = self.probe(host)
+    except Exception as exc:  # pylint: disable=broad-exception-caught
+      result = {'host': host, 'error': f'{type(exc).__name__}: {exc}'}
+    now = time.time()
+    with self.lock:
+      self.running.discard(host)
+      if host not in self.nextchecks:
+        return
+      row = self.db.execute('SELECT failures FROM monitor WHERE host = ?', (host,)).fetchone()
+      failures = row[0] + 1 if failed(result) else 0
+      nextcheck = now + self.interval(result, failures, now)
+      self.db.execute('UPDATE monitor SET nextcheck = ?, lastcheck = ?, failures = ?, result = ? '
+                      'WHERE host = ?', (nextcheck, now, failures, json.dumps(result), host))
+      self.db.commit()
+      self.nextchecks[host] = nextcheck
+      heapq.heappush(self.queue, (nextcheck, host))
+      self.wakeup.notify()
+
+  def duehosts(self, now: float) -> list[str]:
+    """
+    Takes the hosts whose next check is due from the queue.
+
+    Queue entries of removed hosts, or of hosts that were rescheduled since, are
+    skipped. Must be called with the lock held.
+
+    Args:
+        now (float): The current UNIX timestamp.
+
+    Returns:
+        list[str]: The hosts to check now.
+    """
+    due = []
+    while self.queue and self.queue[0][0] <= now:
+      nextcheck, host = heapq.heappop(self.queue)
+      if self.nextchecks.get(host) == nextcheck and host not in self.running:
+        self.running.add(host)
+        due.append(host)
+    return due
+
+  def run(self) -> None:
+    """
+    The scheduler loop: starts the due checks and sleeps until the next one.
+    """
+    with self.lock:
+      while not self.stopping:
+        for host in self.duehosts(time.time()):
+          self.executor.submit(self.check, host)
+        timeout = self.queue[0][0] - time.time() if self.queue else None
+        self.wakeup.wait(timeout)
+
+  def start(self) -> None:
+    """
+    Starts the scheduler in a background thread.
+    """
+    self.thread = threading.Thread(target=self.run, name='monitor', daemon=True)
+    self.thread.start()
+
+  def stop(self) -> None:
+    """
+    Stops the scheduler and waits for running checks.
+    """
+    with self.lock:
+      self.stopping = True
+      self.wakeup.notify()
+    if self.thread is not None:
+      self.thread.join()
+    self.executor.shutdown(wait=True)
+    self.db.close()
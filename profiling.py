@@ -0,0 +1,236 @@
+""" Opt-in profiling of single requests: a cProfile over all threads plus a span trace """
+import cProfile
+import functools
+import json
+import os
+import pstats
+import secrets
+import threading
+import time
+from concurrent.futures import Executor, Future
+from contextvars import ContextVar
+from typing import Any, Callable, Iterable, Optional
+
+from dotenv import load_dotenv
+from flask import Response, make_response, request
+
+load_dotenv()
+
+profileall = os.getenv('PROFILE', default='false').lower() == 'true'
+profiledir = os.getenv('PROFILEDIR', default='profiles')
+
+# The number of functions with the highest cumulative time in the JSON summary.
+TOPFUNCTIONS = 30
+
+
+class Profiler:
+  """
+  Collects the profile and the span trace of one request.
+
+  The request thread and every pool task started for the request with submit
+  run under their own cProfile.Profile; the profiles are merged when the
+  profile is saved. Pool tasks and the stages of metrics.stage add a span with
+  their thread, start (in seconds since the start of the request), duration
+  and arguments.
+  """
+  # pylint: disable=too-many-instance-attributes
+
+  def __init__(self, name: str):
+    self.name = name
+    self.profileid = f'{time.strftime("%Y%m%d-%H%M%S")}-{secrets.token_hex(4)}'
+    self.started = time.time()
+    self.start = time.perf_counter()
+    self.lock = threading.Lock()
+    self.profiles: list[cProfile.Profile] = []
+    self.spans: list[dict] = []
+    self.saved = False
+
+  def span(self, name: str, start: float, seconds: float, **attrs: Any) -> None:
+    """
+    Adds a span to the trace.
+
+    Args:
+        name (str): The name of the stage or function.
+        start (float): The time.perf_counter() value at the start.
+        seconds (float): The duration.
+        **attrs (Any): More about the span, such as the host and the IP address.
+    """
+    span = {'name': name, 'thread': threading.current_thread().name,
+            'start': round(start - self.start, 6), 'seconds': round(seconds, 6), **attrs}
+    with self.lock:
+      self.spans.append(span)
+
+  def run(self, func: Callable, *args: Any, **kwargs: Any) -> Any:
+    """
+    Calls a function with this profiler active in the calling thread.
+
+    Args:
+        func (Callable): The function.
+        *args (Any): Its arguments.
+        **kwargs (Any): Its keyword arguments.
+
+    Returns:
+        Any: The result of the call.
+    """
+    token = current.set(self)
+    profile = cProfile.Profile()
+    try:
+      profile.enable()
+    except ValueError:
+      profile = None
+    try:
+      return func(*args, **kwargs)
+    finally:
+      if profile is not None:
+        profile.disable()
+        with self.lock:
+          self.profiles.append(profile)
+      current.reset(token)
+
+  def task(self, func: Callable, submitted: float, *args: Any) -> Any:
+    """
+    Runs a pool task under this profiler and adds a span for it.
+
+    Args:
+        func (Callable): The function of the task.
+        submitted (float): The time.perf_counter() value when it was submitted.
+        *args (Any): Its arguments.
+
+    Returns:
+        Any: The result of the task.
+    """
+    start = time.perf_counter()
+    try:
+      return self.run(func, *args)
+    finally:
+      self.span(func.__name__, start, time.perf_counter() - start,
+                queued=round(start - submitted, 6),
+                args=[getattr(arg, '__name__', arg) for arg in args
+                      if isinstance(arg, str) or callable(arg)])
+
+  def summary(self, stats: pstats.Stats) -> dict:
+    """
+    Returns the trace of the request with the functions that took most time.
+
+    Args:
+        stats (pstats.Stats): The merged profile.
+
+    Returns:
+        dict: The id, request, start (UNIX timestamp), duration, spans in order of
+        start and the TOPFUNCTIONS functions with the highest cumulative time.
+    """
+    top = sorted(stats.stats.items(), key=lambda item: item[1][3], reverse=True)[:TOPFUNCTIONS]
+    with self.lock:
+      spans = sorted(self.spans, key=lambda span: span['start'])
+    return {'id': self.profileid, 'request': self.name, 'started': self.started,
+            'seconds': round(time.perf_counter() - self.start, 6), 'spans': spans,
+            'top': [{'function': f'{filename}:{line}({func})', 'calls': calls,
+                     'tottime': round(tottime, 6), 'cumtime': round(cumtime, 6)}
+                    for (filename, line, func), (_, calls, tottime, cumtime, _) in top]}
+
+  def save(self) -> None:
+    """
+    Writes the merged profile to PROFILEDIR/<id>.prof (for pstats or snakeviz) and
+    the trace to PROFILEDIR/<id>.json, once.
+    """
+    with self.lock:
+      if self.saved:
+        return
+      self.saved = True
+      profiles = list(self.profiles)
+    stats = pstats.Stats(*profiles) if profiles else pstats.Stats()
+    os.makedirs(profiledir, exist_ok=True)
+    stats.dump_stats(os.path.join(profiledir, f'{self.profileid}.prof'))
+    with open(os.path.join(profiledir, f'{self.profileid}.json'), 'w', encoding='utf-8') as trace:
+      json.dump(self.summary(stats), trace, indent=1)
+
+
+current: ContextVar[Optional[Profiler]] = ContextVar('profiler', default=None)
+
+
+def submit(pool: Executor, func: Callable, *args: Any) -> Future:
+  """
+  Submits a task to a pool; while a request is profiled the task is profiled too.
+
+  Args:
+      pool (Executor): The pool.
+      func (Callable): The function of the task.
+      *args (Any): Its arguments.
+
+  Returns:
+      Future: The future of the task.
+  """
+  profiler = current.get()
+  if profiler is None:
+    return pool.submit(func, *args)
+  return pool.submit(profiler.task, func, time.perf_counter(), *args)
+
+
+class ProfiledIterator:
+  """
+  Runs every step of a streamed response under a profiler and saves the profile
+  when the response is finished or closed.
+  """
+
+  def __init__(self, iterable: Iterable, profiler: Profiler):
+    self.iterable = iterable
+    self.iterator = iter(iterable)
+    self.profiler = profiler
+
+  def __iter__(self) -> 'ProfiledIterator':
+    return self
+
+  def __next__(self) -> Any:
+    try:
+      return self.profiler.run(next, self.iterator)
+    except BaseException:
+      self.profiler.save()
+      raise
+
+  def close(self) -> None:
+    """
+    Closes the wrapped iterable and saves the profile.
+    """
+    try:
+      if hasattr(self.iterable, 'close'):
+        self.iterable.close()
+    finally:
+      self.profiler.save()
+
+
+def profiled(requested: Callable[[], bool]) -> Callable[[Callable], Callable]:
+  """
+  Profiles a view when `requested` returns True for the current request.
+
+  The response gets a Profile-Id header; the profile is saved under that id
+  when the view returns, or for a streamed response when the stream ends. A
+  request that is not profiled only pays for the call of `requested`.
+
+  Args:
+      requested (Callable[[], bool]): Tells whether the current request is profiled.
+
+  Returns:
+      Callable[[Callable], Callable]: The decorator.
+  """
+  def decorator(view: Callable) -> Callable:
+    @functools.wraps(view)
+    def wrapper(*args: Any, **kwargs: Any) -> Any:
+      if not requested():
+        return view(*args, **kwargs)
+      profiler = Profiler(f'{request.method} {request.full_path.rstrip("?")}')
+      try:
+        result = profiler.run(view, *args, **kwargs)
+      except Exception:
+        profiler.save()
+        raise
+      if isinstance(result, Response) and result.is_streamed:
+        result.response = ProfiledIterator(result.response, profiler)
+      elif isinstance(result, (str, bytes, dict, list, tuple, Response)):
+        profiler.save()
+      else:
+        result = ProfiledIterator(result, profiler)
+      response = make_response(result)
+      response.headers['Profile-Id'] = profiler.profileid
+      return response
+    return wrapper
+  return decorator
@@ -0,0 +1,213 @@
+""" Token-bucket rate limits for outgoing probes, fair across the checked hosts """
+import heapq
+import itertools
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from dotenv import load_dotenv
+
+import metrics
+
+load_dotenv()
+
+iprate = float(os.getenv('IPRATE', default='5'))
+ipburst = float(os.getenv('IPBURST', default='10'))
+resolverrate = float(os.getenv('RESOLVERRATE', default='20'))
+resolverburst = float(os.getenv('RESOLVERBURST', default='40'))
+globalrate = float(os.getenv('GLOBALRATE', default='200'))
+globalburst = float(os.getenv('GLOBALBURST', default='200'))
+
+# Buckets of targets that were not used for a while are dropped above this number.
+MAXBUCKETS = 10000
+
+
+class FairBucket:
+  """
+  A token bucket that fills with `rate` tokens per second up to `burst` tokens.
+
+  Waiting callers are served in weighted fair queueing order over their owners
+  (the checked hosts): every owner has its own virtual finish time, so a host
+  with many queued probes only gets its share of the tokens and a host that
+  arrives later does not wait behind all of them.
+  """
+  # pylint: disable=too-many-instance-attributes
+
+  def __init__(self, rate: float, burst: float):
+    self.rate = rate
+    self.burst = max(burst, 1.0)
+    self.tokens = self.burst
+    self.updated = time.monotonic()
+    self.cond = threading.Condition()
+    self.queue: list[list] = []
+    self.finish: dict[str, float] = {}
+    self.vtime = 0.0
+    self.seq = itertools.count()
+
+  def refill(self) -> float:
+    """
+    Adds the tokens for the time since the last refill. The lock must be held.
+
+    Returns:
+        float: The current time.monotonic() value.
+    """
+    now = time.monotonic()
+    self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+    self.updated = now
+    return now
+
+  def head(self) -> Optional[list]:
+    """
+    Returns the first waiter that did not give up. The lock must be held.
+
+    Returns:
+        Optional[list]: The queue entry [tag, sequence number, cancelled, owner], or None.
+    """
+    while self.queue and self.queue[0][2]:
+      heapq.heappop(self.queue)
+    return self.queue[0] if self.queue else None
+
+  def withdraw(self, owner: str, tag: float) -> None:
+    """
+    Takes back the virtual finish time of a waiter that gave up, so the owner is
+    not charged for tokens it never got. The lock must be held.
+
+    Args:
+        owner (str): The owner of the waiter.
+        tag (float): The virtual finish time of the waiter.
+    """
+    if self.finish.get(owner) != tag:
+      return
+    waiting = [entry[0] for entry in self.queue if entry[3] == owner and not entry[2]]
+    if waiting:
+      self.finish[owner] = max(waiting)
+    else:
+      del self.finish[owner]
+
+  def idle(self) -> bool:
+    """
+    Tells whether the bucket is full and nobody waits, so it can be dropped.
+
+    Returns:
+        bool: True if dropping the bucket changes nothing.
+    """
+    with self.cond:
+      self.refill()
+      return self.head() is None and self.tokens >= self.burst
+
+  def acquire(self, owner: str, cost: float = 1.0, timeout: float = None) -> Optional[float]:
+    """
+    Takes tokens, waiting for them in fair order.
+
+    Args:
+        owner (str): The host the probe is for.
+        cost (float): The number of tokens, such as the number of DNS queries.
+        timeout (float): The maximum time to wait in seconds; None waits as long as needed.
+
+    Returns:
+        Optional[float]: The time waited in seconds, or None when the timeout passed first.
+    """
+    cost = min(cost, self.burst)
+    with self.cond:
+      start = self.refill()
+      tag = max(self.vtime, self.finish.get(owner, 0.0)) + cost
+      self.finish[owner] = tag
+      entry = [tag, next(self.seq), False, owner]
+      heapq.heappush(self.queue, entry)
+      while True:
+        now = self.refill()
+        first = self.head() is entry
+        if first and self.tokens >= cost:
+          heapq.heappop(self.queue)
+          self.tokens -= cost
+          self.vtime = tag
+          if self.finish.get(owner) == tag:
+            del self.finish[owner]
+          self.cond.notify_all()
+          return now - start
+        wait = (cost - self.tokens) / self.rate if first else None
+        if timeout is not None:
+          left = start + timeout - now
+          if left <= 0:
+            entry[2] = True
+            self.withdraw(owner, tag)
+            self.cond.notify_all()
+            return None
+          wait = left if wait is None else min(wait, left)
+        self.cond.wait(wait)
+
+
+class RateLimiter:
+  """
+  Limits outgoing probes per destination IP address, per DNS resolver and in
+  total. A probe takes a token from the bucket of its target and then from the
+  global bucket. A rate of 0 turns that limit off.
+  """
+
+  def __init__(self, rates: dict[str, tuple[float, float]]):
+    self.rates = rates
+    self.lock = threading.Lock()
+    self.buckets: OrderedDict[tuple[str, str], FairBucket] = OrderedDict()
+    rate, burst = rates.get('global', (0, 0))
+    self.globalbucket = FairBucket(rate, burst) if rate > 0 else None
+
+  def bucket(self, kind: str, target: str) -> Optional[FairBucket]:
+    """
+    Returns the bucket of a target, created on first use.
+
+    Args:
+        kind (str): The kind of target, 'ip' or 'resolver'.
+        target (str): The IP address or resolver.
+
+    Returns:
+        Optional[FairBucket]: The bucket, or None when this kind is not limited.
+    """
+    rate, burst = self.rates.get(kind, (0, 0))
+    if rate <= 0:
+      return None
+    with self.lock:
+      key = (kind, target)
+      if key in self.buckets:
+        self.buckets.move_to_end(key)
+        return self.buckets[key]
+      while len(self.buckets) >= MAXBUCKETS and next(iter(self.buckets.values())).idle():
+        self.buckets.popitem(last=False)
+      bucket = self.buckets[key] = FairBucket(rate, burst)
+      return bucket
+
+  def acquire(self, kind: str, target: str, owner: str, cost: float = 1.0,
+              timeout: float = None) -> Optional[float]:
+    """
+    Waits until a probe to a target may be sent.
+
+    The waiting time per limit is recorded in sslcheck_ratelimit_wait_seconds,
+    probes that gave up in sslcheck_ratelimit_timeouts_total.
+
+    Args:
+        kind (str): The kind of target, 'ip' or 'resolver'.
+        target (str): The IP address or resolver.
+        owner (str): The host the probe is for, for fair queueing.
+        cost (float): The number of probes. Defaults to 1.
+        timeout (float): The maximum time to wait in seconds; None waits as long as needed.
+
+    Returns:
+        Optional[float]: The total time waited in seconds, or None when the
+        timeout passed first.
+    """
+    waited = 0.0
+    for limit, bucket in ((kind, self.bucket(kind, target)), ('global', self.globalbucket)):
+      if bucket is None:
+        continue
+      seconds = bucket.acquire(owner.lower(), cost, None if timeout is None else timeout - waited)
+      if seconds is None:
+        metrics.RATELIMITTIMEOUTS.inc(limit=limit)
+        return None
+      metrics.RATELIMITWAIT.observe(seconds, limit=limit)
+      waited += seconds
+    return waited
+
+
+limiter = RateLimiter({'ip': (iprate, ipburst), 'resolver': (resolverrate, resolverburst),
+                       'global': (globalrate, globalburst)})
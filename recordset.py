@@ -0,0 +1,95 @@
+""" JSON answers for dig and digall with an ETag over the record sets """
+import functools
+import hashlib
+import json
+from typing import Any, Callable, Iterable, Optional
+
+from flask import Request, Response, make_response
+
+JSONMIMETYPE = 'application/json'
+
+
+def wantsjson(request: Request) -> bool:
+  """
+  Tells whether a client prefers JSON over the HTML page, from its Accept header.
+
+  Args:
+      request (Request): The request.
+
+  Returns:
+      bool: True if application/json is preferred over text/html; a request
+      without Accept header gets HTML.
+  """
+  return request.accept_mimetypes.best_match(['text/html', JSONMIMETYPE]) == JSONMIMETYPE
+
+
+def variesbyaccept(view: Callable) -> Callable:
+  """
+  Adds `Vary: Accept` to the responses of a view that answers HTML or JSON
+  depending on the Accept header, so a shared cache does not give the JSON (or
+  its 304) to a client that asked for HTML, or the other way around.
+
+  Args:
+      view (Callable): The view.
+
+  Returns:
+      Callable: The view with the header added to every response.
+  """
+  @functools.wraps(view)
+  def wrapper(*args: Any, **kwargs: Any) -> Response:
+    response = make_response(view(*args, **kwargs))
+    response.vary.add('Accept')
+    return response
+  return wrapper
+
+
+def normalize(records: dict[str, list[str]]) -> dict[str, list[str]]:
+  """
+  Puts a record set in a fixed order, so the same answers in another order give
+  the same JSON and ETag.
+
+  Args:
+      records (dict[str, list[str]]): The records per record type.
+
+  Returns:
+      dict[str, list[str]]: The record types sorted, each with its records sorted
+      and without duplicates.
+  """
+  return {rectype: sorted(set(records[rectype])) for rectype in sorted(records)}
+
+
+def etag(data: dict) -> str:
+  """
+  Computes the entity tag of a JSON answer.
+
+  Args:
+      data (dict): The normalized answer.
+
+  Returns:
+      str: A hash of the canonical JSON of the answer.
+  """
+  canonical = json.dumps(data, sort_keys=True, separators=(',', ':'))
+  return hashlib.sha256(canonical.encode()).hexdigest()[:32]
+
+
+def digjson(request: Request, host: str,
+            answers: Iterable[tuple[Optional[str], dict[str, list[str]]]]) -> Response:
+  """
+  Returns the records of a host as JSON with an ETag, or 304 Not Modified when
+  the client already has the same records (If-None-Match).
+
+  Args:
+      request (Request): The request, for its If-None-Match header.
+      host (str): The hostname.
+      answers (Iterable[tuple[Optional[str], dict[str, list[str]]]]): The records
+          per resolver as yielded by digresolvers; None for the default resolver.
+
+  Returns:
+      Response: {"host": ..., "resolvers": {resolver: {type: [records]}}} with
+      the resolvers sorted and the default resolver as "default".
+  """
+  resolvers = {resolver or 'default': normalize(records) for resolver, records in answers}
+  data = {'host': host.lower(), 'resolvers': dict(sorted(resolvers.items()))}
+  response = Response(json.dumps(data), mimetype=JSONMIMETYPE)
+  response.set_etag(etag(data))
+  return response.make_conditional(request)
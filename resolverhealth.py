@@ -0,0 +1,140 @@
+""" Health of the DNS resolvers: latency, failure rate and a circuit breaker """
+import threading
+import time
+
+SKIPPED = 'skipped'
+# Weight of the newest query in the moving averages.
+ALPHA = 0.3
+# The adaptive timeout is this many times the average latency, at least MINTIMEOUT.
+TIMEOUTFACTOR = 4.0
+MINTIMEOUT = 0.5
+
+
+class ResolverHealth:
+  """
+  Tracks per resolver an exponentially weighted moving average (EWMA) of the
+  latency of answered queries and of the failure rate.
+
+  The latency sets an adaptive timeout, so a slow resolver does not get the same
+  short timeout as a fast one and a fast one does not hold up a request for the
+  full DNSTIMEOUT. When the failure rate reaches `failurerate` the breaker opens
+  and the resolver is skipped for `cooldown` seconds. After that one query is let
+  through as a trial: an answer closes the breaker, a failure opens it again.
+  """
+
+  def __init__(self, failurerate: float = 0.5, cooldown: float = 60, maxtimeout: float = 5.0):
+    self.maxfailurerate = failurerate
+    self.cooldown = cooldown
+    self.maxtimeout = maxtimeout
+    self.lock = threading.Lock()
+    self.resolvers: dict[str, dict] = {}
+
+  def stats(self, resolver: str) -> dict:
+    """
+    Returns the state of a resolver, created on first use. The lock must be held.
+
+    Args:
+        resolver (str): The resolver.
+
+    Returns:
+        dict: The average latency (None until a query is answered), the failure
+        rate, the number of queries, the time.monotonic() value until which the
+        breaker is open (0 when closed) and whether a trial query is running.
+    """
+    if resolver not in self.resolvers:
+      self.resolvers[resolver] = {'latency': None, 'failurerate': 0.0, 'queries': 0,
+                                  'openuntil': 0.0, 'trial': False}
+    return self.resolvers[resolver]
+
+  def allow(self, resolver: str) -> bool:
+    """
+    Tells whether a query may be sent to a resolver. A caller that gets True
+    must report the outcome of its query with record, or call release when it
+    does not send the query.
+
+    Args:
+        resolver (str): The resolver.
+
+    Returns:
+        bool: False while the breaker is open or a trial query is running.
+    """
+    with self.lock:
+      stats = self.stats(resolver)
+      if not stats['openuntil']:
+        return True
+      if time.monotonic() < stats['openuntil'] or stats['trial']:
+        return False
+      stats['trial'] = True
+      return True
+
+  def timeout(self, resolver: str) -> float:
+    """
+    Returns the timeout for a query to a resolver.
+
+    Args:
+        resolver (str): The resolver.
+
+    Returns:
+        float: TIMEOUTFACTOR times the average latency, between MINTIMEOUT and
+        `maxtimeout`; `maxtimeout` while no query has been answered.
+    """
+    with self.lock:
+      latency = self.stats(resolver)['latency']
+    if latency is None:
+      return self.maxtimeout
+    return min(max(latency * TIMEOUTFACTOR, MINTIMEOUT), self.maxtimeout)
+
+  def record(self, resolver: str, seconds: float, answered: bool) -> None:
+    """
+    Adds the outcome of a query to the averages and opens or closes the breaker.
+
+    Args:
+        resolver (str): The resolver.
+        seconds (float): The duration of the query.
+        answered (bool): Whether all record types were answered.
+    """
+    with self.lock:
+      stats = self.stats(resolver)
+      stats['queries'] += 1
+      stats['failurerate'] = ALPHA * (not answered) + (1 - ALPHA) * stats['failurerate']
+      if answered:
+        stats['latency'] = seconds if stats['latency'] is None \
+          else ALPHA * seconds + (1 - ALPHA) * stats['latency']
+        if stats['trial']:
+          stats['openuntil'] = 0.0
+      elif stats['trial'] or stats['failurerate'] >= self.maxfailurerate:
+        stats['openuntil'] = time.monotonic() + self.cooldown
+      stats['trial'] = False
+
+  def release(self, resolver: str) -> None:
+    """
+    Ends a query that was allowed but not sent, without counting it: a trial
+    query can then be let through again.
+
+    Args:
+        resolver (str): The resolver.
+    """
+    with self.lock:
+      self.stats(resolver)['trial'] = False
+
+  def clear(self) -> None:
+    """
+    Forgets the state of all resolvers.
+    """
+    with self.lock:
+      self.resolvers.clear()
+
+  def snapshot(self) -> dict[str, dict]:
+    """
+    Returns the state of all resolvers that have been queried.
+
+    Returns:
+        dict[str, dict]: Per resolver the average latency in seconds (None when
+        nothing was answered), the failure rate, the number of queries and
+        whether the breaker is open.
+    """
+    now = time.monotonic()
+    with self.lock:
+      return {resolver: {'latency': stats['latency'], 'failurerate': round(stats['failurerate'], 4),
+                         'queries': stats['queries'], 'open': now < stats['openuntil']}
+              for resolver, stats in self.resolvers.items()}
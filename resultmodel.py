@@ -0,0 +1,256 @@
+""" Compact records for check results, with their JSON form and a CSV export """
+import csv
+import json
+import sys
+from typing import Any, Iterable, Iterator, NamedTuple, Optional, TextIO
+
+from tlsprobe import TLSVERSIONS
+
+TLSNAMES = tuple(TLSVERSIONS)
+IPVERSIONS = ('ipv4data', 'ipv6data')
+CSVCOLUMNS = ['host', 'ipversion', 'ip', 'httpreponse', 'CN', 'issuer', 'validuntil', 'certerror',
+              *TLSNAMES, 'error']
+
+
+def intern(value: Any) -> Any:
+  """
+  Interns strings, so the many equal issuers, dates and statuses of a large
+  result set are stored once.
+
+  Args:
+      value (Any): The value.
+
+  Returns:
+      Any: The interned string, or the value itself when it is not a string.
+  """
+  return sys.intern(value) if isinstance(value, str) else value
+
+
+class Cert(NamedTuple):
+  """
+  The certificate of one address; unknown fields are None.
+
+  Attributes:
+      CN (Optional[str]): The common name.
+      issuer (Optional[str]): The common name of the issuer.
+      validuntil (Optional[str]): The end of the validity period.
+      error (Optional[str]): Why no certificate was found.
+  """
+  CN: Optional[str] = None
+  issuer: Optional[str] = None
+  validuntil: Optional[str] = None
+  error: Optional[str] = None
+
+
+class Address(NamedTuple):
+  """
+  The probe results of one address.
+
+  Attributes:
+      ip (str): The IP address.
+      httpreponse (str): The HTTP status or why it failed.
+      cert (Cert): The certificate.
+      tls (tuple): Per TLS version in TLSNAMES order whether it is supported.
+  """
+  ip: str
+  httpreponse: Any
+  cert: Cert
+  tls: tuple
+
+
+class IPData(NamedTuple):
+  """
+  The result of one IP version.
+
+  Attributes:
+      addresses (Optional[tuple[Address, ...]]): The addresses, None when the
+          host has no addresses of this version.
+      error (Optional[str]): Set when the IP version did not finish.
+      timings (Optional[dict]): The timing breakdown, when requested.
+  """
+  addresses: Optional[tuple[Address, ...]] = None
+  error: Optional[str] = None
+  timings: Optional[dict] = None
+
+
+class HostResult(NamedTuple):
+  """
+  The result of getinfo as a tuple instead of nested dicts: the field names are
+  stored once per type instead of once per result, and the strings are interned.
+
+  Attributes:
+      host (str): The hostname.
+      ipresponses (Optional[tuple[IPData, IPData]]): The IPv4 and IPv6 results,
+          None when the check failed before.
+      error (Optional[str]): Why the check failed.
+      timings (Optional[dict]): The total duration, when requested.
+  """
+  host: str
+  ipresponses: Optional[tuple[IPData, IPData]] = None
+  error: Optional[str] = None
+  timings: Optional[dict] = None
+
+
+def compactssl(probes: tuple[dict, dict]) -> tuple[Cert, tuple]:
+  """
+  Converts the certificate and TLS results of getsslinfo to compact form.
+
+  Args:
+      probes (tuple[dict, dict]): The certificate and the TLS versions.
+
+  Returns:
+      tuple[Cert, tuple]: The certificate and the TLS results in TLSNAMES order.
+  """
+  cert, tls = probes
+  return (Cert(*(intern(cert.get(field)) for field in Cert._fields)),
+          tuple(tls.get(version) for version in TLSNAMES))
+
+
+def expandssl(probes: Iterable) -> tuple[dict, dict]:
+  """
+  Converts certificate and TLS results from compact form back to dicts. Lists,
+  as read back from JSON, are accepted as well as tuples.
+
+  Args:
+      probes (Iterable): The certificate and the TLS results.
+
+  Returns:
+      tuple[dict, dict]: The certificate and the TLS versions as getsslinfo gives them.
+  """
+  cert, tls = probes
+  return ({field: value for field, value in zip(Cert._fields, cert) if value is not None},
+          dict(zip(TLSNAMES, tls)))
+
+
+def compactip(ipdata: dict) -> IPData:
+  """
+  Converts the result of one IP version of getipinfo to an IPData.
+
+  Args:
+      ipdata (dict): The result of getipinfo.
+
+  Returns:
+      IPData: The same result in compact form.
+  """
+  addresses = None
+  if 'addresses' in ipdata:
+    addresses = tuple(Address(address['ip'], intern(address['httpreponse']),
+                              *compactssl((address['cert'], address['tls'])))
+                      for address in ipdata['addresses'])
+  return IPData(addresses, ipdata.get('error'), ipdata.get('timings'))
+
+
+def compact(result: dict) -> HostResult:
+  """
+  Converts a getinfo result to a HostResult.
+
+  Args:
+      result (dict): The result of getinfo, batch or the monitor.
+
+  Returns:
+      HostResult: The same result in compact form.
+  """
+  ipresponses = result.get('ipresponses')
+  if ipresponses is not None:
+    ipresponses = tuple(compactip(ipresponses[ipversion]) for ipversion in IPVERSIONS)
+  return HostResult(result.get('host'), ipresponses, result.get('error'), result.get('timings'))
+
+
+def expandaddress(address: Address) -> dict:
+  """
+  Converts the probe results of one address back to a dict.
+
+  Args:
+      address (Address): The compact probe results.
+
+  Returns:
+      dict: The ip, httpreponse, cert and tls of the address.
+  """
+  cert, tls = expandssl((address.cert, address.tls))
+  return {'ip': address.ip, 'httpreponse': address.httpreponse, 'cert': cert, 'tls': tls}
+
+
+def expandip(ipdata: IPData) -> dict:
+  """
+  Converts the result of one IP version back to the dict of getipinfo.
+
+  Args:
+      ipdata (IPData): The compact result.
+
+  Returns:
+      dict: The addresses, error and timings that are set.
+  """
+  data: dict[str, Any] = {}
+  if ipdata.addresses is not None:
+    data['addresses'] = [expandaddress(address) for address in ipdata.addresses]
+  for field in ('error', 'timings'):
+    if getattr(ipdata, field) is not None:
+      data[field] = getattr(ipdata, field)
+  return data
+
+
+def expand(result: HostResult) -> dict:
+  """
+  Converts a HostResult back to the dict of getinfo, as POST /sslcheck returns it.
+
+  Args:
+      result (HostResult): The compact result.
+
+  Returns:
+      dict: The result of getinfo.
+  """
+  data: dict[str, Any] = {'host': result.host}
+  if result.ipresponses is not None:
+    data['ipresponses'] = {ipversion: expandip(ipdata)
+                           for ipversion, ipdata in zip(IPVERSIONS, result.ipresponses)}
+  for field in ('error', 'timings'):
+    if getattr(result, field) is not None:
+      data[field] = getattr(result, field)
+  return data
+
+
+def csvrows(result: HostResult) -> Iterator[list]:
+  """
+  Flattens a result to rows of CSVCOLUMNS: one row per address, one row per IP
+  version that failed, and one row for a host without any of those.
+
+  Args:
+      result (HostResult): The result.
+
+  Returns:
+      Iterator[list]: The rows; missing values are empty.
+  """
+  rows = 0
+  for ipversion, ipdata in zip(IPVERSIONS, result.ipresponses or ()):
+    if ipdata.error is not None:
+      rows += 1
+      yield [result.host, ipversion, *[''] * (len(CSVCOLUMNS) - 3), ipdata.error]
+    for address in ipdata.addresses or ():
+      rows += 1
+      yield [result.host, ipversion, address.ip, address.httpreponse,
+             *('' if value is None else value for value in address.cert),
+             *('' if value is None else value for value in address.tls), '']
+  if not rows:
+    yield [result.host, *[''] * (len(CSVCOLUMNS) - 2), result.error or '']
+
+
+def exportcsv(lines: Iterable[str], output: TextIO) -> int:
+  """
+  Writes the results of a scan as CSV, one JSON line at a time, so a result
+  file of any size can be exported without loading it into memory.
+
+  Args:
+      lines (Iterable[str]): The JSON lines written by scan.py or the batch endpoint.
+      output (TextIO): The file to write the CSV to.
+
+  Returns:
+      int: The number of hosts exported.
+  """
+  writer = csv.writer(output)
+  writer.writerow(CSVCOLUMNS)
+  count = 0
+  for line in lines:
+    if line.strip():
+      writer.writerows(csvrows(compact(json.loads(line))))
+      count += 1
+  return count
@@ -0,0 +1,188 @@
+""" Fleet-scan: runs the SSL-checker over a list of hosts from the command line """
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from typing import Iterable, Iterator, TextIO
+
+import sslcheck
+from resultmodel import exportcsv
+from shard import Coordinator
+
+
+class Throttle:  # pylint: disable=too-few-public-methods
+  """
+  Limits how many calls per second may start, shared by all worker threads.
+
+  A rate of 0 or less means no limit.
+  """
+
+  def __init__(self, rate: float):
+    self.interval = 1.0 / rate if rate > 0 else 0.0
+    self.lock = threading.Lock()
+    self.nextstart = time.monotonic()
+
+  def wait(self) -> None:
+    """
+    Blocks until the next call may start.
+    """
+    if self.interval <= 0:
+      return
+    with self.lock:
+      now = time.monotonic()
+      start = max(now, self.nextstart)
+      self.nextstart = start + self.interval
+    if start > now:
+      time.sleep(start - now)
+
+
+def readhosts(lines: Iterable[str]) -> Iterator[str]:
+  """
+  Yields the hostnames from lines of text, skipping empty lines and comments.
+
+  Args:
+      lines (Iterable[str]): The lines, one hostname per line.
+
+  Returns:
+      Iterator[str]: The hostnames.
+  """
+  for line in lines:
+    host = line.split('#', 1)[0].strip()
+    if host:
+      yield host
+
+
+def readcheckpoint(output: str) -> set[str]:
+  """
+  Returns the hosts that already have a result in the output file.
+
+  Every line of the output file is a complete JSON result, so the output file
+  itself is the checkpoint. A last line that was cut off when the scan was
+  killed is removed, so new results can be appended safely.
+
+  Args:
+      output (str): The path of the output file.
+
+  Returns:
+      set[str]: The hosts that are done.
+  """
+  done = set()
+  if not os.path.exists(output):
+    return done
+  with open(output, 'rb+') as resultfile:
+    goodsize = 0
+    for line in resultfile:
+      if not line.endswith(b'\n'):
+        break
+      try:
+        done.add(json.loads(line)['host'])
+      except (ValueError, KeyError, TypeError):
+        break
+      goodsize += len(line)
+    resultfile.truncate(goodsize)
+  return done
+
+
+def scanhosts(hosts: Iterable[str], output: TextIO, workers: int = 8, rate: float = 0,
+              done: set[str] = None, nodes: list[str] = None) -> int:
+  # pylint: disable=too-many-arguments,too-many-positional-arguments
+  """
+  Runs getinfo for every host that is not done yet and appends each result as
+  one JSON line to the output as soon as it is finished.
+
+  With nodes the hosts are not checked in this process but spread over those
+  sslcheck servers (see shard.Coordinator); workers and rate then do not apply.
+
+  Every line is flushed and synced to disk, so a killed scan loses at most the
+  hosts that were running.
+
+  Args:
+      hosts (Iterable[str]): The hostnames to check.
+      output (TextIO): The file to append the results to.
+      workers (int): The number of hosts checked at once.
+      rate (float): The maximum number of hosts started per second, 0 for no limit.
+      done (set[str]): Hosts to skip because they already have a result.
+      nodes (list[str]): The base URLs of sslcheck servers to run the checks on.
+
+  Returns:
+      int: The number of hosts checked.
+  """
+  done = set() if done is None else done
+  throttle = Throttle(rate)
+
+  def todo() -> Iterator[str]:
+    for host in hosts:
+      if host not in done:
+        done.add(host)
+        yield host
+
+  def check(host: str) -> dict:
+    throttle.wait()
+    return sslcheck.checkhost(host)
+
+  if nodes:
+    results = Coordinator(nodes, sslcheck.secretapikey).run(todo())
+  else:
+    results = sslcheck.runbounded(check, todo(), workers)
+  count = 0
+  for result in results:
+    output.write(json.dumps(result) + '\n')
+    output.flush()
+    os.fsync(output.fileno())
+    count += 1
+  return count
+
+
+def main(argv: list[str] = None) -> int:
+  """
+  Parses the command line and runs the scan.
+
+  Args:
+      argv (list[str]): The command line arguments, defaults to sys.argv[1:].
+
+  Returns:
+      int: The exit code.
+  """
+  parser = argparse.ArgumentParser(description='Check the certificates of a list of hosts.')
+  parser.add_argument('input', nargs='?', default='-',
+                      help='file with one hostname per line, - for stdin (default)')
+  parser.add_argument('-o', '--output', required=True,
+                      help='file to append the JSON lines to; an existing file is resumed')
+  parser.add_argument('-w', '--workers', type=int, default=sslcheck.batchworkers,
+                      help='number of hosts checked at once (default BATCHWORKERS)')
+  parser.add_argument('-r', '--rate', type=float, default=0,
+                      help='maximum number of hosts started per second (default no limit)')
+  parser.add_argument('-n', '--nodes', default=os.getenv('SHARDNODES', default=''),
+                      help='comma separated base URLs of sslcheck servers to spread the hosts '
+                           'over (default SHARDNODES, empty checks locally)')
+  parser.add_argument('--csv',
+                      help='afterwards export all results in the output file to this CSV file')
+  args = parser.parse_args(argv)
+  done = readcheckpoint(args.output)
+  nodes = [node for node in args.nodes.replace(' ', '').split(',') if node]
+  if sslcheck.changedb and not nodes:
+    sslcheck.changefeed = sslcheck.openchangefeed(sslcheck.changedb)
+  try:
+    with open(args.output, 'a', encoding='utf-8') as output:
+      if args.input == '-':
+        count = scanhosts(readhosts(sys.stdin), output, args.workers, args.rate, done, nodes)
+      else:
+        with open(args.input, encoding='utf-8') as hostfile:
+          count = scanhosts(readhosts(hostfile), output, args.workers, args.rate, done, nodes)
+  finally:
+    if sslcheck.changefeed is not None:
+      sslcheck.changefeed.stop()
+      sslcheck.changefeed = None
+  print(f'{count} hosts checked', file=sys.stderr)
+  if args.csv:
+    with open(args.output, encoding='utf-8') as results, \
+        open(args.csv, 'w', newline='', encoding='utf-8') as csvfile:
+      count = exportcsv(results, csvfile)
+    print(f'{count} hosts exported', file=sys.stderr)
+  return 0
+
+
+if __name__ == '__main__':
+  sys.exit(main())
@@ -0,0 +1,268 @@
+""" Sharded scans: a coordinator splits hosts over sslcheck nodes with consistent hashing """
+import bisect
+import hashlib
+import json
+import os
+import queue
+import threading
+import time
+from collections import deque
+from typing import Iterable, Iterator
+
+import requests
+from dotenv import load_dotenv
+
+load_dotenv()
+
+shardchunk = int(os.getenv('SHARDCHUNK', default='50'))
+shardconnections = int(os.getenv('SHARDCONNECTIONS', default='2'))
+shardtimeout = float(os.getenv('SHARDTIMEOUT', default='120'))
+shardbusyretries = int(os.getenv('SHARDBUSYRETRIES', default='10'))
+
+# Points per node on the hash ring; more points spread the hosts more evenly.
+REPLICAS = 100
+NOLIVENODE = 'No live node'
+
+
+def ringhash(key: str) -> int:
+  """
+  Maps a key to a point on the hash ring.
+
+  Args:
+      key (str): The key.
+
+  Returns:
+      int: The first 8 bytes of the SHA-1 hash of the key.
+  """
+  return int.from_bytes(hashlib.sha1(key.encode()).digest()[:8], 'big')
+
+
+class HashRing:  # pylint: disable=too-few-public-methods
+  """
+  Consistent hashing of hostnames onto nodes.
+
+  Every node gets REPLICAS points on a ring and a host belongs to the first
+  point after its own hash. A host therefore always goes to the same node, so
+  its cached DNS answers and probe results are reused, and when a node is left
+  out only the hosts of that node move, each to the next node on the ring.
+  """
+
+  def __init__(self, nodes: list[str], replicas: int = REPLICAS):
+    self.points = sorted((ringhash(f'{node}#{replica}'), node)
+                         for node in nodes for replica in range(replicas))
+    self.hashes = [point for point, _ in self.points]
+
+  def node(self, host: str, exclude: Iterable[str] = ()) -> str:
+    """
+    Returns the node of a host.
+
+    Args:
+        host (str): The hostname.
+        exclude (Iterable[str]): Nodes to skip, such as nodes that died.
+
+    Returns:
+        str: The node, or None when all nodes are excluded.
+    """
+    exclude = set(exclude)
+    start = bisect.bisect(self.hashes, ringhash(host.lower()))
+    for index in range(len(self.points)):
+      node = self.points[(start + index) % len(self.points)][1]
+      if node not in exclude:
+        return node
+    return None
+
+
+def postbatch(node: str, hosts: list[str], apikey: str, timeout: float) -> Iterator[dict]:
+  """
+  Checks hosts at the batch endpoint of a node and yields the results as they stream in.
+
+  Args:
+      node (str): The base URL of the node, such as http://10.0.0.2:8082.
+      hosts (list[str]): The hostnames.
+      apikey (str): The API key of the node.
+      timeout (float): The maximum time in seconds to connect and between two results.
+
+  Returns:
+      Iterator[dict]: The getinfo result of every host, in order of completion.
+
+  Raises:
+      requests.RequestException: When the node cannot be reached, fails or stalls.
+      ValueError: When the node does not answer with results.
+  """
+  with requests.post(f'{node.rstrip("/")}/sslcheck/batch', json=hosts, headers={'Apikey': apikey},
+                     stream=True, timeout=timeout) as response:
+    response.raise_for_status()
+    if response.headers.get('Content-Type', '').split(';')[0] != 'application/x-ndjson':
+      raise ValueError(response.text[:100])
+    for line in response.iter_lines():
+      if line:
+        yield json.loads(line)
+
+
+class Coordinator:
+  """
+  Spreads the hosts of a scan over sslcheck nodes and collects their results.
+
+  The hosts are split with a HashRing. Every node gets `connections` batch
+  requests of at most `chunk` hosts at a time. A node that answers 503 (busy)
+  is retried after its Retry-After, at most `busyretries` times in a row; a node
+  that stays busy, cannot be reached, fails or stalls longer than `timeout` is
+  taken out, and its hosts without a result move to the next live node on the
+  ring. When no node is left the remaining
+  hosts get an error result.
+  """
+  # pylint: disable=too-many-instance-attributes
+
+  def __init__(self, nodes: list[str], apikey: str, chunk: int = shardchunk,
+               connections: int = shardconnections, timeout: float = shardtimeout,
+               busyretries: int = shardbusyretries):
+    # pylint: disable=too-many-arguments,too-many-positional-arguments
+    self.nodes = nodes
+    self.apikey = apikey
+    self.chunk = chunk
+    self.connections = connections
+    self.timeout = timeout
+    self.busyretries = busyretries
+    self.ring = HashRing(nodes)
+    self.cond = threading.Condition()
+    self.pending: dict[str, deque] = {node: deque() for node in nodes}
+    self.dead: dict[str, str] = {}
+    self.busy: dict[str, int] = {node: 0 for node in nodes}
+    self.unfinished = 0
+    self.results: queue.Queue = queue.Queue()
+
+  def assign(self, hosts: Iterable[str]) -> None:
+    """
+    Queues hosts at their live node, or reports them as failed when no node is
+    left. The lock must be held.
+
+    Args:
+        hosts (Iterable[str]): The hostnames.
+    """
+    for host in hosts:
+      node = self.ring.node(host, self.dead)
+      if node is None:
+        self.report({'host': host, 'error': f'{NOLIVENODE}: {"; ".join(self.dead.values())}'})
+      else:
+        self.pending[node].append(host)
+    self.cond.notify_all()
+
+  def report(self, result: dict) -> None:
+    """
+    Passes the result of a host on to run. The lock must be held.
+
+    Args:
+        result (dict): The result.
+    """
+    self.unfinished -= 1
+    self.results.put(result)
+    if not self.unfinished:
+      self.cond.notify_all()
+
+  def take(self, node: str) -> list[str]:
+    """
+    Waits for hosts for a node.
+
+    Args:
+        node (str): The node.
+
+    Returns:
+        list[str]: At most `chunk` hosts, or an empty list when the node died
+        or all hosts have a result.
+    """
+    with self.cond:
+      while not self.pending[node] and self.unfinished and node not in self.dead:
+        self.cond.wait()
+      if node in self.dead:
+        return []
+      return [self.pending[node].popleft() for _ in range(min(self.chunk, len(self.pending[node])))]
+
+  def work(self, node: str) -> None:
+    """
+    Sends the hosts of a node to it in batches until all hosts have a result or
+    the node dies.
+
+    Args:
+        node (str): The node.
+    """
+    while True:
+      hosts = self.take(node)
+      if not hosts:
+        return
+      todo = set(hosts)
+      try:
+        for result in postbatch(node, hosts, self.apikey, self.timeout):
+          with self.cond:
+            if result.get('host') in todo:
+              todo.discard(result['host'])
+              self.report(result)
+      except requests.HTTPError as exc:
+        if exc.response is not None and exc.response.status_code == 503 and self.retrybusy(node):
+          time.sleep(float(exc.response.headers.get('Retry-After', '1')))
+          with self.cond:
+            self.pending[node].extendleft(reversed([host for host in hosts if host in todo]))
+          continue
+        self.fail(node, exc, todo)
+        return
+      except (requests.RequestException, ValueError) as exc:
+        self.fail(node, exc, todo)
+        return
+      with self.cond:
+        self.busy[node] = 0
+        for host in todo:
+          self.report({'host': host, 'error': f'No result from {node}'})
+
+  def retrybusy(self, node: str) -> bool:
+    """
+    Counts a 503 of a node.
+
+    Args:
+        node (str): The node.
+
+    Returns:
+        bool: True while the node answered 503 at most `busyretries` times in a
+        row, so the batch may be sent again.
+    """
+    with self.cond:
+      self.busy[node] += 1
+      return self.busy[node] <= self.busyretries
+
+  def fail(self, node: str, exc: Exception, todo: set[str]) -> None:
+    """
+    Takes a node out and moves its hosts without a result to the other nodes.
+
+    Args:
+        node (str): The node.
+        exc (Exception): What went wrong.
+        todo (set[str]): The hosts of the running batch without a result.
+    """
+    with self.cond:
+      self.dead[node] = f'{node}: {type(exc).__name__}: {exc}'
+      hosts = list(todo) + list(self.pending[node])
+      self.pending[node].clear()
+      self.assign(hosts)
+
+  def run(self, hosts: Iterable[str]) -> Iterator[dict]:
+    """
+    Checks the hosts on the nodes.
+
+    Args:
+        hosts (Iterable[str]): The hostnames, without duplicates.
+
+    Returns:
+        Iterator[dict]: The result of every host, in order of completion.
+    """
+    total = 0
+    with self.cond:
+      for host in hosts:
+        total += 1
+        self.unfinished += 1
+        self.assign([host])
+    threads = [threading.Thread(target=self.work, args=(node,), name=f'shard-{node}', daemon=True)
+               for node in self.nodes for _ in range(self.connections)]
+    for thread in threads:
+      thread.start()
+    for _ in range(total):
+      yield self.results.get()
+    for thread in threads:
+      thread.join()
@@ -0,0 +1,63 @@
+""" Coalescing of identical concurrent calls """
+import threading
+from concurrent.futures import Future
+from typing import Any, Callable, Hashable
+
+import metrics
+
+
+class SingleFlight:
+  """
+  Runs at most one call per key at a time. Callers that ask for a key while a
+  call for it is in flight wait for that call and get its result, or its
+  exception, instead of starting their own.
+
+  Nothing is kept after a call finishes; caching results is left to the caches.
+  """
+
+  def __init__(self, name: str):
+    self.name = name
+    self.lock = threading.Lock()
+    self.calls: dict[Hashable, Future] = {}
+
+  def do(self, key: Hashable, func: Callable[..., Any], *args: Any) -> Any:
+    """
+    Calls func(*args), or waits for the call with the same key that is in flight.
+
+    Args:
+        key (Hashable): Identifies calls that give the same result.
+        func (Callable[..., Any]): The function to call.
+        *args (Any): The arguments of the call.
+
+    Returns:
+        Any: The result of the call, shared by all callers with the same key.
+    """
+    with self.lock:
+      future = self.calls.get(key)
+      leader = future is None
+      if leader:
+        future = self.calls[key] = Future()
+    if not leader:
+      metrics.COALESCED.inc(operation=self.name)
+      return future.result()
+    try:
+      result = func(*args)
+    except BaseException as exc:
+      with self.lock:
+        del self.calls[key]
+      future.set_exception(exc)
+      raise
+    with self.lock:
+      del self.calls[key]
+    future.set_result(result)
+    return result
+
+  def inflight(self) -> int:
+    """
+    Returns the number of calls in flight.
+
+    Returns:
+        int: The number of keys with a running call.
+    """
+    with self.lock:
+      return len(self.calls)
@@ -1,264 +1,224 @@
 """ SSL-checker """
+import json
 import os
-import socket
-import ssl
-from datetime import datetime
-from typing import Any
-
-import pydig
-import requests
-from flask import Flask, request, render_template
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from datetime import datetime, timezone
+from typing import Any, Callable, Iterable, Iterator, Optional
+
+from flask import Flask, Response, request, render_template, send_from_directory, stream_template, \
+  stream_with_context
 from dotenv import load_dotenv
 
 from waitress import serve
 
+import dnsquery
+import metrics
+import profiling
+import tlsprobe
+from admission import Slots, busy
+from cache import TTLCache
+from cachestore import CacheStore
+from changefeed import ChangeFeed
+from deadline import TIMEDOUT, Deadline
+from dnsquery import digresolvers, getip
+from httpprobe import gethttpstatus
+from jobs import PENDING, JobQueue, pendingresponse
+from recordset import digjson, variesbyaccept, wantsjson
+from resultmodel import HostResult, compact, compactssl, expand, expandssl
+from singleflight import SingleFlight
+from tlsprobe import getsslinfo
+from monitor import Monitor
+
 app = Flask(__name__)
 load_dotenv()
 
 secretapikey = os.getenv('SECRETAPIKEY', default='MySecret')
-
-
-def dodig(host: str, recordtype: str) -> list[str]:
-  """
-  Executes a DNS query for a specified host and record type and returns the DNS
-  query result.
-
-  This function enables querying DNS records based on a given host and record
-  type, facilitating DNS resolution and record retrieval. It leverages the
-  pydig library to perform the query.
-
-  Args:
-      host (str): The hostname or domain to query.
-      recordtype (str): The type of DNS record to query, such as 'A', 'MX', 'TXT', etc.
-
-  Returns:
-      list[str]: A list of DNS query results related to the specified host and
-      record type.
+maxworkers = int(os.getenv('MAXWORKERS', default='16'))
+batchworkers = int(os.getenv('BATCHWORKERS', default='8'))
+monitorenabled = os.getenv('MONITOR', default='false').lower() == 'true'
+port = int(os.getenv('PORT', default='8082'))
+threads = int(os.getenv('THREADS', default='16'))
+connectionlimit = int(os.getenv('CONNECTIONLIMIT', default='200'))
+retryafter = int(os.getenv('RETRYAFTER', default='5'))
+checkslots = Slots(int(os.getenv('MAXCHECKS', default='8')))
+jobqueue = JobQueue(int(os.getenv('JOBWORKERS', default='4')),
+                    int(os.getenv('MAXJOBS', default='100')),
+                    float(os.getenv('JOBTTL', default='600')))
+checkdeadline = float(os.getenv('CHECKDEADLINE', default='20'))
+digdeadline = float(os.getenv('DIGDEADLINE', default='10'))
+digtypes = os.getenv('DIGTYPES', default='A,AAAA,CAA,CNAME,DNSKEY,DS,MX,NS,PTR,SOA,TXT') \
+  .replace(' ', '').upper().split(',')
+digservers = os.getenv('DIGRESOLVERS', default='1.1.1.1,144.217.51.168,165.87.13.129,168.95.1.1,'
+                                               '208.67.222.222,64.6.64.6,77.88.8.8,8.26.56.26,'
+                                               '8.8.8.8,9.9.9.10,9.9.9.9,94.140.14.14') \
+  .replace(' ', '').split(',')
+probecachettl = int(os.getenv('PROBECACHETTL', default='300'))
+probecache = TTLCache(int(os.getenv('PROBECACHESIZE', default='10000')))
+cachedb = os.getenv('CACHEDB', default='sslcache.db')
+cacheflushinterval = float(os.getenv('CACHEFLUSHINTERVAL', default='1'))
+changedb = os.getenv('CHANGEDB', default='sslchanges.db')
+changeretention = float(os.getenv('CHANGERETENTION', default='2592000'))
+# Opened by openchangefeed when the server starts; None records nothing.
+changefeed: Optional[ChangeFeed] = None
+
+# The IPv6 branch stops at the deadline itself; getinfo waits this much longer
+# for its partial results before marking the whole branch as timed out.
+DEADLINEGRACE = 0.5
+# Probes (HTTP, cert, TLS) run in probepool and never wait on other futures.
+# The IPv4/IPv6 branches that wait on the probes run in branchpool, so the
+# probes can always make progress and the pools cannot deadlock.
+probepool = ThreadPoolExecutor(max_workers=maxworkers, thread_name_prefix='probe')
+branchpool = ThreadPoolExecutor(max_workers=maxworkers, thread_name_prefix='branch')
+# The address lookups of the checks have their own pool, so a busy /digall in
+# the dig pool cannot hold them up until the deadline of the check.
+lookuppool = ThreadPoolExecutor(max_workers=maxworkers, thread_name_prefix='lookup')
+
+# Identical checks that run at the same time are done once.
+checkflights = SingleFlight('check')
+
+
+def timedcall(func: Callable, *args: Any) -> tuple[Any, float]:
   """
-  return pydig.query(host, recordtype)
-
-
-def dodigresolver(host: str, recordtype: str, resolver: str) -> list[str]:
-  """
-  Executes a DNS query for a specified host and record type and returns the DNS
-  query result from the supplied resolver.
-
-  This function enables querying DNS records based on a given host and record
-  type, facilitating DNS resolution and record retrieval. It leverages the
-  pydig library to perform the query.
-
-  Args:
-      host (str): The hostname or domain to query.
-      recordtype (str): The type of DNS record to query, such as 'A', 'MX', 'TXT', etc.
-      resolver (str): The IP-address from the DNS-resolver.
-
-  Returns:
-      list[str]: A list of DNS query results related to the specified host and record type.
-  """
-  resolver = pydig.Resolver(
-    nameservers=[resolver],
-  )
-  return resolver.query(host, recordtype)
-
-
-def getip4(host: str) -> list[str]:
-  """
-  Resolves and retrieves the IPv4 address for a given host.
-
-  Determines the IPv4 address associated with the specified host by using
-  a dedicated function to perform an 'A' record DNS query.
+  Calls a function and measures how long the call takes.
 
   Parameters:
-      host: str
-          The host for which the IPv4 address is to be resolved.
+  func: Callable
+    The function to call.
+  *args: Any
+    The arguments of the call.
 
   Returns:
-      list[str]
-          The IPv4 address for the provided host.
-
-  Raises:
-      Any exceptions that may occur during DNS resolution.
+  tuple[Any, float]
+    The result of the call and its duration in seconds.
   """
-  return dodig(host, 'A')
+  start = time.perf_counter()
+  result = func(*args)
+  return result, round(time.perf_counter() - start, 4)
 
 
-def getip6(host: str) -> list[str]:
+def probettl(certinfo: dict) -> float:
   """
-  Resolves the IPv6 address for a given host.
+  Returns how long certificate and TLS results may be cached.
 
-  This function retrieves the IPv6 address associated with the specified host by
-  performing a DNS query for the 'AAAA' record.
+  Results are fresh for PROBECACHETTL seconds, but never longer than the
+  certificate is valid. Failed probes are not cached.
 
-  Args:
-      host (str): The hostname for which the IPv6 address is to be resolved.
+  Parameters:
+  certinfo: dict
+    The certificate information of getsslinfo.
 
   Returns:
-      list[str]: List with the IPv6 addresses of the given host.
+  float
+    The number of seconds the results may be cached, 0 if they may not be cached.
   """
-  return dodig(host, 'AAAA')
+  if 'validuntil' not in certinfo:
+    return 0
+  validuntil = datetime.strptime(certinfo['validuntil'], '%Y-%m-%d %H:%M:%S')
+  remaining = validuntil.replace(tzinfo=timezone.utc) - datetime.now(timezone.utc)
+  return min(probecachettl, remaining.total_seconds())
 
 
-def getip(host: str, ipversion: str = 'ipv4') -> tuple[bool, list[str]]:
+def probessl(host: str, ipversion: str, ipaddress: str, usecache: bool,
+             deadline: Deadline) -> Callable[[], tuple[tuple[dict, dict], Optional[float]]]:
   """
-  Resolves the IP addresses of a given host based on the specified IP version.
-
-  This function retrieves IP addresses for a hostname based on whether the user
-  requests IPv4 or IPv6 addresses. It handles the filtering of IPv6 addresses to
-  exclude any that are represented in dot-decimal notation.
-
-  Parameters:
-      host: str
-          The hostname for which to resolve IP addresses.
-      ipversion: str
-          Specifies the IP version, either 'ipv4' or 'ipv6'. Defaults to 'ipv4'.
-
-  Returns:
-      tuple[bool, list[str]]
-          A tuple where the first element is a boolean indicating success or
-          failure. The second element is a list of resolved IP addresses. For
-          'ipv4', it contains IPv4 addresses. For 'ipv6', it contains
-          non-dot-decimal IPv6 addresses.
-  """
-  if ipversion == 'ipv4':
-    hostlist = getip4(host)
-    return True, hostlist
-  if ipversion == 'ipv6':
-    hostlist = getip6(host)
-    ret = []
-    for ipaddress in hostlist:
-      if '.' not in ipaddress:
-        ret.append(ipaddress)
-    return True, ret
-  return False, []
-
-
-def gethttpstatus(host: str, ipaddress: str) -> str:
-  """
-  Get the HTTP status code for a specified host and IP address.
-
-  This function sends an HTTP GET request to the provided IP address and specifies
-  the `Host` in the headers for the request. It disables SSL verification and applies
-  a timeout of 6 seconds, along with preventing automatic redirects. If the request
-  is successful, it returns the HTTP status code. Otherwise, it handles connection
-  errors and returns a failure message.
+  Starts the certificate/TLS probe of one address of a host in the probe pool,
+  unless a fresh result is cached for the host and address.
 
   Parameters:
   host: str
-      The host/domain to be set in the request headers.
+    The hostname of the server.
+  ipversion: str
+    The IP version, 'ipv4' or 'ipv6'.
   ipaddress: str
-      The IP address where the HTTP GET request is to be sent.
+    The resolved address to probe.
+  usecache: bool
+    Whether a cached result may be used.
+  deadline: Deadline
+    The deadline of the check.
 
   Returns:
-  int or str
-      Returns the HTTP status code as an integer on a successful connection, or the
-      string 'failed to connect' if there is a connection error.
+  Callable[[], tuple[tuple[dict, dict], Optional[float]]]
+    A function that waits for the result of getsslinfo until the deadline, stores
+    a complete result in the cache (in compact form, see resultmodel.compactssl)
+    and returns it with the duration of the probe (None when cached or timed out).
   """
-  try:
-    headers = {'Host': f'{host}'}
-    url = f'https://{ipaddress}'
-    req = requests.get(url, headers=headers, verify=False, timeout=6, allow_redirects=False)
-    return f'{req.status_code}'
-  except requests.ConnectionError:
-    return 'failed to connect'
+  cachekey = (host.lower(), ipversion, ipaddress)
+  found, probes = probecache.get(cachekey) if usecache else (False, None)
+  if found:
+    return lambda: (expandssl(probes), None)
+  sslfuture = profiling.submit(probepool, timedcall, getsslinfo, host, ipversion, deadline,
+                               ipaddress)
+
+  def result() -> tuple[tuple[dict, dict], Optional[float]]:
+    try:
+      fresh, seconds = sslfuture.result(timeout=deadline.remaining())
+    except FutureTimeoutError:
+      sslfuture.cancel()
+      return ({'error': TIMEDOUT}, {ver: TIMEDOUT for ver in tlsprobe.TLSVERSIONS}), None
+    if TIMEDOUT not in fresh[1].values():
+      probecache.put(cachekey, compactssl(fresh), probettl(fresh[0]))
+    return fresh, seconds
 
+  return result
 
-def getcertinfo(host: str, ipversion: str = 'ipv4') -> dict:
-  """
-  Retrieves the SSL certificate details of a given host specifying the IP version.
 
-  The function establishes a secure connection to the given host, fetches the SSL
-  certificate, and extracts information such as the common name (CN) of the
-  certificate, the issuer's common name, and the validity period of the certificate.
-  If an error occurs while attempting to establish a connection or retrieve the
-  certificate, an error message is included in the return dictionary.
+def probehttp(host: str, ipversion: str, iplijst: list[str],
+              deadline: Deadline) -> Callable[[], dict[str, tuple[str, Optional[float]]]]:
+  """
+  Starts the HTTP probes of all addresses of a host in the probe pool.
 
   Parameters:
   host: str
-    The hostname of the server for which the SSL certificate information is retrieved.
+    The hostname of the server.
   ipversion: str
-    The IP version to be used for the connection. Defaults to 'ipv4'. Supported
-    options are 'ipv4' and 'ipv6'.
+    The IP version, 'ipv4' or 'ipv6'.
+  iplijst: list[str]
+    The addresses to probe.
+  deadline: Deadline
+    The deadline of the check.
 
   Returns:
-  dict
-    A dictionary containing the extracted certificate information or an error message
-    in case of failure.
-
-  Raises:
-  IOError
-    If an error occurs during the connection or SSL handshake process.
-  """
-  ret = {}
-  if ipversion == 'ipv6':
-    sock_type = socket.AF_INET6
-  else:
-    sock_type = socket.AF_INET
-  ctx = ssl.create_default_context()
-  socks = socket.socket(sock_type)
-  socks.settimeout(5.0)
-  with ctx.wrap_socket(socks, server_hostname=host) as soc:
-    try:
-      soc.connect((host, 443))
-    except IOError:
-      ret['error'] = 'Error getting cert'
-      return ret
-    cert = soc.getpeercert()
-    subject = dict(x[0] for x in cert['subject'])
-    issued_to = subject['commonName']
-    issuer = dict(x[0] for x in cert['issuer'])
-    issued_by = issuer['commonName']
-    validdate = datetime.strptime(cert['notAfter'], '%b %d %H:%M:%S %Y %Z')
-
-    ret['CN'] = issued_to
-    ret['issuer'] = issued_by
-    ret['validuntil'] = validdate.strftime('%Y-%m-%d %H:%M:%S')
-    return ret
-
-
-def gettlsinfo(host: str, ipversion: str = 'ipv4') -> dict[str, bool]:
+  Callable[[], dict[str, tuple[str, Optional[float]]]]
+    A function that waits for the probes until the deadline and returns per
+    address the HTTP status and the duration of the probe. Probes that are not
+    finished at the deadline are cancelled and get ('timed out', None).
   """
-Get the supported TLS versions for a given host.
-
-This function checks the provided host for its support for specific versions
-of TLS protocols by establishing secure sockets using SSL/TLS configurations
-with predefined minimum and maximum versions. It supports both IPv4 and IPv6
-connections as specified by the user.
-
-Arguments:
-    host (str): The hostname of the server to test for supported TLS versions.
-    ipversion (str): Specify whether to use 'ipv4' or 'ipv6' for the connection.
-        Defaults to 'ipv4'.
-
-Returns:
-    dict: A dictionary where the keys are strings representing the names of
-    the TLS versions and the values are booleans indicating support for that
-    version.
-"""
-  ret = {}
-  if ipversion == 'ipv6':
-    sock_type = socket.AF_INET6
-  else:
-    sock_type = socket.AF_INET
-  for ver in (ssl.TLSVersion.TLSv1_2, ssl.TLSVersion.TLSv1_3):
-    ctx = ssl.create_default_context()
-    ctx.minimum_version = ver
-    ctx.maximum_version = ver
-    socks = socket.socket(sock_type)
-    socks.settimeout(5.0)
-    with ctx.wrap_socket(socks, server_hostname=host) as soc:
-      try:
-        soc.connect((host, 443))
-        ret[ver.name] = True  # pylint: disable=no-member
-      except IOError:
-        ret[ver.name] = False  # pylint: disable=no-member
-  return ret
-
-
-def getipinfo(host: str, ipversion: str = 'ipv4') -> dict:
+  httpfutures = [profiling.submit(probepool, timedcall, gethttpstatus, host,
+                                  f'[{ipaddress}]' if ipversion == 'ipv6' else ipaddress,
+                                  deadline)
+                 for ipaddress in iplijst]
+
+  def result() -> dict[str, tuple[str, Optional[float]]]:
+    wait(httpfutures, timeout=deadline.remaining())
+    httpresults = {}
+    for ipaddress, httpfuture in zip(iplijst, httpfutures):
+      if httpfuture.cancel() or not httpfuture.done():
+        httpresults[ipaddress] = (TIMEDOUT, None)
+      else:
+        httpresults[ipaddress] = httpfuture.result()
+    return httpresults
+
+  return result
+
+
+def getipinfo(host: str, ipversion: str = 'ipv4', usecache: bool = True,
+              timings: bool = False, deadline: Deadline = None) -> dict:
   """
 Fetches IP information, HTTP response status, TLS information, and certificate data
 for the given host and IP version.
 
+The host is resolved once, in its own lookup pool, and every resolved address is
+probed directly: the HTTP status, the certificate and the TLS versions of each
+address are probed concurrently in the shared probe pool (size set with
+MAXWORKERS). Without addresses nothing is probed. Certificate and TLS results are
+cached per host and address (see probettl).
+
+All parts stop at the deadline: probes that did not start yet are cancelled and
+every unfinished part is reported as 'timed out'. When the DNS lookup itself does
+not finish in time, the result is {'error': 'timed out'}.
+
 This function retrieves the list of IP addresses for a specified host and IP version
 (IPv4 or IPv6), checks their HTTP response status, fetches TLS connection details, and
 retrieves certificate information. It returns this aggregated data in a structured format.
@@ -268,56 +228,179 @@ host: str
     The hostname for which information is to be retrieved.
 ipversion: str
     The IP version to use, either 'ipv4' or 'ipv6'. Defaults to 'ipv4'.
+usecache: bool
+    Whether cached DNS answers and certificate/TLS results may be used. Defaults to True.
+timings: bool
+    Whether to add the duration in seconds of the DNS lookup, every HTTP probe, every
+    certificate/TLS probe (None when cached) and the whole branch under 'timings'.
+deadline: Deadline
+    The deadline of the check. Defaults to no deadline.
 
 Returns:
 dict
-    A dictionary containing the addresses list, TLS information, and certificate
-    details. The structure of the dictionary is as follows:
+    A dictionary containing the addresses list. The structure of the dictionary is
+    as follows:
     - addresses: A list of dictionaries, where each dictionary has:
         - ip: str, the IP address.
         - httpreponse: varies, the HTTP response status for the given IP.
-    - cert: varies, details of the host's certificate.
-    - tls: varies, TLS configuration information associated with the host.
+        - cert: varies, details of the certificate served on the given IP.
+        - tls: varies, the TLS versions the given IP supports.
 """
+  deadline = deadline or Deadline()
   data = {}
-  ipaddressdata = []
-  ipfound, iplijst = getip(host, ipversion)
+  start = time.perf_counter()
+  dnsfuture = profiling.submit(lookuppool, timedcall, getip, host, ipversion, usecache, deadline)
+  try:
+    (ipfound, iplijst), dnstime = dnsfuture.result(timeout=deadline.remaining())
+  except FutureTimeoutError:
+    dnsfuture.cancel()
+    return {'error': TIMEDOUT}
   if ipfound:
-    for ipaddress in iplijst:
-      ipdata = {'ip': ipaddress}
-      if ipversion == 'ipv6':
-        ipaddress = f'[{ipaddress}]'
-      response = gethttpstatus(host, ipaddress)
-      ipdata['httpreponse'] = response
-      ipaddressdata.append(ipdata)
-    data['addresses'] = ipaddressdata
-    certinfo = getcertinfo(host, ipversion)
-    data['cert'] = certinfo
-    tlsinfo = gettlsinfo(host, ipversion)
-    data['tls'] = tlsinfo
+    data['addresses'], probetimes = probeaddresses(host, ipversion, iplijst, usecache, deadline)
+    if timings:
+      data['timings'] = dict(probetimes, dns=dnstime, total=round(time.perf_counter() - start, 4))
   return data
 
 
-def getinfo(host: str) -> dict:
+def probeaddresses(host: str, ipversion: str, iplijst: list[str], usecache: bool,
+                   deadline: Deadline) -> tuple[list[dict], dict[str, dict]]:
+  """
+  Probes the HTTP status, the certificate and the TLS versions of every resolved
+  address of a host concurrently.
+
+  Parameters:
+  host: str
+    The hostname of the server.
+  ipversion: str
+    The IP version, 'ipv4' or 'ipv6'.
+  iplijst: list[str]
+    The resolved addresses.
+  usecache: bool
+    Whether cached certificate/TLS results may be used.
+  deadline: Deadline
+    The deadline of the check.
+
+  Returns:
+  tuple[list[dict], dict[str, dict]]
+    The 'addresses' of getipinfo and the durations of the probes per address
+    under 'http' and 'ssl'.
+  """
+  sslresults = {ipaddress: probessl(host, ipversion, ipaddress, usecache, deadline)
+                for ipaddress in iplijst}
+  httpresults = probehttp(host, ipversion, iplijst, deadline)()
+  addresses = []
+  probetimes: dict[str, dict] = {'http': {}, 'ssl': {}}
+  for ipaddress, (response, probetimes['http'][ipaddress]) in httpresults.items():
+    (cert, tls), probetimes['ssl'][ipaddress] = sslresults[ipaddress]()
+    addresses.append({'ip': ipaddress, 'httpreponse': response,
+                      'cert': dict(cert), 'tls': dict(tls)})
+  return addresses, probetimes
+
+
+def getinfo(host: str, usecache: bool = True, timings: bool = False,
+            deadline: Deadline = None) -> dict:
   """
 Gets detailed information about a given host, including its IPv4 and IPv6
 information.
 
+Concurrent calls for the same host with the same usecache and timings share one
+check: the later callers wait for the check in flight and get its result, within
+the deadline of that check.
+
 Parameters:
 host (str): The hostname or IP address for which information is being
 retrieved.
+usecache (bool): Whether cached DNS answers and certificate/TLS results may be
+used. Defaults to True.
+timings (bool): Whether to add a timing breakdown per IP version and the total
+duration under 'timings'. Defaults to False.
+deadline (Deadline): The deadline of the whole check. Defaults to CHECKDEADLINE
+seconds from now; parts that are not finished by then are marked 'timed out'.
 
 Returns:
 dict: A dictionary containing the `host` and `ipresponses`. The `ipresponses`
 key contains another dictionary with keys `ipv4data` and `ipv6data` that hold
 information for IPv4 and IPv6, respectively.
 """
+  result = checkflights.do((host.lower(), usecache, timings), checkbranches, host, usecache,
+                           timings, deadline or Deadline(checkdeadline))
+  return dict(result, host=host)
+
+
+def compactinfo(host: str, usecache: bool, timings: bool) -> HostResult:
+  """
+  Runs getinfo and returns its result in compact form, for results that are
+  kept in memory for a while, such as those of asynchronous jobs.
+
+  Args:
+      host (str): The hostname.
+      usecache (bool): Whether cached results may be used.
+      timings (bool): Whether to add a timing breakdown.
+
+  Returns:
+      HostResult: The result of getinfo; resultmodel.expand gives the dict back.
+  """
+  return compact(getinfo(host, usecache, timings))
+
+
+def checkbranches(host: str, usecache: bool, timings: bool, deadline: Deadline) -> dict:
+  """
+  Runs the check of getinfo: the IPv6 branch runs in the background while the
+  IPv4 branch runs in the calling thread.
+
+  Args:
+      host (str): The hostname.
+      usecache (bool): Whether cached results may be used.
+      timings (bool): Whether to add a timing breakdown.
+      deadline (Deadline): The deadline of the whole check.
+
+  Returns:
+      dict: The result of getinfo.
+  """
   data: dict[str, Any] = {'host': host}
-  ipresponses = {'ipv4data': getipinfo(host), 'ipv6data': getipinfo(host, 'ipv6')}
+  start = time.perf_counter()
+  ipv6future = profiling.submit(branchpool, getipinfo, host, 'ipv6', usecache, timings, deadline)
+  ipresponses = {'ipv4data': getipinfo(host, 'ipv4', usecache, timings, deadline)}
+  try:
+    ipresponses['ipv6data'] = ipv6future.result(timeout=deadline.remaining(DEADLINEGRACE))
+  except FutureTimeoutError:
+    ipv6future.cancel()
+    ipresponses['ipv6data'] = {'error': TIMEDOUT}
   data['ipresponses'] = ipresponses
+  if changefeed is not None:
+    changefeed.recordinfo(data)
+  if timings:
+    data['timings'] = {'total': round(time.perf_counter() - start, 4)}
   return data
 
 
+def profilerequested() -> bool:
+  """
+  Tells whether the current request is profiled (see profiling.profiled).
+
+  Returns:
+      bool: True with PROFILE=true, or for a request with `Profile: true` and
+      the right Apikey header.
+  """
+  if profiling.profileall:
+    return True
+  return request.headers.get('Profile', '').lower() in ('1', 'true', 'yes') \
+    and request.headers.get('Apikey') == secretapikey
+
+
+def requestusescache() -> bool:
+  """
+  Tells whether the current request allows cached results.
+
+  A request with `Cache-Control: no-cache` bypasses the caches; the fresh
+  results are stored again.
+
+  Returns:
+      bool: False if the request has `Cache-Control: no-cache`, True otherwise.
+  """
+  return 'no-cache' not in request.headers.get('Cache-Control', '').lower()
+
+
 @app.route('/sslcheck', methods=['GET'])
 def sslcheckget() -> str:
   """
@@ -332,57 +415,127 @@ Returns:
   return 'OK'
 
 
+@app.route('/sslcheck/metrics', methods=['GET'])
+def sslcheckmetricsget() -> Response:
+  """
+  Handles GET requests to the '/sslcheck/metrics' endpoint.
+
+  Returns:
+      Response: The stage durations, stages in progress, errors, cache counters and
+      resolver health in the Prometheus text format.
+  """
+  extra = ['# TYPE sslcheck_check_slots_used gauge',
+           f'sslcheck_check_slots_used {checkslots.inuse()}',
+           '# TYPE sslcheck_jobs_pending gauge',
+           f'sslcheck_jobs_pending {jobqueue.load()}']
+  for name, stats in sslcheckcacheget().items():
+    for counter in ('hits', 'misses'):
+      extra.append(f'# TYPE sslcheck_{name}_cache_{counter}_total counter')
+      extra.append(f'sslcheck_{name}_cache_{counter}_total {stats[counter]}')
+    extra.append(f'# TYPE sslcheck_{name}_cache_size gauge')
+    extra.append(f'sslcheck_{name}_cache_size {stats["size"]}')
+  resolvers = dnsquery.health.snapshot()
+  for name, field in (('latency_seconds', 'latency'), ('failure_rate', 'failurerate'),
+                      ('open', 'open')):
+    extra.append(f'# TYPE sslcheck_resolver_{name} gauge')
+    extra.extend(f'sslcheck_resolver_{name}{{resolver="{resolver}"}} {float(stats[field] or 0)}'
+                 for resolver, stats in resolvers.items())
+  return Response(metrics.render(extra), mimetype='text/plain; version=0.0.4')
+
+
+@app.route('/sslcheck/cache', methods=['GET'])
+def sslcheckcacheget() -> dict:
+  """
+  Handles GET requests to the '/sslcheck/cache' endpoint.
+
+  Returns:
+      dict: The hit, miss and size counters of the caches.
+  """
+  return {'dns': dnsquery.dnscache.stats(), 'probe': probecache.stats()}
+
+
+def recorddns(host: str, answers: Iterator[tuple[Optional[str], dict[str, list[str]]]]
+              ) -> Iterator[tuple[Optional[str], dict[str, list[str]]]]:
+  """
+  Records the DNS records of every resolver in the change feed, when it is
+  enabled, while passing them on.
+
+  Args:
+      host (str): The hostname.
+      answers (Iterator[tuple[Optional[str], dict[str, list[str]]]]): The records
+          per resolver as yielded by digresolvers.
+
+  Returns:
+      Iterator[tuple[Optional[str], dict[str, list[str]]]]: The same answers.
+  """
+  if changefeed is None:
+    return answers
+  return changefeed.recorddns(host, answers)
+
+
 @app.route('/sslcheck/dig/<host>', methods=['GET'])
+@profiling.profiled(profilerequested)
+@variesbyaccept
 def sslcheckdigget(host: str) -> str:
   """
   Handles GET requests to the '/sslcheck/dig' endpoint.
 
   This function is a simple dig for a host. It responds to a GET request
-  to get dig informatie for a host.
+  to get dig informatie for a host. The record types are queried concurrently;
+  types without an answer after DIGDEADLINE seconds are shown as 'timed out'.
+  With `Accept: application/json` the records are returned as JSON with an ETag
+  (see recordset.digjson); both answers carry `Vary: Accept`.
 
   Returns:
       str: This function returns dig information.
   """
-  types = ["A", "AAAA", "CAA", "CNAME", "DNSKEY", "DS", "MX", "NS", "PTR", "SOA", "TXT", ]
-  records = {}
-  for rectype in types:
-    values = dodig(host, rectype)
-    if len(values) > 0:
-      records[rectype] = values
-  return render_template('dig.html',
-                         host=host,
-                         resultaat=records)
+  if not checkslots.acquire():
+    return busy(retryafter)
+  try:
+    answers = recorddns(host, digresolvers(host, [None], digtypes, requestusescache(),
+                                           Deadline(digdeadline)))
+    if wantsjson(request):
+      return digjson(request, host, answers)
+    _, records = next(answers)
+    return render_template('dig.html',
+                           host=host,
+                           resultaat=records)
+  finally:
+    checkslots.release()
 
 
 @app.route('/sslcheck/digall/<host>', methods=['GET'])
-def sslcheckdigallget(host: str) -> str:
+@profiling.profiled(profilerequested)
+@variesbyaccept
+def sslcheckdigallget(host: str) -> Iterator[str]:
   """
   Handles GET requests to the '/sslcheck/digall' endpoint.
 
   This function is a simple dig for a host. It responds to a GET request
-  to get dig informatie for a host for multiple DNS-resolvers.
+  to get dig informatie for a host for multiple DNS-resolvers. All queries run
+  concurrently and the table rows are streamed per resolver as it finishes.
+  Resolvers that are not finished after DIGDEADLINE seconds are shown with
+  'timed out' for their unfinished record types. With `Accept: application/json`
+  all resolvers are returned at once as JSON with an ETag (see recordset.digjson);
+  both answers carry `Vary: Accept`.
 
   Returns:
-      str: This function returns dig information.
+      Iterator[str]: This function returns dig information.
   """
-  types = ["A", "AAAA", "CAA", "CNAME", "DNSKEY", "DS", "MX", "NS", "PTR", "SOA", "TXT", ]
-  resolvers = ["1.1.1.1", "144.217.51.168", "165.87.13.129", "168.95.1.1",
-               "208.67.222.222", "64.6.64.6", "77.88.8.8", "8.26.56.26",
-               "8.8.8.8", "9.9.9.10", "9.9.9.9", "94.140.14.14", ]
-  results = {}
-  for resolver in resolvers:
-    records = {}
-    for rectype in types:
-      values = dodigresolver(host, rectype, resolver)
-      if len(values) > 0:
-        records[rectype] = values
-    results[resolver] = records
-  return render_template('digall.html',
-                         host=host,
-                         resultaat=results)
+  if not checkslots.acquire():
+    return busy(retryafter)
+  answers = recorddns(host, digresolvers(host, digservers, digtypes, requestusescache(),
+                                         Deadline(digdeadline)))
+  if wantsjson(request):
+    try:
+      return digjson(request, host, answers)
+    finally:
+      checkslots.release()
+  return checkslots.hold(stream_template('digall.html', host=host, resultaat=answers))
 
 
 @app.route('/sslcheck', methods=['POST'])
+@profiling.profiled(profilerequested)
 def sslcheckpost() -> str or dict:
   """
 Handles SSL certificate check requests via a POST method.
@@ -393,9 +546,19 @@ is missing or invalid, or if the hostname is not provided, an appropriate
 response is returned to the client. If all headers are valid,
 it delegates hostname processing to another function (e.g., getinfo).
 
+At most MAXCHECKS checks run at once in the request threads; a request beyond
+that gets 503 with Retry-After at once. With the header `Prefer: respond-async`
+the check runs as a job in the background instead and the answer is 202 with
+the URL of the job (see sslcheckjobget).
+
+A host watched by the monitor is answered with the stored result of its last
+check, with the time of that check under 'checked', unless the request asks for
+a fresh check (`Cache-Control: no-cache`), timings or a job.
+
 Returns either:
     str: Error message if the API key is missing or invalid, or if the hostname is not provided.
     dict: A dictionary with the properties of the requested host.
+    Response: 202 for a job, or 503 when the server is too busy.
 """
   apikey = None
   host = None
@@ -408,8 +571,279 @@ Returns either:
     return 'Invalid apikey'
   if host is None:
     return 'No host given'
-  return getinfo(host)
+  timings = request.headers.get('Timings', '').lower() in ('1', 'true', 'yes')
+  respondasync = 'respond-async' in request.headers.get('Prefer', '')
+  if monitor is not None and requestusescache() and not timings and not respondasync:
+    stored = monitor.result(host)
+    if stored is not None:
+      return stored
+  if respondasync:
+    jobid = jobqueue.submit(compactinfo, host, requestusescache(), timings)
+    return busy(retryafter) if jobid is None else pendingresponse(jobid)
+  if not checkslots.acquire():
+    return busy(retryafter)
+  try:
+    return getinfo(host, requestusescache(), timings)
+  finally:
+    checkslots.release()
+
+
+def runbounded(func: Callable, items: Iterable, workers: int) -> Iterator:
+  """
+  Calls a function for every item with at most `workers` calls running at once
+  and yields the results in order of completion.
+
+  Items are taken from the iterable only when a worker is free, so a long
+  iterable is never held in memory as a whole.
+
+  Args:
+      func (Callable): The function to call with each item.
+      items (Iterable): The items.
+      workers (int): The maximum number of concurrent calls.
+
+  Returns:
+      Iterator: The results of the calls, in order of completion.
+  """
+  itemiter = iter(items)
+  with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='bounded') as executor:
+    running = set()
+    for item in itemiter:
+      running.add(profiling.submit(executor, func, item))
+      if len(running) >= workers:
+        done, running = wait(running, return_when=FIRST_COMPLETED)
+        for future in done:
+          yield future.result()
+    for future in as_completed(running):
+      yield future.result()
+
+
+def checkhost(host: str, usecache: bool = True) -> dict:
+  """
+  Runs getinfo for a host and turns an unexpected error into a result.
+
+  Args:
+      host (str): The hostname to check.
+      usecache (bool): Whether cached results may be used. Defaults to True.
+
+  Returns:
+      dict: The result of getinfo, or the host with an 'error' key.
+  """
+  try:
+    return getinfo(host, usecache)
+  except Exception as exc:  # pylint: disable=broad-exception-caught
+    return {'host': host, 'error': f'{type(exc).__name__}: {exc}'}
+
+
+def requesthosts() -> Iterator[str]:
+  """
+  Reads the hostnames from the body of the current request.
+
+  A body with content type application/json must be a JSON list of hostnames;
+  any other body is read line by line with one hostname per line. Empty lines
+  are skipped.
+
+  Returns:
+      Iterator[str]: The hostnames.
+  """
+  if request.is_json:
+    lines = request.get_json()
+  else:
+    lines = (line.decode('utf-8', errors='replace') for line in request.stream)
+  for line in lines:
+    host = str(line).strip()
+    if host:
+      yield host
+
+
+@app.route('/sslcheck/batch', methods=['POST'])
+@profiling.profiled(profilerequested)
+def sslcheckbatchpost() -> str or Response:
+  """
+Handles batch SSL certificate check requests via a POST method.
+
+The request needs the same Apikey header as POST /sslcheck. The body holds the
+hostnames (see requesthosts). The hosts are checked with at most BATCHWORKERS
+at once, and the result of every host is streamed as one JSON line as soon as
+it is finished (application/x-ndjson).
+
+Returns either:
+    str: Error message if the API key is missing or invalid.
+    Response: The streamed results, one getinfo dictionary per line.
+"""
+  if request.headers.get('Apikey') != secretapikey:
+    return 'Invalid apikey'
+  if not checkslots.acquire():
+    return busy(retryafter)
+  usecache = requestusescache()
+
+  def generate() -> Iterator[str]:
+    for result in runbounded(lambda host: checkhost(host, usecache), requesthosts(), batchworkers):
+      yield json.dumps(result) + '\n'
+
+  return Response(checkslots.hold(stream_with_context(generate())),
+                  mimetype='application/x-ndjson')
+
+
+@app.route('/sslcheck/jobs/<jobid>', methods=['GET'])
+def sslcheckjobget(jobid: str) -> str or dict or Response:
+  """
+Handles GET requests for a job started with `Prefer: respond-async`.
+
+Returns either:
+    str: Error message if the API key is missing or invalid.
+    dict: The result of the finished check.
+    Response: 202 while the job waits or runs, 404 for an unknown or expired job.
+"""
+  if request.headers.get('Apikey') != secretapikey:
+    return 'Invalid apikey'
+  state, result = jobqueue.status(jobid)
+  if state is None:
+    return Response('Unknown job', status=404)
+  if state == PENDING:
+    return pendingresponse(jobid)
+  return expand(result) if isinstance(result, HostResult) else result
+
+
+@app.route('/sslcheck/profiles/<name>', methods=['GET'])
+def sslcheckprofileget(name: str) -> str or Response:
+  """
+Handles GET requests to download a profile: '<id>.json' for the span trace and
+the slowest functions, '<id>.prof' for the cProfile data (pstats, snakeviz).
+The id is in the Profile-Id header of the profiled response.
+
+Returns either:
+    str: Error message if the API key is missing or invalid.
+    Response: The file, or 404 when it does not exist.
+"""
+  if request.headers.get('Apikey') != secretapikey:
+    return 'Invalid apikey'
+  return send_from_directory(os.path.abspath(profiling.profiledir), name)
+
+
+@app.route('/sslcheck/changes', methods=['GET'])
+def sslcheckchangesget() -> str or dict or Response:
+  """
+Handles GET requests to the '/sslcheck/changes' endpoint: the change feed.
+
+Every check and dig stores a content hash per host and section ('addresses',
+'cert', 'tls' and 'dns/<resolver>'). This endpoint returns only the sections
+that changed after the `cursor` query parameter (0 or absent: all hosts), at
+most `limit` (default 1000) at a time, with the cursor for the next call.
+
+Returns either:
+    str: Error message if the API key is missing or invalid, or the change feed
+        is not enabled.
+    dict: The changes, the next cursor and whether more changes are waiting.
+    Response: 400 for a cursor or limit that is not a number.
+"""
+  if request.headers.get('Apikey') != secretapikey:
+    return 'Invalid apikey'
+  if changefeed is None:
+    return 'Change feed not enabled'
+  try:
+    cursor = int(request.args.get('cursor', '0'))
+    limit = min(max(int(request.args.get('limit', '1000')), 1), 10000)
+  except ValueError:
+    return Response('Invalid cursor or limit', status=400)
+  return changefeed.changes(cursor, limit)
+
+
+monitor = Monitor(os.getenv('MONITORDB', default='sslcheck.db'),
+                  lambda host: checkhost(host, usecache=False),
+                  workers=int(os.getenv('MONITORWORKERS', default='4')),
+                  mininterval=float(os.getenv('MONITORMININTERVAL', default='600')),
+                  maxinterval=float(os.getenv('MONITORMAXINTERVAL', default='86400')),
+                  retry=float(os.getenv('MONITORRETRY', default='300'))) if monitorenabled else None
+
+
+def monitorrequest() -> Optional[str]:
+  """
+  Validates a request to the monitor endpoints.
+
+  Returns:
+      Optional[str]: An error message if the API key is missing or invalid or the
+      monitor is not enabled, None if the request may proceed.
+  """
+  if request.headers.get('Apikey') != secretapikey:
+    return 'Invalid apikey'
+  if monitor is None:
+    return 'Monitor not enabled'
+  return None
+
+
+@app.route('/sslcheck/monitor', methods=['GET'])
+def sslcheckmonitorget() -> str or list:
+  """
+Handles GET requests to the '/sslcheck/monitor' endpoint.
+
+Returns either:
+    str: Error message if the API key is invalid or the monitor is not enabled.
+    list: The watched hosts with the times of their last and next check.
+"""
+  return monitorrequest() or monitor.hosts()
+
+
+@app.route('/sslcheck/monitor', methods=['POST', 'DELETE'])
+def sslcheckmonitorpost() -> str:
+  """
+Adds (POST) or removes (DELETE) the host in the Hostname header to or from the
+monitor. Watched hosts are rechecked in the background, and POST /sslcheck
+answers them from the stored result.
+
+Returns:
+    str: An error message, or 'OK'.
+"""
+  error = monitorrequest()
+  if error:
+    return error
+  host = request.headers.get('Hostname')
+  if host is None:
+    return 'No host given'
+  if request.method == 'DELETE':
+    monitor.remove(host)
+  else:
+    monitor.add(host)
+  return 'OK'
+
+
+def persistcaches(dbpath: str) -> CacheStore:
+  """
+  Loads the DNS and probe caches from the snapshot of the previous run and
+  keeps the snapshot up to date from now on.
+
+  Args:
+      dbpath (str): The path of the SQLite database.
+
+  Returns:
+      CacheStore: The store, with its background writer started.
+  """
+  store = CacheStore(dbpath, cacheflushinterval)
+  dnsquery.dnscache.persist(store, 'dns')
+  probecache.persist(store, 'probe')
+  store.start()
+  return store
+
+
+def openchangefeed(dbpath: str) -> ChangeFeed:
+  """
+  Opens the change feed and starts writing it in the background.
+
+  Args:
+      dbpath (str): The path of the SQLite database.
+
+  Returns:
+      ChangeFeed: The feed, with its background writer started.
+  """
+  feed = ChangeFeed(dbpath, cacheflushinterval, changeretention)
+  feed.start()
+  return feed
 
 
 if __name__ == '__main__':
-  serve(app, host="0.0.0.0", port=8082)
+  if cachedb:
+    persistcaches(cachedb)
+  if changedb:
+    changefeed = openchangefeed(changedb)
+  if monitor is not None:
+    monitor.start()
+  serve(app, host="0.0.0.0", port=port, threads=threads, connection_limit=connectionlimit)
@@ -0,0 +1,55 @@
+import pytest
+
+from admission import Slots
+
+
+def test_slots():
+  slots = Slots(2)
+  assert slots.acquire()
+  assert slots.acquire()
+  assert not slots.acquire()
+  slots.release()
+  assert slots.inuse() == 1
+  assert slots.acquire()
+
+
+def test_slots_hold():
+  slots = Slots(1)
+  slots.acquire()
+  resultaat = list(slots.hold(iter(['a', 'b'])))
+  assert resultaat == ['a', 'b']
+  assert slots.inuse() == 0
+
+
+def test_slots_hold_close():
+  slots = Slots(1)
+  gesloten = []
+
+  def body():
+    try:
+      yield 'a'
+      yield 'b'
+    finally:
+      gesloten.append(True)
+
+  slots.acquire()
+  held = slots.hold(body())
+  assert next(held) == 'a'
+  held.close()
+  held.close()
+  assert slots.inuse() == 0
+  assert gesloten == [True]
+
+
+def test_slots_hold_error():
+  def body():
+    yield 'a'
+    raise ValueError('fout')
+
+  slots = Slots(1)
+  slots.acquire()
+  held = slots.hold(body())
+  next(held)
+  with pytest.raises(ValueError):
+    next(held)
+  assert slots.inuse() == 0
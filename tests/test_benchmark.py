@@ -0,0 +1,68 @@
+""" testen voor de benchmark met lokale stand-ins voor DNS- en TLS-servers """
+import shutil
+import tempfile
+import threading
+import unittest
+
+import requests
+from waitress import create_server
+
+import benchmark
+import dnsquery
+import ratelimit
+import sslcheck
+import tlsprobe
+
+
+class TestBenchmark(unittest.TestCase):
+  def test_percentile(self):
+    waarden = [float(x) for x in range(1, 101)]
+    assert benchmark.percentile(waarden, 0.5) == 50.0
+    assert benchmark.percentile(waarden, 0.99) == 99.0
+    assert benchmark.percentile([], 0.99) == 0.0
+
+  def test_measure(self):
+    tellers = iter(range(10))
+
+    def func():
+      if next(tellers) % 5 == 0:
+        raise ValueError('fout')
+
+    resultaat = benchmark.measure(func, 10, 2)
+    assert resultaat['count'] == 10
+    assert resultaat['errors'] == 2
+
+  def test_stopapi(self):
+    api = create_server(sslcheck.app, host='127.0.0.1', port=0, threads=2)
+    draad = threading.Thread(target=api.run, daemon=True)
+    draad.start()
+    assert requests.get(f'http://127.0.0.1:{api.effective_port}/sslcheck', timeout=5).ok
+    benchmark.stopapi(api, draad)
+    assert not draad.is_alive()
+    assert not api.socket
+
+  def test_compare(self):
+    oud = {'results': {'baseline': {'getinfo': {'p50': 0.010, 'p99': 0.020}}}}
+    nieuw = {'results': {'baseline': {'getinfo': {'p50': 0.011, 'p99': 0.040},
+                                      'dodigall': {'p50': 0.001, 'p99': 0.002}}}}
+    assert benchmark.compare(oud, nieuw, 1.25) == ['baseline/getinfo p99: 0.020000s -> 0.040000s']
+
+  @unittest.skipIf(shutil.which('openssl') is None, 'openssl is nodig voor het certificaat')
+  def test_runscenario(self):
+    state = (tlsprobe.TLSPORT, dnsquery.dnsbackend, dnsquery.dnsserver, sslcheck.digservers,
+             ratelimit.limiter)
+    try:
+      with tempfile.TemporaryDirectory() as directory:
+        certfile, keyfile = benchmark.makecert(directory)
+        resultaat = benchmark.runscenario(benchmark.Scenario(tlsversions=('TLSv1_2',)), 2, 2, 1,
+                                          certfile, keyfile)
+    finally:
+      (tlsprobe.TLSPORT, dnsquery.dnsbackend, dnsquery.dnsserver, sslcheck.digservers,
+       ratelimit.limiter) = state
+      tlsprobe.tlscontexts.clear()
+      tlsprobe.tlssessions.clear()
+      dnsquery.dnscache.clear()
+      sslcheck.probecache.clear()
+    assert set(resultaat) == {'dodigall', 'getsslinfo', 'gethttpstatus', 'getinfo',
+                              'api_sslcheckpost', 'api_sslcheckdigallget'}
+    assert all(stats['errors'] == 0 for stats in resultaat.values())
@@ -0,0 +1,43 @@
+""" testen voor de TTL-cache """
+import unittest
+from unittest.mock import patch
+
+from cache import TTLCache
+
+
+class TestTTLCache(unittest.TestCase):
+  def test_hit_miss(self):
+    cache = TTLCache(10)
+    cache.put('sleutel', ['waarde'], 60)
+    assert cache.get('sleutel') == (True, ['waarde'])
+    assert cache.get('anders') == (False, None)
+    assert cache.stats() == {'hits': 1, 'misses': 1, 'size': 1, 'maxsize': 10}
+
+  def test_negative(self):
+    cache = TTLCache(10)
+    cache.put('leeg', [], 60)
+    assert cache.get('leeg') == (True, [])
+
+  @patch('time.monotonic', side_effect=[100.0, 150.0, 170.0])
+  def test_expired(self, mock_monotonic):
+    cache = TTLCache(10)
+    cache.put('sleutel', 'waarde', 60)
+    assert cache.get('sleutel') == (True, 'waarde')
+    assert cache.get('sleutel') == (False, None)
+    assert cache.stats()['size'] == 0
+
+  def test_lru(self):
+    cache = TTLCache(2)
+    cache.put('a', 1, 60)
+    cache.put('b', 2, 60)
+    cache.get('a')
+    cache.put('c', 3, 60)
+    assert cache.get('b') == (False, None)
+    assert cache.get('a') == (True, 1)
+    assert cache.get('c') == (True, 3)
+
+  def test_disabled(self):
+    cache = TTLCache(0)
+    cache.put('sleutel', 'waarde', 60)
+    cache.put('nul', 'waarde', 0)
+    assert cache.get('sleutel') == (False, None)
@@ -0,0 +1,88 @@
+""" testen voor de cache-snapshot in SQLite """
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+import sslcheck
+from cache import TTLCache
+from cachestore import CacheStore
+
+
+class TestCacheStore(unittest.TestCase):
+  def setUp(self):
+    self.tmp = tempfile.TemporaryDirectory()
+    self.dbpath = os.path.join(self.tmp.name, 'cache.db')
+
+  def tearDown(self):
+    self.tmp.cleanup()
+
+  def test_roundtrip(self):
+    store = CacheStore(self.dbpath)
+    cache = TTLCache(10)
+    cache.persist(store, 'probe')
+    cache.put(('test.nl', 'ipv4', '1.2.3.4'), ({'CN': 'test.nl'}, {'TLSv1_3': True}), 60)
+    cache.put(('8.8.8.8', 'test.nl', 'A'), ['1.2.3.4'], 60)
+    store.stop()
+
+    store = CacheStore(self.dbpath)
+    warm = TTLCache(10)
+    assert warm.persist(store, 'probe') == 2
+    assert warm.get(('test.nl', 'ipv4', '1.2.3.4')) == (True, [{'CN': 'test.nl'}, {'TLSv1_3': True}])
+    assert warm.get(('8.8.8.8', 'test.nl', 'A')) == (True, ['1.2.3.4'])
+    assert TTLCache(10).persist(store, 'dns') == 0
+    store.stop()
+
+  def test_unflushed(self):
+    store = CacheStore(self.dbpath)
+    store.put('dns', 'eerste', 1, 60)
+    store.flush()
+    store.put('dns', 'tweede', 2, 60)
+    resultaat = CacheStore(self.dbpath).load('dns')
+    assert [(key, value) for key, value, ttl in resultaat] == [('eerste', 1)]
+    store.stop()
+
+  def test_expired(self):
+    store = CacheStore(self.dbpath)
+    with patch('time.time', return_value=1000.0):
+      store.put('dns', 'kort', 1, 10)
+      store.put('dns', 'lang', 2, 100)
+      store.flush()
+    with patch('time.time', return_value=1050.0):
+      assert store.load('dns') == [('lang', 2, 50.0)]
+      store.flush()
+    assert store.db.execute('SELECT COUNT(*) FROM cache').fetchone() == (1,)
+    store.stop()
+
+  def test_clear(self):
+    store = CacheStore(self.dbpath)
+    cache = TTLCache(10)
+    cache.persist(store, 'dns')
+    cache.put('eerste', 1, 60)
+    store.flush()
+    cache.put('tweede', 2, 60)
+    store.put('probe', 'ander', 3, 60)
+    cache.clear()
+    store.flush()
+    assert store.load('dns') == []
+    assert [key for key, value, ttl in store.load('probe')] == ['ander']
+    store.stop()
+
+  def test_background(self):
+    store = CacheStore(self.dbpath, interval=0.01)
+    store.start()
+    store.put('dns', 'sleutel', 'waarde', 60)
+    store.stop()
+    assert [key for key, value, ttl in CacheStore(self.dbpath).load('dns')] == ['sleutel']
+
+  def test_persistcaches(self):
+    store = CacheStore(self.dbpath)
+    store.put('dns', ('1.1.1.1', 'test.nl', 'A'), ['1.2.3.4'], 60)
+    store.stop()
+    with patch('dnsquery.dnscache', TTLCache(10)) as dnscache, \
+        patch('sslcheck.probecache', TTLCache(10)) as probecache:
+      store = sslcheck.persistcaches(self.dbpath)
+      probecache.put(('test.nl', 'ipv4', '1.2.3.4'), ({}, {}), 60)
+      assert dnscache.get(('1.1.1.1', 'test.nl', 'A')) == (True, ['1.2.3.4'])
+      store.stop()
+    assert len(CacheStore(self.dbpath).load('probe')) == 1
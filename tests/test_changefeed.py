@@ -0,0 +1,94 @@
+""" testen voor de change feed """
+import os
+import tempfile
+import time
+import unittest
+from unittest.mock import patch
+
+from changefeed import ChangeFeed, infosections
+
+GELDIG = {'host': 'Test.nl',
+          'ipresponses': {'ipv4data': {'addresses': [{'ip': '1.2.3.5', 'httpreponse': '200',
+                                                      'cert': {'CN': 'test.nl'}, 'tls': {'TLSv1_3': True}},
+                                                     {'ip': '1.2.3.4', 'httpreponse': '200',
+                                                      'cert': {'CN': 'test.nl'}, 'tls': {'TLSv1_3': True}}]},
+                          'ipv6data': {}}}
+
+
+def vervang(ip: str, cert: dict, tls: dict) -> dict:
+  return {'host': 'test.nl',
+          'ipresponses': {'ipv4data': {'addresses': [{'ip': ip, 'httpreponse': '200',
+                                                      'cert': cert, 'tls': tls}]},
+                          'ipv6data': {}}}
+
+
+class TestChangeFeed(unittest.TestCase):
+  def setUp(self):
+    self.feed = ChangeFeed(':memory:')
+
+  def test_infosections(self):
+    assert infosections(GELDIG) == {'addresses': {'ipv4data': ['1.2.3.4', '1.2.3.5'], 'ipv6data': []},
+                                    'cert': {'1.2.3.5': {'CN': 'test.nl'}, '1.2.3.4': {'CN': 'test.nl'}},
+                                    'tls': {'1.2.3.5': {'TLSv1_3': True}, '1.2.3.4': {'TLSv1_3': True}}}
+    assert infosections({'host': 'test.nl', 'error': 'ValueError: fout'}) == {}
+    assert infosections({'host': 'test.nl', 'ipresponses': {'ipv4data': {}, 'ipv6data': {'error': 'timed out'}}}) == {}
+
+  def test_record(self):
+    assert self.feed.recordinfo(GELDIG) == ['addresses', 'cert', 'tls']
+    assert self.feed.recordinfo(GELDIG) == []
+    eerste = self.feed.changes()
+    assert eerste['cursor'] == 3
+    assert [(change['host'], change['section']) for change in eerste['changes']] == \
+           [('test.nl', 'addresses'), ('test.nl', 'cert'), ('test.nl', 'tls')]
+    assert self.feed.recordinfo(vervang('1.2.3.4', {'CN': 'test.nl'}, {'TLSv1_3': False})) == \
+           ['addresses', 'cert', 'tls']
+    assert self.feed.recordinfo(vervang('1.2.3.4', {'CN': 'nieuw.nl'}, {'TLSv1_3': False})) == ['cert']
+    tweede = self.feed.changes(eerste['cursor'])
+    assert [change['section'] for change in tweede['changes']] == ['addresses', 'tls', 'cert']
+    assert tweede['changes'][-1]['data'] == {'1.2.3.4': {'CN': 'nieuw.nl'}}
+    assert self.feed.changes(tweede['cursor']) == {'cursor': tweede['cursor'], 'more': False, 'changes': []}
+
+  def test_incomplete(self):
+    self.feed.recordinfo(vervang('1.2.3.4', {'CN': 'test.nl'}, {'TLSv1_3': True}))
+    assert self.feed.recordinfo(vervang('1.2.3.4', {'error': 'timed out'}, {'TLSv1_3': 'timed out'})) == []
+    answers = [(None, {'A': ['1.2.3.4']}), ('8.8.8.8', {'A': ['timed out']}), ('9.9.9.9', {'A': ['skipped']})]
+    assert list(self.feed.recorddns('test.nl', answers)) == answers
+    assert [change['section'] for change in self.feed.changes(3)['changes']] == ['dns/default']
+
+  def test_limit(self):
+    for host in ['a.nl', 'b.nl', 'c.nl']:
+      self.feed.record(host, {'dns/default': {'A': [host]}})
+    eerste = self.feed.changes(0, 2)
+    assert (eerste['cursor'], eerste['more']) == (2, True)
+    tweede = self.feed.changes(eerste['cursor'], 2)
+    assert (tweede['cursor'], tweede['more']) == (3, False)
+    assert [change['host'] for change in tweede['changes']] == ['c.nl']
+
+  def test_flush(self):
+    with tempfile.TemporaryDirectory() as tmpdir:
+      dbpath = os.path.join(tmpdir, 'changes.db')
+      feed = ChangeFeed(dbpath, interval=0.01)
+      feed.start()
+      feed.record('a.nl', {'dns/default': {'A': ['1.2.3.4']}})
+      time.sleep(0.1)
+      assert feed.db.execute('SELECT host, seq FROM changes').fetchall() == [('a.nl', 1)]
+      feed.stop()
+      opnieuw = ChangeFeed(dbpath)
+      assert opnieuw.record('a.nl', {'dns/default': {'A': ['1.2.3.4']}}) == []
+      assert opnieuw.record('b.nl', {'dns/default': {'A': ['1.2.3.5']}}) == ['dns/default']
+      assert opnieuw.changes(1)['changes'][0]['hash'] is not None
+      assert opnieuw.seq == 2
+      opnieuw.stop()
+
+  def test_retention(self):
+    feed = ChangeFeed(':memory:', retention=60)
+    with patch('time.time', return_value=1000):
+      feed.record('oud.nl', {'dns/default': {'A': ['1.2.3.4']}})
+      feed.record('gezien.nl', {'dns/default': {'A': ['1.2.3.5']}})
+      feed.flush()
+    with patch('time.time', return_value=1050):
+      feed.record('gezien.nl', {'dns/default': {'A': ['1.2.3.5']}})
+      feed.flush()
+    with patch('time.time', return_value=1070):
+      assert [change['host'] for change in feed.changes()['changes']] == ['gezien.nl']
+      assert feed.record('oud.nl', {'dns/default': {'A': ['1.2.3.4']}}) == ['dns/default']
@@ -0,0 +1,27 @@
+""" testen voor de deadline van een controle """
+import unittest
+from unittest.mock import patch
+
+from deadline import Deadline
+
+
+class TestDeadline(unittest.TestCase):
+  def test_geen_deadline(self):
+    deadline = Deadline()
+    assert deadline.remaining() is None
+    assert not deadline.expired()
+    assert deadline.timeout(5.0) == 5.0
+
+  @patch('time.monotonic', side_effect=[100.0, 103.0, 103.0, 103.0, 111.0])
+  def test_deadline(self, mock_monotonic):
+    deadline = Deadline(10)
+    assert deadline.remaining() == 7.0
+    assert deadline.timeout(5.0) == 5.0
+    assert deadline.remaining(0.5) == 7.5
+    assert deadline.expired()
+
+  @patch('time.monotonic', side_effect=[100.0, 109.0, 120.0])
+  def test_timeout(self, mock_monotonic):
+    deadline = Deadline(10)
+    assert deadline.timeout(5.0) == 1.0
+    assert deadline.timeout(5.0) == 0.001
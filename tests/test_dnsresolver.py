@@ -0,0 +1,121 @@
+""" testen voor de in-process DNS-resolver tegen een lokale stub DNS-server """
+import socket
+import socketserver
+import struct
+import threading
+import unittest
+from unittest.mock import patch
+
+import dnsresolver
+import dnsquery
+import sslcheck
+
+RECORDS = {
+  'A': [(300, socket.inet_aton('12.34.56.78'))],
+  'AAAA': [(60, socket.inet_pton(socket.AF_INET6, '1:2::3:0'))],
+  'MX': [(3600, struct.pack('!H', 10) + b'\xc0\x0c')],
+  'TXT': [(120, b'\x0cv=spf1 -all"\x03abc')],
+  'CAA': [(120, b'\x00\x05issueletsencrypt.org')],
+}
+SOA = dnsresolver.encodename('ns.test.nl') + dnsresolver.encodename('hostmaster.test.nl') \
+      + struct.pack('!IIIII', 1, 7200, 3600, 1209600, 30)
+
+
+def buildresponse(query: bytes, tcp: bool = False) -> bytes:
+  qid = struct.unpack_from('!H', query)[0]
+  (qname, qtype), offset = dnsresolver.readquestion(query, 1)
+  if qname == 'servfail.nl.':
+    return struct.pack('!HHHHHH', qid, 0x8182, 1, 0, 0, 0) + query[12:offset]
+  rectype = next(key for key, value in dnsresolver.RECORDTYPES.items() if value == qtype)
+  answers = RECORDS.get(rectype, [])
+  truncated = rectype == 'TXT' and not tcp
+  flags = 0x8180 | (0x0200 if truncated else 0)
+  ret = struct.pack('!HHHHHH', qid, flags, 1, 0 if truncated else len(answers),
+                    0 if answers else 1, 0) + query[12:offset]
+  if truncated:
+    return ret
+  for ttl, rdata in answers:
+    ret += b'\xc0\x0c' + struct.pack('!HHIH', qtype, 1, ttl, len(rdata)) + rdata
+  if not answers:
+    ret += b'\xc0\x0c' + struct.pack('!HHIH', 6, 1, 3600, len(SOA)) + SOA
+  return ret
+
+
+class StubUDPHandler(socketserver.BaseRequestHandler):
+  def handle(self):
+    data, sock = self.request
+    sock.sendto(buildresponse(data), self.client_address)
+
+
+class StubTCPHandler(socketserver.BaseRequestHandler):
+  def handle(self):
+    length = struct.unpack('!H', dnsresolver.recvexact(self.request, 2))[0]
+    response = buildresponse(dnsresolver.recvexact(self.request, length), tcp=True)
+    self.request.sendall(struct.pack('!H', len(response)) + response)
+
+
+class TestDnsResolver(unittest.TestCase):
+  @classmethod
+  def setUpClass(cls):
+    cls.udpserver = socketserver.ThreadingUDPServer(('127.0.0.1', 0), StubUDPHandler)
+    port = cls.udpserver.server_address[1]
+    cls.tcpserver = socketserver.ThreadingTCPServer(('127.0.0.1', port), StubTCPHandler)
+    cls.port = port
+    for server in (cls.udpserver, cls.tcpserver):
+      threading.Thread(target=server.serve_forever, daemon=True).start()
+
+  @classmethod
+  def tearDownClass(cls):
+    for server in (cls.udpserver, cls.tcpserver):
+      server.shutdown()
+      server.server_close()
+
+  def test_query(self):
+    resultaat = dnsresolver.query('test.nl', ['A', 'AAAA', 'MX', 'CAA', 'NS'], '127.0.0.1', self.port)
+    assert resultaat['A'] == dnsresolver.Answer(['12.34.56.78'], 300)
+    assert resultaat['AAAA'] == dnsresolver.Answer(['1:2::3:0'], 60)
+    assert resultaat['MX'] == dnsresolver.Answer(['10 test.nl.'], 3600)
+    assert resultaat['CAA'] == dnsresolver.Answer(['0 issue "letsencrypt.org"'], 120)
+    assert resultaat['NS'] == dnsresolver.Answer([], 30)
+
+  def test_query_truncated(self):
+    resultaat = dnsresolver.query('test.nl', ['TXT'], '127.0.0.1', self.port)
+    assert resultaat['TXT'] == dnsresolver.Answer(['"v=spf1 -all\\"" "abc"'], 120)
+
+  def test_query_servfail(self):
+    resultaat = dnsresolver.query('servfail.nl', ['A'], '127.0.0.1', self.port)
+    assert resultaat == {'A': dnsresolver.Answer([], 0, False)}
+
+  def test_query_label_te_lang(self):
+    host = 'a' * 64 + '.nl'
+    with patch('socket.socket') as mock_socket:
+      resultaat = dnsresolver.query(host, ['A', 'AAAA'], '127.0.0.1', self.port)
+    assert resultaat == {'A': dnsresolver.Answer([], 0, False), 'AAAA': dnsresolver.Answer([], 0, False)}
+    assert not mock_socket.called
+    with patch('dnsquery.dnsbackend', 'wire'), patch('dnsquery.dnsserver', f'127.0.0.1#{self.port}'):
+      assert dnsquery.dodigall(host, ['A']) == {'A': []}
+
+  @patch('dnsresolver.tcpquery', side_effect=ConnectionRefusedError)
+  def test_query_truncated_tcpfout(self, mock_tcpquery):
+    resultaat = dnsresolver.query('test.nl', ['TXT', 'A'], '127.0.0.1', self.port)
+    assert resultaat == {'TXT': dnsresolver.Answer([], 0, False),
+                         'A': dnsresolver.Answer(['12.34.56.78'], 300)}
+    assert mock_tcpquery.called
+
+  def test_query_timeout(self):
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+      sock.bind(('127.0.0.1', 0))
+      resultaat = dnsresolver.query('test.nl', ['A'], '127.0.0.1', sock.getsockname()[1], timeout=0.1)
+    assert resultaat == {'A': dnsresolver.Answer([], 0, False)}
+
+  def test_dodigall_wire(self):
+    with patch('dnsquery.dnsbackend', 'wire'), patch('dnsquery.dnsserver', f'127.0.0.1#{self.port}'):
+      resultaat = dnsquery.dodigall('test.nl', ['A', 'NS'])
+      ipfound, iplijst = dnsquery.getip('test.nl', 'ipv6')
+    assert resultaat == {'A': ['12.34.56.78'], 'NS': []}
+    assert ipfound
+    assert iplijst == ['1:2::3:0']
+
+  def test_splitresolver(self):
+    assert dnsresolver.splitresolver('8.8.8.8') == ('8.8.8.8', 53)
+    assert dnsresolver.splitresolver('127.0.0.1#5353') == ('127.0.0.1', 5353)
@@ -1,9 +1,15 @@
+import json
+import threading
 from unittest.mock import patch
 
 import pytest
 from flask import Flask
 
+import dnsquery
 import sslcheck
+from admission import Slots
+from changefeed import ChangeFeed
+from jobs import JobQueue
 
 
 @pytest.fixture()
@@ -12,6 +18,8 @@ def app():
   app.config.update({
     "TESTING": True,
   })
+  dnsquery.dnscache.clear()
+  dnsquery.health.clear()
 
   @app.route('/sslcheck', methods=['GET'])
   def sslcheckget():
@@ -21,6 +29,38 @@ def app():
   def sslcheckpost():
     return sslcheck.sslcheckpost()
 
+  @app.route('/sslcheck/batch', methods=['POST'])
+  def sslcheckbatchpost():
+    return sslcheck.sslcheckbatchpost()
+
+  @app.route('/sslcheck/jobs/<jobid>', methods=['GET'])
+  def sslcheckjobget(jobid: str):
+    return sslcheck.sslcheckjobget(jobid)
+
+  @app.route('/sslcheck/monitor', methods=['GET'])
+  def sslcheckmonitorget():
+    return sslcheck.sslcheckmonitorget()
+
+  @app.route('/sslcheck/monitor', methods=['POST', 'DELETE'])
+  def sslcheckmonitorpost():
+    return sslcheck.sslcheckmonitorpost()
+
+  @app.route('/sslcheck/metrics', methods=['GET'])
+  def sslcheckmetricsget():
+    return sslcheck.sslcheckmetricsget()
+
+  @app.route('/sslcheck/cache', methods=['GET'])
+  def sslcheckcacheget():
+    return sslcheck.sslcheckcacheget()
+
+  @app.route('/sslcheck/profiles/<name>', methods=['GET'])
+  def sslcheckprofileget(name: str):
+    return sslcheck.sslcheckprofileget(name)
+
+  @app.route('/sslcheck/changes', methods=['GET'])
+  def sslcheckchangesget():
+    return sslcheck.sslcheckchangesget()
+
   @app.route('/sslcheck/dig/<host>', methods=['GET'])
   def sslcheckdigget(host: str):
     return sslcheck.sslcheckdigget(host)
@@ -29,7 +69,8 @@ def app():
   def sslcheckdigallget(host: str):
     return sslcheck.sslcheckdigallget(host)
 
-  yield app
+  with patch('sslcheck.changefeed', ChangeFeed(':memory:')):
+    yield app
 
 
 @pytest.fixture()
@@ -67,6 +108,78 @@ def test_sslcheck_post(mock_info, client):
   assert mock_info.called
 
 
+@patch('sslcheck.getinfo', side_effect=lambda host, usecache, timings: {'timings': timings})
+def test_sslcheck_post_timings(mock_info, client):
+  response = client.post('/sslcheck', headers={'Apikey': 'MySecret', 'Hostname': 'a.nl', 'Timings': 'true'})
+  assert response.json == {'timings': True}
+
+
+@patch('sslcheck.getinfo', side_effect=None)
+def test_sslcheck_post_monitor(mock_info, client):
+  with patch('sslcheck.monitor') as mock_monitor:
+    mock_monitor.result.return_value = {'host': 'example.com'}
+    response = client.post('/sslcheck', headers={'Apikey': 'MySecret', 'Hostname': 'example.com'})
+  assert response.json == {'host': 'example.com'}
+  assert not mock_info.called
+
+
+@patch('sslcheck.getinfo', side_effect=lambda host, usecache, timings: {'host': host, 'vers': True})
+def test_sslcheck_post_monitor_vers(mock_info, client):
+  with patch('sslcheck.monitor') as mock_monitor:
+    mock_monitor.result.return_value = {'host': 'example.com', 'checked': 1}
+    for headers in ({'Cache-Control': 'no-cache'}, {'Timings': 'true'}):
+      response = client.post('/sslcheck', headers={'Apikey': 'MySecret', 'Hostname': 'example.com',
+                                                   **headers})
+      assert response.json['vers']
+    with patch('sslcheck.jobqueue') as mock_jobqueue:
+      mock_jobqueue.submit.return_value = 'job1'
+      response = client.post('/sslcheck', headers={'Apikey': 'MySecret', 'Hostname': 'example.com',
+                                                   'Prefer': 'respond-async'})
+    assert response.status_code == 202
+  assert not mock_monitor.result.called
+
+
+def test_sslcheck_monitor_disabled(client):
+  response = client.post('/sslcheck/monitor', headers={'Apikey': 'MySecret', 'Hostname': 'a.nl'})
+  assert b"Monitor not enabled" in response.data
+  response = client.get('/sslcheck/monitor', headers={'Apikey': 'somekey'})
+  assert b"Invalid apikey" in response.data
+
+
+def test_sslcheck_monitor(client):
+  with patch('sslcheck.monitor') as mock_monitor:
+    mock_monitor.hosts.return_value = [{'host': 'a.nl'}]
+    client.post('/sslcheck/monitor', headers={'Apikey': 'MySecret', 'Hostname': 'a.nl'})
+    client.delete('/sslcheck/monitor', headers={'Apikey': 'MySecret', 'Hostname': 'b.nl'})
+    response = client.get('/sslcheck/monitor', headers={'Apikey': 'MySecret'})
+  mock_monitor.add.assert_called_once_with('a.nl')
+  mock_monitor.remove.assert_called_once_with('b.nl')
+  assert response.json == [{'host': 'a.nl'}]
+
+
+def test_sslcheck_batch_wrongkey(client):
+  response = client.post('/sslcheck/batch', headers={'Apikey': 'somekey'}, data='test.nl\n')
+  assert b"Invalid apikey" in response.data
+
+
+@patch('sslcheck.getinfo', side_effect=lambda host, usecache: {'host': host})
+def test_sslcheck_batch(mock_info, client):
+  response = client.post('/sslcheck/batch', headers={'Apikey': 'MySecret'},
+                         data='a.nl\n\nb.nl\nc.nl\n')
+  assert response.mimetype == 'application/x-ndjson'
+  resultaat = sorted(json.loads(line)['host'] for line in response.data.splitlines())
+  assert resultaat == ['a.nl', 'b.nl', 'c.nl']
+  assert mock_info.call_count == 3
+
+
+@patch('sslcheck.getinfo', side_effect=[{'host': 'a.nl'}, ValueError('fout')])
+def test_sslcheck_batch_json(mock_info, client):
+  with patch('sslcheck.batchworkers', 1):
+    response = client.post('/sslcheck/batch', headers={'Apikey': 'MySecret'}, json=['a.nl', 'b.nl'])
+    regels = [json.loads(line) for line in response.data.splitlines()]
+  assert regels == [{'host': 'a.nl'}, {'host': 'b.nl', 'error': 'ValueError: fout'}]
+
+
 @patch('pydig.query', side_effect=[['12.34.56.78'],
                                    [], [], [], [], [], [], [], [], [], [], ])
 def test_sslcheckdig_get(mock_query, client):
@@ -74,26 +187,173 @@ def test_sslcheckdig_get(mock_query, client):
   assert b"Host: test.nl" in response.data
   assert b"<td class=\"w3-align-top\">A</td>" in response.data
   assert b"12.34.56.78<br/>" in response.data
+  assert response.headers['Vary'] == 'Accept'
   assert mock_query.call_count == 11
 
 
-@patch('pydig.Resolver.query', side_effect=[
-  ['12.34.56.78'], [], [], [], [], [], [], [], [], [], [],
-  ['12.34.56.78'], [], [], [], [], [], [], [], [], [], [],
-  ['12.34.56.78'], [], [], [], [], [], [], [], [], [], [],
-  ['12.34.56.78'], [], [], [], [], [], [], [], [], [], [],
-  ['12.34.56.78'], [], [], [], [], [], [], [], [], [], [],
-  ['12.34.56.78'], [], [], [], [], [], [], [], [], [], [],
-  ['12.34.56.78'], [], [], [], [], [], [], [], [], [], [],
-  ['12.34.56.78'], [], [], [], [], [], [], [], [], [], [],
-  ['12.34.56.78'], [], [], [], [], [], [], [], [], [], [],
-  ['12.34.56.78'], [], [], [], [], [], [], [], [], [], [],
-  ['12.34.56.78'], [], [], [], [], [], [], [], [], [], [],
-  ['12.34.56.78'], [], [], [], [], [], [], [], [], [], [],
-])
+@patch('pydig.query', side_effect=lambda host, recordtype: ['12.34.56.78'] if recordtype == 'A' else [])
+def test_sslcheckdig_get_cache(mock_query, client):
+  client.get(f'/sslcheck/dig/test.nl')
+  client.get(f'/sslcheck/dig/test.nl')
+  assert mock_query.call_count == 11
+  client.get(f'/sslcheck/dig/test.nl', headers={'Cache-Control': 'no-cache'})
+  assert mock_query.call_count == 22
+  response = client.get('/sslcheck/cache')
+  assert response.json['dns']['hits'] == 11
+  assert response.json['dns']['misses'] == 11
+
+
+@patch('pydig.Resolver.query',
+       side_effect=lambda host, recordtype: ['12.34.56.78'] if recordtype == 'A' else [])
 def test_sslcheckdigall_get(mock_query, client):
   response = client.get(f'/sslcheck/digall/test.nl')
   assert b"Host: test.nl" in response.data
   assert b"<td class=\"w3-align-top\">A</td>" in response.data
   assert b"12.34.56.78<br/>" in response.data
+  assert response.headers['Vary'] == 'Accept'
   assert mock_query.call_count == 11 * 12
+
+
+@patch('pydig.query', side_effect=lambda host, recordtype: [])
+def test_sslcheck_metrics(mock_query, client):
+  client.get(f'/sslcheck/dig/test.nl')
+  response = client.get('/sslcheck/metrics')
+  assert response.mimetype == 'text/plain'
+  assert b'# TYPE sslcheck_stage_duration_seconds histogram' in response.data
+  assert b'sslcheck_stage_duration_seconds_count{stage="dns",ipversion="",outcome="ok"}' in response.data
+  assert b'sslcheck_dns_cache_misses_total 11' in response.data
+
+
+@patch('sslcheck.getinfo', side_effect=None)
+def test_sslcheck_busy(mock_info, client):
+  with patch('sslcheck.checkslots', Slots(0)):
+    responses = [client.post('/sslcheck', headers={'Apikey': 'MySecret', 'Hostname': 'a.nl'}),
+                 client.post('/sslcheck/batch', headers={'Apikey': 'MySecret'}, data='a.nl\n'),
+                 client.get('/sslcheck/dig/a.nl'),
+                 client.get('/sslcheck/digall/a.nl')]
+  assert [response.status_code for response in responses] == [503] * 4
+  assert responses[0].headers['Retry-After'] == '5'
+  assert not mock_info.called
+
+
+@patch('pydig.query', side_effect=lambda host, recordtype: [])
+def test_sslcheck_slots_released(mock_query, client):
+  slots = Slots(1)
+  with patch('sslcheck.checkslots', slots):
+    client.get('/sslcheck/dig/a.nl')
+    with patch('sslcheck.getinfo', side_effect=lambda host, usecache: {'host': host}):
+      response = client.post('/sslcheck/batch', headers={'Apikey': 'MySecret'}, data='a.nl\n')
+      assert response.status_code == 200
+      response.close()
+  assert slots.inuse() == 0
+
+
+def test_sslcheck_async(client):
+  gestart = threading.Event()
+  klaar = threading.Event()
+
+  def getinfo(host, usecache, timings):
+    gestart.set()
+    klaar.wait(5)
+    return {'host': host}
+
+  with patch('sslcheck.jobqueue', JobQueue(1, 1, 60)), patch('sslcheck.getinfo', side_effect=getinfo):
+    headers = {'Apikey': 'MySecret', 'Hostname': 'a.nl', 'Prefer': 'respond-async'}
+    response = client.post('/sslcheck', headers=headers)
+    assert response.status_code == 202
+    location = response.headers['Location']
+    assert location == f"/sslcheck/jobs/{response.json['job']}"
+    gestart.wait(5)
+    assert client.post('/sslcheck', headers=headers).status_code == 503
+    assert client.get(location, headers={'Apikey': 'MySecret'}).status_code == 202
+    klaar.set()
+    sslcheck.jobqueue.executor.shutdown(wait=True)
+    response = client.get(location, headers={'Apikey': 'MySecret'})
+  assert response.json == {'host': 'a.nl'}
+
+
+def test_sslcheck_job_unknown(client):
+  assert client.get('/sslcheck/jobs/abc', headers={'Apikey': 'somekey'}).data == b'Invalid apikey'
+  assert client.get('/sslcheck/jobs/abc', headers={'Apikey': 'MySecret'}).status_code == 404
+
+
+def test_sslcheckdig_json(client):
+  antwoorden = iter([['1.2.3.5', '1.2.3.4'], ['1.2.3.4', '1.2.3.5']])
+  with patch('pydig.query', side_effect=lambda host, recordtype: next(antwoorden) if recordtype == 'A' else []):
+    eerste = client.get('/sslcheck/dig/Test.nl', headers={'Accept': 'application/json'})
+    tweede = client.get('/sslcheck/dig/Test.nl', headers={'Accept': 'application/json',
+                                                          'Cache-Control': 'no-cache',
+                                                          'If-None-Match': eerste.headers['ETag']})
+  assert eerste.json == {'host': 'test.nl', 'resolvers': {'default': {'A': ['1.2.3.4', '1.2.3.5']}}}
+  assert eerste.headers['ETag']
+  assert tweede.status_code == 304
+  assert tweede.data == b''
+  assert eerste.headers['Vary'] == tweede.headers['Vary'] == 'Accept'
+
+
+@patch('pydig.Resolver.query', side_effect=lambda host, recordtype: ['12.34.56.78'] if recordtype == 'A' else [])
+def test_sslcheckdigall_json(mock_query, client):
+  response = client.get('/sslcheck/digall/test.nl', headers={'Accept': 'application/json'})
+  assert list(response.json['resolvers']) == sorted(sslcheck.digservers)
+  assert response.json['resolvers']['8.8.8.8'] == {'A': ['12.34.56.78']}
+  assert response.headers['Vary'] == 'Accept'
+  response = client.get('/sslcheck/digall/test.nl', headers={'Accept': 'application/json',
+                                                             'If-None-Match': 'anders'})
+  assert response.status_code == 200
+
+
+def test_sslcheck_changes(client):
+  antwoorden = iter([['1.2.3.4'], ['1.2.3.4'], ['1.2.3.5']])
+  headers = {'Apikey': 'MySecret'}
+  with patch('pydig.query', side_effect=lambda host, recordtype: next(antwoorden) if recordtype == 'A' else []):
+    client.get('/sslcheck/dig/test.nl')
+    eerste = client.get('/sslcheck/changes', headers=headers).json
+    client.get('/sslcheck/dig/test.nl', headers={'Cache-Control': 'no-cache'})
+    tweede = client.get(f"/sslcheck/changes?cursor={eerste['cursor']}", headers=headers).json
+    client.get('/sslcheck/dig/test.nl', headers={'Cache-Control': 'no-cache'})
+    derde = client.get(f"/sslcheck/changes?cursor={eerste['cursor']}", headers=headers).json
+  assert [(change['host'], change['section'], change['data']) for change in eerste['changes']] == \
+         [('test.nl', 'dns/default', {'A': ['1.2.3.4']})]
+  assert tweede == {'cursor': eerste['cursor'], 'more': False, 'changes': []}
+  assert [change['data'] for change in derde['changes']] == [{'A': ['1.2.3.5']}]
+  assert derde['cursor'] > eerste['cursor']
+
+
+def test_sslcheck_changes_invalid(client):
+  assert client.get('/sslcheck/changes', headers={'Apikey': 'somekey'}).data == b'Invalid apikey'
+  assert client.get('/sslcheck/changes?cursor=x', headers={'Apikey': 'MySecret'}).status_code == 400
+
+
+@patch('pydig.query', side_effect=lambda host, recordtype: [])
+def test_sslcheck_profile(mock_query, client, tmp_path):
+  with patch('profiling.profiledir', str(tmp_path)):
+    assert 'Profile-Id' not in client.get('/sslcheck/dig/a.nl', headers={'Profile': 'true'}).headers
+    response = client.get('/sslcheck/dig/a.nl', headers={'Profile': 'true', 'Apikey': 'MySecret',
+                                                         'Cache-Control': 'no-cache'})
+    profielid = response.headers['Profile-Id']
+    assert b'Host: a.nl' in response.data
+    trace = client.get(f'/sslcheck/profiles/{profielid}.json', headers={'Apikey': 'MySecret'}).json
+    assert client.get(f'/sslcheck/profiles/{profielid}.prof', headers={'Apikey': 'MySecret'}).status_code == 200
+    assert client.get('/sslcheck/profiles/bestaatniet.json', headers={'Apikey': 'MySecret'}).status_code == 404
+    assert client.get(f'/sslcheck/profiles/{profielid}.json', headers={'Apikey': 'somekey'}).data == b'Invalid apikey'
+  assert trace['request'] == 'GET /sslcheck/dig/a.nl'
+  assert len([span for span in trace['spans'] if span['name'] == 'dns']) == 11
+  assert len([span for span in trace['spans'] if span['name'] == 'dodigresolver']) == 11
+  assert trace['top']
+
+
+@patch('sslcheck.getinfo', side_effect=lambda host, usecache: {'host': host})
+def test_sslcheck_profile_batch(mock_info, client, tmp_path):
+  with patch('profiling.profiledir', str(tmp_path)):
+    response = client.post('/sslcheck/batch', headers={'Apikey': 'MySecret', 'Profile': 'true'},
+                           data='a.nl\nb.nl\n')
+    assert len(response.data.splitlines()) == 2
+    response.close()
+    trace = json.loads((tmp_path / f"{response.headers['Profile-Id']}.json").read_text())
+  assert sorted(span['args'][0] for span in trace['spans']) == ['a.nl', 'b.nl']
+
+
+def test_sslcheck_changes_disabled(client):
+  with patch('sslcheck.changefeed', None), patch('pydig.query', return_value=['1.2.3.4']):
+    assert client.get('/sslcheck/dig/test.nl').status_code == 200
+    assert client.get('/sslcheck/changes', headers={'Apikey': 'MySecret'}).data == b'Change feed not enabled'
@@ -0,0 +1,34 @@
+import threading
+
+from jobs import DONE, PENDING, JobQueue
+
+
+def test_jobqueue():
+  jobs = JobQueue(2, 10, 60)
+  jobid = jobs.submit(lambda host: {'host': host}, 'a.nl')
+  jobs.executor.shutdown(wait=True)
+  assert jobs.status(jobid) == (DONE, {'host': 'a.nl'})
+  assert jobs.status('onbekend') == (None, None)
+  assert jobs.load() == 0
+
+
+def test_jobqueue_full():
+  klaar = threading.Event()
+  jobs = JobQueue(1, 1, 60)
+  jobid = jobs.submit(klaar.wait, 5)
+  assert jobs.submit(klaar.wait, 5) is None
+  assert jobs.status(jobid) == (PENDING, None)
+  assert jobs.load() == 1
+  klaar.set()
+  jobs.executor.shutdown(wait=True)
+  assert jobs.status(jobid) == (DONE, True)
+
+
+def test_jobqueue_error():
+  def fout():
+    raise ValueError('fout')
+
+  jobs = JobQueue(1, 1, 60)
+  jobid = jobs.submit(fout)
+  jobs.executor.shutdown(wait=True)
+  assert jobs.status(jobid) == (DONE, {'error': 'ValueError: fout'})
@@ -0,0 +1,40 @@
+""" testen voor de metrics per fase """
+import socket
+import unittest
+
+import metrics
+
+
+class TestMetrics(unittest.TestCase):
+  def test_histogram(self):
+    histogram = metrics.Histogram('test_seconds', 'Test.', ('stage',), buckets=(0.1, 1.0))
+    metrics.REGISTRY.remove(histogram)
+    histogram.observe(0.05, stage='dns')
+    histogram.observe(0.5, stage='dns')
+    verwachting = ['# HELP test_seconds Test.',
+                   '# TYPE test_seconds histogram',
+                   'test_seconds_bucket{stage="dns",le="0.1"} 1',
+                   'test_seconds_bucket{stage="dns",le="1.0"} 2',
+                   'test_seconds_bucket{stage="dns",le="+Inf"} 2',
+                   'test_seconds_sum{stage="dns"} 0.55',
+                   'test_seconds_count{stage="dns"} 2']
+    assert histogram.render() == verwachting
+
+  def test_stage(self):
+    with metrics.stage('teststage', 'ipv4'):
+      assert metrics.INFLIGHT.values[('teststage',)] == 1
+    with self.assertRaises(socket.timeout):
+      with metrics.stage('teststage', 'ipv4'):
+        raise socket.timeout()
+    with self.assertRaises(ValueError):
+      with metrics.stage('teststage', 'ipv4'):
+        raise ValueError()
+    assert metrics.INFLIGHT.values[('teststage',)] == 0
+    assert metrics.ERRORS.values[('teststage', 'ipv4', 'timeout')] == 1
+    assert metrics.ERRORS.values[('teststage', 'ipv4', 'error')] == 1
+    assert metrics.STAGESECONDS.counts[('teststage', 'ipv4', 'ok')][-1] == 1
+
+  def test_render(self):
+    resultaat = metrics.render(['extra 1'])
+    assert '# TYPE sslcheck_stage_inflight gauge' in resultaat
+    assert resultaat.endswith('extra 1\n')
@@ -0,0 +1,95 @@
+""" testen voor de certificaat-monitor """
+import os
+import tempfile
+import time
+import unittest
+from unittest.mock import MagicMock
+
+import monitor
+
+GELDIG = {'host': 'test.nl',
+          'ipresponses': {'ipv4data': {'addresses': [{'ip': '1.2.3.4', 'httpreponse': '200',
+                                                      'cert': {'CN': 'test.nl', 'issuer': 'CA',
+                                                               'validuntil': '2030-01-01 00:00:00'},
+                                                      'tls': {'TLSv1_2': True, 'TLSv1_3': True}},
+                                                     {'ip': '1.2.3.5', 'httpreponse': '200',
+                                                      'cert': {'CN': 'test.nl', 'issuer': 'CA',
+                                                               'validuntil': '2030-06-01 00:00:00'},
+                                                      'tls': {'TLSv1_2': True, 'TLSv1_3': True}}]},
+                          'ipv6data': {'addresses': []}}}
+FOUT = {'host': 'test.nl',
+        'ipresponses': {'ipv4data': {'addresses': [{'ip': '1.2.3.4', 'httpreponse': '200',
+                                                    'cert': {'error': 'Error getting cert'},
+                                                    'tls': {'TLSv1_2': False, 'TLSv1_3': False}}]}}}
+
+
+class TestMonitor(unittest.TestCase):
+  def setUp(self):
+    self.tmp = tempfile.TemporaryDirectory()
+    self.dbpath = os.path.join(self.tmp.name, 'monitor.db')
+    self.probe = MagicMock(return_value=GELDIG)
+    self.monitor = monitor.Monitor(self.dbpath, self.probe, mininterval=600, maxinterval=86400, retry=300)
+
+  def tearDown(self):
+    self.monitor.stop()
+    self.tmp.cleanup()
+
+  def test_validuntil_failed(self):
+    assert monitor.validuntil(GELDIG) == 1893456000
+    assert monitor.validuntil(FOUT) is None
+    assert not monitor.failed(GELDIG)
+    assert monitor.failed(FOUT)
+    assert monitor.failed({'host': 'test.nl', 'error': 'ValueError'})
+    assert monitor.failed({'host': 'test.nl', 'ipresponses': {'ipv6data': {'error': 'timed out'}}})
+
+  def test_interval(self):
+    now = 1893456000 - 30 * 86400
+    assert self.monitor.interval(GELDIG, 0, now) == 86400
+    assert self.monitor.interval(GELDIG, 0, 1893456000 - 86400) == 8640
+    assert self.monitor.interval(GELDIG, 0, 1893456000 + 86400) == 600
+    assert self.monitor.interval(FOUT, 1, now) == 300
+    assert self.monitor.interval(FOUT, 3, now) == 1200
+    assert self.monitor.interval(FOUT, 20, now) == 86400
+
+  def test_check(self):
+    self.monitor.add('Test.nl')
+    self.monitor.add('test.nl')
+    assert self.monitor.duehosts(time.time()) == ['test.nl']
+    assert self.monitor.duehosts(time.time()) == []
+    self.probe.return_value = FOUT
+    self.monitor.check('test.nl')
+    self.monitor.check('test.nl')
+    hosts = self.monitor.hosts()
+    assert len(hosts) == 1
+    assert hosts[0]['failures'] == 2
+    assert 0 < hosts[0]['nextcheck'] - hosts[0]['lastcheck'] <= 600
+    assert self.monitor.result('test.nl') == dict(FOUT, checked=hosts[0]['lastcheck'])
+
+  def test_persistent(self):
+    self.monitor.add('test.nl')
+    self.monitor.check('test.nl')
+    tweede = monitor.Monitor(self.dbpath, self.probe)
+    resultaat = tweede.result('TEST.NL')
+    assert resultaat.pop('checked') <= time.time()
+    assert resultaat == GELDIG
+    assert tweede.duehosts(time.time()) == []
+    tweede.stop()
+
+  def test_remove(self):
+    self.monitor.add('test.nl')
+    self.monitor.remove('test.nl')
+    assert self.monitor.hosts() == []
+    assert self.monitor.duehosts(time.time()) == []
+    assert self.monitor.result('test.nl') is None
+
+  def test_run(self):
+    self.monitor.start()
+    self.monitor.add('test.nl')
+    for _ in range(100):
+      if self.monitor.result('test.nl') is not None:
+        break
+      time.sleep(0.01)
+    resultaat = self.monitor.result('test.nl')
+    assert resultaat.pop('checked') <= time.time()
+    assert resultaat == GELDIG
+    self.probe.assert_called_once_with('test.nl')
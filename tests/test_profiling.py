@@ -0,0 +1,66 @@
+""" testen voor het profileren van losse requests """
+import json
+import os
+import pstats
+import tempfile
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch
+
+import metrics
+import profiling
+
+
+def werk(getal: int) -> int:
+  with metrics.stage('test', host='a.nl'):
+    return getal * 2
+
+
+class TestProfiler(unittest.TestCase):
+  def setUp(self):
+    self.tmp = tempfile.TemporaryDirectory()
+    self.patcher = patch('profiling.profiledir', self.tmp.name)
+    self.patcher.start()
+
+  def tearDown(self):
+    self.patcher.stop()
+    self.tmp.cleanup()
+
+  def test_off(self):
+    with ThreadPoolExecutor(1) as pool:
+      assert profiling.submit(pool, werk, 2).result() == 4
+    assert profiling.current.get() is None
+
+  def test_run(self):
+    profiler = profiling.Profiler('GET /test')
+    with ThreadPoolExecutor(2) as pool:
+      resultaat = profiler.run(lambda: [future.result() for future in
+                                        [profiling.submit(pool, werk, getal) for getal in range(3)]])
+    assert resultaat == [0, 2, 4]
+    assert profiling.current.get() is None
+    profiler.save()
+    with open(os.path.join(self.tmp.name, f'{profiler.profileid}.json'), encoding='utf-8') as trace:
+      spans = json.load(trace)['spans']
+    assert sorted(span['name'] for span in spans) == ['test'] * 3 + ['werk'] * 3
+    assert all(span['thread'].startswith('ThreadPoolExecutor') for span in spans)
+    assert {span['host'] for span in spans if span['name'] == 'test'} == {'a.nl'}
+    assert all(span['queued'] >= 0 for span in spans if span['name'] == 'werk')
+    stats = pstats.Stats(os.path.join(self.tmp.name, f'{profiler.profileid}.prof'))
+    assert any(func == 'werk' for _, _, func in stats.stats)
+
+  def test_iterator(self):
+    profiler = profiling.Profiler('GET /stream')
+    gesloten = []
+
+    class Stroom:
+      def __iter__(self):
+        return iter(['a', 'b'])
+
+      def close(self):
+        gesloten.append(True)
+
+    stroom = profiling.ProfiledIterator(Stroom(), profiler)
+    assert list(stroom) == ['a', 'b']
+    stroom.close()
+    assert gesloten == [True]
+    assert sorted(os.listdir(self.tmp.name)) == [f'{profiler.profileid}.json', f'{profiler.profileid}.prof']
@@ -0,0 +1,72 @@
+import threading
+import time
+
+import metrics
+from ratelimit import FairBucket, RateLimiter
+
+
+def test_bucket_burst():
+  bucket = FairBucket(rate=1, burst=2)
+  assert bucket.acquire('a.nl') < 0.01
+  assert bucket.acquire('a.nl') < 0.01
+  assert bucket.acquire('a.nl', timeout=0.05) is None
+  assert bucket.idle() is False
+
+
+def test_bucket_wait():
+  bucket = FairBucket(rate=20, burst=1)
+  bucket.acquire('a.nl')
+  gewacht = bucket.acquire('a.nl', timeout=1)
+  assert 0.02 < gewacht < 0.5
+
+
+def test_bucket_timeout_finish():
+  bucket = FairBucket(rate=1, burst=1)
+  bucket.acquire('a.nl')
+  for nummer in range(3):
+    assert bucket.acquire(f'h{nummer}.nl', timeout=0.01) is None
+  assert bucket.finish == {}
+
+
+def test_bucket_timeout_waiting():
+  bucket = FairBucket(rate=1, burst=1)
+  bucket.acquire('a.nl')
+  wachter = threading.Thread(target=bucket.acquire, args=('b.nl',), kwargs={'timeout': 0.3})
+  wachter.start()
+  time.sleep(0.05)
+  assert bucket.acquire('b.nl', timeout=0.01) is None
+  assert bucket.finish == {'b.nl': 2.0}
+  wachter.join()
+  assert bucket.finish == {}
+
+
+def test_bucket_fair():
+  bucket = FairBucket(rate=50, burst=1)
+  bucket.acquire('groot.nl')
+  volgorde = []
+  lock = threading.Lock()
+
+  def probe(owner):
+    bucket.acquire(owner, timeout=5)
+    with lock:
+      volgorde.append(owner)
+
+  threads = [threading.Thread(target=probe, args=('groot.nl',)) for _ in range(6)]
+  for thread in threads:
+    thread.start()
+  time.sleep(0.01)
+  threads.append(threading.Thread(target=probe, args=('klein.nl',)))
+  threads[-1].start()
+  for thread in threads:
+    thread.join()
+  assert volgorde.index('klein.nl') < 3
+
+
+def test_ratelimiter():
+  limiter = RateLimiter({'ip': (1, 1), 'resolver': (0, 0), 'global': (100, 100)})
+  assert limiter.bucket('resolver', '1.1.1.1') is None
+  assert limiter.acquire('ip', '1.2.3.4', 'a.nl') < 0.01
+  assert limiter.acquire('ip', '1.2.3.5', 'a.nl') < 0.01
+  assert limiter.acquire('ip', '1.2.3.4', 'a.nl', timeout=0.01) is None
+  assert limiter.acquire('resolver', '1.1.1.1', 'a.nl') < 0.01
+  assert 'sslcheck_ratelimit_timeouts_total{limit="ip"}' in metrics.render()
@@ -0,0 +1,25 @@
+from flask import Flask, request
+
+import recordset
+
+
+def test_normalize():
+  resultaat = recordset.normalize({'MX': ['20 b.nl.', '10 a.nl.'], 'A': ['1.2.3.4', '1.2.3.4']})
+  assert resultaat == {'A': ['1.2.3.4'], 'MX': ['10 a.nl.', '20 b.nl.']}
+  assert list(resultaat) == ['A', 'MX']
+
+
+def test_etag():
+  eerste = recordset.etag({'host': 'a.nl', 'resolvers': {'default': {'A': ['1.2.3.4']}}})
+  tweede = recordset.etag({'resolvers': {'default': {'A': ['1.2.3.4']}}, 'host': 'a.nl'})
+  assert eerste == tweede
+  assert eerste != recordset.etag({'host': 'a.nl', 'resolvers': {'default': {'A': ['1.2.3.5']}}})
+
+
+def test_wantsjson():
+  app = Flask(__name__)
+  verwachting = {'application/json': True, 'text/html,application/json;q=0.9': False,
+                 '*/*': False, '': False}
+  for accept, json in verwachting.items():
+    with app.test_request_context(headers={'Accept': accept} if accept else {}):
+      assert recordset.wantsjson(request) == json
@@ -0,0 +1,56 @@
+from unittest.mock import patch
+
+from resolverhealth import MINTIMEOUT, ResolverHealth
+
+
+def test_timeout():
+  health = ResolverHealth(maxtimeout=5.0)
+  assert health.timeout('1.1.1.1') == 5.0
+  health.record('1.1.1.1', 0.1, True)
+  assert health.timeout('1.1.1.1') == MINTIMEOUT
+  health.record('1.1.1.1', 0.6, True)
+  assert round(health.timeout('1.1.1.1'), 2) == 1.0
+  health.record('1.1.1.1', 5.0, False)
+  assert round(health.timeout('1.1.1.1'), 2) == 1.0
+
+
+def test_breaker():
+  health = ResolverHealth(failurerate=0.5, cooldown=60)
+  with patch('time.monotonic', return_value=1000):
+    health.record('1.1.1.1', 5.0, False)
+    assert health.allow('1.1.1.1')
+    health.record('1.1.1.1', 5.0, False)
+    assert not health.allow('1.1.1.1')
+    assert health.snapshot()['1.1.1.1'] == {'latency': None, 'failurerate': 0.51, 'queries': 2, 'open': True}
+  with patch('time.monotonic', return_value=1061):
+    assert health.allow('1.1.1.1')
+    assert not health.allow('1.1.1.1')
+    health.record('1.1.1.1', 0.1, True)
+    assert health.allow('1.1.1.1')
+    assert not health.snapshot()['1.1.1.1']['open']
+
+
+def test_breaker_trial_failed():
+  health = ResolverHealth(failurerate=0.5, cooldown=60)
+  with patch('time.monotonic', return_value=1000):
+    health.record('1.1.1.1', 5.0, False)
+    health.record('1.1.1.1', 5.0, False)
+  with patch('time.monotonic', return_value=1061):
+    assert health.allow('1.1.1.1')
+    health.record('1.1.1.1', 5.0, False)
+    assert not health.allow('1.1.1.1')
+  health.clear()
+  assert health.snapshot() == {}
+
+
+def test_breaker_trial_released():
+  health = ResolverHealth(failurerate=0.5, cooldown=60)
+  with patch('time.monotonic', return_value=1000):
+    health.record('1.1.1.1', 5.0, False)
+    health.record('1.1.1.1', 5.0, False)
+  with patch('time.monotonic', return_value=1061):
+    assert health.allow('1.1.1.1')
+    assert not health.allow('1.1.1.1')
+    health.release('1.1.1.1')
+    assert health.allow('1.1.1.1')
+  assert health.snapshot()['1.1.1.1']['queries'] == 2
@@ -0,0 +1,55 @@
+""" testen voor het compacte resultaatmodel en de CSV-export """
+import csv
+import io
+import json
+import unittest
+
+import resultmodel
+
+GELDIG = {'host': 'test.nl',
+          'ipresponses': {'ipv4data': {'addresses': [{'ip': '1.2.3.4', 'httpreponse': '200',
+                                                      'cert': {'CN': 'test.nl', 'issuer': 'CA',
+                                                               'validuntil': '2030-01-01 00:00:00'},
+                                                      'tls': {'TLSv1_2': True, 'TLSv1_3': False}},
+                                                     {'ip': '1.2.3.5', 'httpreponse': 'timed out',
+                                                      'cert': {'error': 'Error getting cert'},
+                                                      'tls': {'TLSv1_2': False, 'TLSv1_3': 'timed out'}}],
+                                       'timings': {'dns': 0.1}},
+                          'ipv6data': {'error': 'timed out'}},
+          'timings': {'total': 1.5}}
+
+
+class TestResultModel(unittest.TestCase):
+  def test_roundtrip(self):
+    for resultaat in [GELDIG,
+                      {'host': 'leeg.nl', 'ipresponses': {'ipv4data': {}, 'ipv6data': {'addresses': []}}},
+                      {'host': 'fout.nl', 'error': 'ValueError: fout'}]:
+      compact = resultmodel.compact(resultaat)
+      assert json.dumps(resultmodel.expand(compact)) == json.dumps(resultaat)
+
+  def test_compact(self):
+    eerste = resultmodel.compact(GELDIG)
+    tweede = resultmodel.compact(json.loads(json.dumps(GELDIG)))
+    assert eerste == tweede
+    assert eerste.ipresponses[0].addresses[0].cert.issuer is tweede.ipresponses[0].addresses[0].cert.issuer
+    assert eerste.ipresponses[0].addresses[1].tls == (False, 'timed out')
+
+  def test_ssl(self):
+    probes = ({'CN': 'test.nl', 'issuer': 'CA', 'validuntil': '2030-01-01 00:00:00'},
+              {'TLSv1_2': True, 'TLSv1_3': True})
+    compact = resultmodel.compactssl(probes)
+    assert resultmodel.expandssl(compact) == probes
+    assert resultmodel.expandssl(json.loads(json.dumps(compact))) == probes
+
+  def test_exportcsv(self):
+    uitvoer = io.StringIO()
+    regels = [json.dumps(GELDIG), '', json.dumps({'host': 'fout.nl', 'error': 'ValueError: fout'})]
+    assert resultmodel.exportcsv(regels, uitvoer) == 2
+    rijen = list(csv.DictReader(io.StringIO(uitvoer.getvalue())))
+    assert [(rij['host'], rij['ipversion'], rij['ip'], rij['error']) for rij in rijen] == \
+           [('test.nl', 'ipv4data', '1.2.3.4', ''), ('test.nl', 'ipv4data', '1.2.3.5', ''),
+            ('test.nl', 'ipv6data', '', 'timed out'), ('fout.nl', '', '', 'ValueError: fout')]
+    assert rijen[0]['issuer'] == 'CA'
+    assert (rijen[0]['TLSv1_2'], rijen[0]['TLSv1_3']) == ('True', 'False')
+    assert (rijen[1]['certerror'], rijen[1]['CN'], rijen[1]['TLSv1_3']) == \
+           ('Error getting cert', '', 'timed out')
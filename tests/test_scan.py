@@ -0,0 +1,79 @@
+""" testen voor de fleet-scan """
+import json
+import os
+import tempfile
+import time
+import unittest
+from unittest.mock import patch
+
+import scan
+
+
+class TestScan(unittest.TestCase):
+  def setUp(self):
+    self.tmp = tempfile.TemporaryDirectory()
+    self.resultaten = os.path.join(self.tmp.name, 'resultaat.ndjson')
+    self.changedb = patch('sslcheck.changedb', os.path.join(self.tmp.name, 'wijzigingen.db'))
+    self.changedb.start()
+
+  def tearDown(self):
+    self.changedb.stop()
+    self.tmp.cleanup()
+
+  def test_readhosts(self):
+    resultaat = list(scan.readhosts(['a.nl\n', '\n', '# commentaar\n', ' b.nl # tweede\n']))
+    assert resultaat == ['a.nl', 'b.nl']
+
+  def test_readcheckpoint(self):
+    with open(self.resultaten, 'wb') as resultfile:
+      resultfile.write(b'{"host": "a.nl"}\n{"host": "b.nl"}\n{"host": "c.')
+    resultaat = scan.readcheckpoint(self.resultaten)
+    assert resultaat == {'a.nl', 'b.nl'}
+    with open(self.resultaten, 'rb') as resultfile:
+      assert resultfile.read() == b'{"host": "a.nl"}\n{"host": "b.nl"}\n'
+
+  def test_readcheckpoint_missing(self):
+    assert scan.readcheckpoint(self.resultaten + '.bestaatniet') == set()
+
+  @patch('sslcheck.getinfo', side_effect=lambda host, usecache: {'host': host})
+  def test_main_resume(self, mock_info):
+    hostlijst = os.path.join(self.tmp.name, 'hosts.txt')
+    with open(self.resultaten, 'w', encoding='utf-8') as resultfile:
+      resultfile.write('{"host": "a.nl"}\n{"host": "b')
+    with open(hostlijst, 'w', encoding='utf-8') as hostfile:
+      hostfile.write('a.nl\nb.nl\nc.nl\nc.nl\n')
+    resultaat = scan.main([hostlijst, '-o', self.resultaten, '-w', '2'])
+    assert resultaat == 0
+    with open(self.resultaten, encoding='utf-8') as resultfile:
+      hosts = [json.loads(line)['host'] for line in resultfile]
+    assert hosts[0] == 'a.nl'
+    assert sorted(hosts[1:]) == ['b.nl', 'c.nl']
+    assert mock_info.call_count == 2
+    assert os.path.exists(os.path.join(self.tmp.name, 'wijzigingen.db'))
+    assert scan.sslcheck.changefeed is None
+
+  def test_throttle(self):
+    throttle = scan.Throttle(100)
+    start = time.monotonic()
+    for _ in range(5):
+      throttle.wait()
+    assert time.monotonic() - start >= 0.04
+
+  @patch('sslcheck.getinfo', side_effect=lambda host, usecache: {'host': host, 'error': 'ValueError: fout'})
+  def test_main_csv(self, mock_info):
+    hostlijst = os.path.join(self.tmp.name, 'hosts.txt')
+    csvbestand = os.path.join(self.tmp.name, 'resultaat.csv')
+    with open(hostlijst, 'w', encoding='utf-8') as hostfile:
+      hostfile.write('a.nl\n')
+    assert scan.main([hostlijst, '-o', self.resultaten, '--csv', csvbestand]) == 0
+    with open(csvbestand, encoding='utf-8') as csvfile:
+      regels = csvfile.read().splitlines()
+    assert regels[0].startswith('host,ipversion,ip,httpreponse,CN,')
+    assert regels[1:] == ['a.nl' + ',' * (len(regels[0].split(',')) - 2) + ',ValueError: fout']
+
+  def test_scanhosts_nodes(self):
+    with patch('shard.postbatch', side_effect=lambda node, hosts, apikey, timeout:
+               iter([{'host': host, 'node': node} for host in hosts])) as mock_batch, \
+        open(self.resultaten, 'w', encoding='utf-8') as resultfile:
+      assert scan.scanhosts(['a.nl', 'b.nl'], resultfile, nodes=['http://a:8082']) == 2
+    mock_batch.assert_called_once_with('http://a:8082', ['a.nl', 'b.nl'], 'MySecret', 120)
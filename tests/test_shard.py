@@ -0,0 +1,134 @@
+""" testen voor het verdelen van een scan over meerdere sslcheck-nodes """
+import threading
+import unittest
+from collections import Counter
+from unittest.mock import MagicMock, patch
+
+import requests
+
+import shard
+
+NODES = ['http://a:8082', 'http://b:8082', 'http://c:8082']
+HOSTS = [f'host{nummer}.nl' for nummer in range(300)]
+
+
+class TestHashRing(unittest.TestCase):
+  def test_spread(self):
+    ring = shard.HashRing(NODES)
+    verdeling = Counter(ring.node(host) for host in HOSTS)
+    assert set(verdeling) == set(NODES)
+    assert min(verdeling.values()) > 50
+    assert ring.node('Host1.nl') == ring.node('host1.nl')
+
+  def test_exclude(self):
+    ring = shard.HashRing(NODES)
+    for host in HOSTS:
+      eerste = ring.node(host)
+      tweede = ring.node(host, [NODES[0]])
+      assert tweede != NODES[0]
+      if eerste != NODES[0]:
+        assert tweede == eerste
+    assert ring.node('a.nl', NODES) is None
+
+
+class TestPostBatch(unittest.TestCase):
+  @patch('requests.post')
+  def test_postbatch(self, mock_post):
+    response = mock_post.return_value.__enter__.return_value
+    response.headers = {'Content-Type': 'application/x-ndjson'}
+    response.iter_lines.return_value = [b'{"host": "a.nl"}', b'', b'{"host": "b.nl"}']
+    resultaat = list(shard.postbatch('http://a:8082/', ['a.nl', 'b.nl'], 'MySecret', 5))
+    assert resultaat == [{'host': 'a.nl'}, {'host': 'b.nl'}]
+    mock_post.assert_called_once_with('http://a:8082/sslcheck/batch', json=['a.nl', 'b.nl'],
+                                      headers={'Apikey': 'MySecret'}, stream=True, timeout=5)
+
+  @patch('requests.post')
+  def test_postbatch_apikey(self, mock_post):
+    response = mock_post.return_value.__enter__.return_value
+    response.headers = {'Content-Type': 'text/html; charset=utf-8'}
+    response.text = 'Invalid apikey'
+    with self.assertRaises(ValueError):
+      list(shard.postbatch('http://a:8082', ['a.nl'], 'fout', 5))
+
+
+class TestCoordinator(unittest.TestCase):
+  def test_run(self):
+    gezien = Counter()
+    lock = threading.Lock()
+
+    def postbatch(node, hosts, apikey, timeout):
+      with lock:
+        gezien.update({node: len(hosts)})
+      for host in hosts:
+        yield {'host': host, 'node': node}
+
+    with patch('shard.postbatch', side_effect=postbatch):
+      resultaten = list(shard.Coordinator(NODES, 'MySecret', chunk=7).run(iter(HOSTS)))
+    assert sorted(resultaat['host'] for resultaat in resultaten) == sorted(HOSTS)
+    ring = shard.HashRing(NODES)
+    assert all(resultaat['node'] == ring.node(resultaat['host']) for resultaat in resultaten)
+    assert sum(gezien.values()) == len(HOSTS)
+
+  def test_dead_node(self):
+    def postbatch(node, hosts, apikey, timeout):
+      if node == NODES[0]:
+        yield {'host': hosts[0], 'node': node}
+        raise requests.ConnectionError('weg')
+      for host in hosts:
+        yield {'host': host, 'node': node}
+
+    with patch('shard.postbatch', side_effect=postbatch):
+      resultaten = list(shard.Coordinator(NODES, 'MySecret', chunk=10).run(HOSTS))
+    assert sorted(resultaat['host'] for resultaat in resultaten) == sorted(HOSTS)
+    verdeling = Counter(resultaat['node'] for resultaat in resultaten)
+    assert 0 < verdeling[NODES[0]] <= 2
+    assert 'error' not in str(resultaten)
+
+  def test_busy(self):
+    bezet = requests.HTTPError(response=MagicMock(status_code=503, headers={'Retry-After': '0'}))
+    pogingen = Counter()
+
+    def postbatch(node, hosts, apikey, timeout):
+      pogingen[node] += 1
+      if pogingen[node] == 1:
+        raise bezet
+      for host in hosts:
+        yield {'host': host}
+
+    with patch('shard.postbatch', side_effect=postbatch):
+      resultaten = list(shard.Coordinator(NODES[:1], 'MySecret', connections=1).run(['a.nl', 'b.nl']))
+    assert sorted(resultaat['host'] for resultaat in resultaten) == ['a.nl', 'b.nl']
+    assert pogingen[NODES[0]] == 2
+
+  def test_busy_retries(self):
+    bezet = requests.HTTPError(response=MagicMock(status_code=503, headers={'Retry-After': '0'}))
+    pogingen = Counter()
+
+    def postbatch(node, hosts, apikey, timeout):
+      pogingen[node] += 1
+      if node == NODES[0]:
+        raise bezet
+      for host in hosts:
+        yield {'host': host, 'node': node}
+
+    with patch('shard.postbatch', side_effect=postbatch):
+      resultaten = list(shard.Coordinator(NODES[:2], 'MySecret', busyretries=3).run(HOSTS[:20]))
+    assert sorted(resultaat['host'] for resultaat in resultaten) == sorted(HOSTS[:20])
+    assert all(resultaat['node'] == NODES[1] for resultaat in resultaten)
+    assert pogingen[NODES[0]] == 4
+
+  def test_no_live_node(self):
+    def postbatch(node, hosts, apikey, timeout):
+      raise ValueError('Invalid apikey')
+      yield  # pylint: disable=unreachable
+
+    with patch('shard.postbatch', side_effect=postbatch):
+      resultaten = list(shard.Coordinator(NODES[:2], 'fout', chunk=5).run(HOSTS[:20]))
+    assert len(resultaten) == 20
+    assert all(resultaat['error'].startswith(shard.NOLIVENODE) for resultaat in resultaten)
+    assert 'Invalid apikey' in resultaten[0]['error']
+
+  def test_missing_result(self):
+    with patch('shard.postbatch', side_effect=lambda node, hosts, apikey, timeout: iter([])):
+      resultaten = list(shard.Coordinator(NODES[:1], 'MySecret').run(['a.nl']))
+    assert resultaten == [{'host': 'a.nl', 'error': f'No result from {NODES[0]}'}]
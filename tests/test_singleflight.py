@@ -0,0 +1,58 @@
+""" testen voor het samenvoegen van gelijktijdige aanroepen """
+import threading
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+from singleflight import SingleFlight
+
+
+class TestSingleFlight(unittest.TestCase):
+  def setUp(self):
+    self.flights = SingleFlight('test')
+    self.gestart = threading.Event()
+    self.klaar = threading.Event()
+    self.aanroepen = 0
+
+  def traag(self, waarde):
+    self.aanroepen += 1
+    self.gestart.set()
+    self.klaar.wait(5)
+    if isinstance(waarde, Exception):
+      raise waarde
+    return waarde
+
+  def wachtenden(self, aantal: int) -> None:
+    while metrics.COALESCED.values.get(('test',), 0) < aantal:
+      threading.Event().wait(0.01)
+
+  def test_samenvoegen(self):
+    metrics.COALESCED.values.pop(('test',), None)
+    with ThreadPoolExecutor(max_workers=3) as executor:
+      eerste = executor.submit(self.flights.do, 'a', self.traag, 1)
+      self.gestart.wait(5)
+      tweede = executor.submit(self.flights.do, 'a', self.traag, 2)
+      ander = executor.submit(self.flights.do, 'b', lambda: 3)
+      assert ander.result() == 3
+      self.wachtenden(1)
+      assert self.flights.inflight() == 1
+      self.klaar.set()
+      assert eerste.result() == 1
+      assert tweede.result() == 1
+    assert self.aanroepen == 1
+    assert self.flights.inflight() == 0
+    assert self.flights.do('a', lambda: 4) == 4
+
+  def test_exception(self):
+    metrics.COALESCED.values.pop(('test',), None)
+    with ThreadPoolExecutor(max_workers=2) as executor:
+      eerste = executor.submit(self.flights.do, 'a', self.traag, ValueError('fout'))
+      self.gestart.wait(5)
+      tweede = executor.submit(self.flights.do, 'a', self.traag, 2)
+      self.wachtenden(1)
+      self.klaar.set()
+      with self.assertRaises(ValueError):
+        eerste.result()
+      with self.assertRaises(ValueError):
+        tweede.result()
+    assert self.flights.inflight() == 0
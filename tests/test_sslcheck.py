@@ -1,12 +1,22 @@
 """ testen voor de sslchecker """
 import os
+import ssl
+import subprocess
+import time
 import unittest
+from concurrent.futures import ThreadPoolExecutor
 from unittest.mock import patch, MagicMock
 
 import requests
 from pytest import mark
 
+import httpprobe
+import dnsquery
 import sslcheck
+import tlsprobe
+from changefeed import ChangeFeed
+from deadline import Deadline
+from resolverhealth import ResolverHealth
 
 IN_GITHUB_ACTIONS = os.getenv("GITHUB_ACTIONS") == "true"
 
@@ -16,11 +26,15 @@ class TestDig(unittest.TestCase):
               'issuer': 'CA',
               'validuntil': '2024-12-29 10:11:12'}
 
-  @patch('sslcheck.gettlsinfo', side_effect=[{'TLSv1_2': False, 'TLSv1_3': True}, {'TLSv1_2': True, 'TLSv1_3': False}])
-  @patch('sslcheck.getcertinfo', side_effect=[certinfo, certinfo])
-  @patch('pydig.query', side_effect=[['1.2.3.4'], ['1:2::3:0']])
-  @patch('requests.get')
-  def test_getinfo(self, mock_requestsget, mock_pydigquery, mock_getcertinfo, mock_gettlsinfo):
+  tlsinfo = {'ipv4': {'TLSv1_2': False, 'TLSv1_3': True},
+             'ipv6': {'TLSv1_2': True, 'TLSv1_3': False}}
+  digresult = {'A': ['1.2.3.4'], 'AAAA': ['1:2::3:0']}
+
+  @patch('sslcheck.getsslinfo',
+         side_effect=lambda host, ipversion, deadline, ipaddress: (TestDig.certinfo, TestDig.tlsinfo[ipversion]))
+  @patch('pydig.query', side_effect=lambda host, recordtype: TestDig.digresult[recordtype])
+  @patch('requests.Session.request')
+  def test_getinfo(self, mock_requestsget, mock_pydigquery, mock_getsslinfo):
     mock_requestsget_response = MagicMock()
     mock_requestsget_response.status_code = 200
     mock_requestsget_response.get.return_value = mock_requestsget_response
@@ -28,29 +42,60 @@ class TestDig(unittest.TestCase):
 
     verwachting = {'host': 'www.vanderiethattem.nl',
                    'ipresponses': {'ipv4data': {'addresses': [{'httpreponse': '200',
-                                                               'ip': '1.2.3.4'}],
-                                                'cert': {'CN': 'vanderiethattem.nl',
-                                                         'issuer': 'CA',
-                                                         'validuntil': '2024-12-29 10:11:12'},
-                                                'tls': {'TLSv1_2': False, 'TLSv1_3': True}},
+                                                               'ip': '1.2.3.4',
+                                                               'cert': TestDig.certinfo,
+                                                               'tls': {'TLSv1_2': False, 'TLSv1_3': True}}]},
                                    'ipv6data': {'addresses': [{'httpreponse': '200',
-                                                               'ip': '1:2::3:0'}],
-                                                'cert': {'CN': 'vanderiethattem.nl',
-                                                         'issuer': 'CA',
-                                                         'validuntil': '2024-12-29 10:11:12'},
-                                                'tls': {'TLSv1_2': True, 'TLSv1_3': False}}}}
+                                                               'ip': '1:2::3:0',
+                                                               'cert': TestDig.certinfo,
+                                                               'tls': {'TLSv1_2': True, 'TLSv1_3': False}}]}}}
     resultaat = sslcheck.getinfo("www.vanderiethattem.nl")
     assert mock_requestsget.called
     assert mock_pydigquery.called
-    assert mock_getcertinfo.called
-    assert mock_gettlsinfo.called
+    assert mock_getsslinfo.call_count == 2
+    mock_getsslinfo.assert_any_call('www.vanderiethattem.nl', 'ipv4', unittest.mock.ANY, '1.2.3.4')
+    mock_getsslinfo.assert_any_call('www.vanderiethattem.nl', 'ipv6', unittest.mock.ANY, '1:2::3:0')
     self.assertEqual(resultaat, verwachting)
 
+  @patch('sslcheck.getsslinfo', return_value=({'CN': 'test.nl', 'issuer': 'CA',
+                                                'validuntil': '2999-12-31 10:11:12'},
+                                               {'TLSv1_2': True, 'TLSv1_3': True}))
+  @patch('sslcheck.gethttpstatus', return_value='200')
+  @patch('pydig.query', return_value=['1.2.3.4'])
+  def test_getipinfo_cache(self, mock_pydigquery, mock_gethttpstatus, mock_getsslinfo):
+    eerste = sslcheck.getipinfo('test.nl')
+    tweede = sslcheck.getipinfo('test.nl')
+    assert eerste == tweede
+    assert mock_getsslinfo.call_count == 1
+    assert mock_gethttpstatus.call_count == 2
+    sslcheck.getipinfo('test.nl', usecache=False)
+    assert mock_getsslinfo.call_count == 2
+    assert mock_pydigquery.call_count == 2
+
+  @patch('sslcheck.checkbranches',
+         side_effect=lambda host, usecache, timings, deadline: time.sleep(0.2) or {'host': host})
+  def test_getinfo_coalesce(self, mock_checkbranches):
+    with ThreadPoolExecutor(max_workers=3) as executor:
+      resultaten = list(executor.map(sslcheck.getinfo, ['test.nl', 'TEST.nl', 'ander.nl']))
+    assert resultaten == [{'host': 'test.nl'}, {'host': 'TEST.nl'}, {'host': 'ander.nl'}]
+    assert mock_checkbranches.call_count == 2
+
+  def test_probettl(self):
+    assert sslcheck.probettl({'error': 'Error getting cert'}) == 0
+    assert sslcheck.probettl(self.certinfo) < 0
+    assert sslcheck.probettl({'validuntil': '2999-12-31 10:11:12'}) == sslcheck.probecachettl
+
   def test_getip(self):
-    called, hostlist = sslcheck.getip("www.vanderiethattem.nl", 'ipv8')
+    called, hostlist = dnsquery.getip("www.vanderiethattem.nl", 'ipv8')
     assert called == False
 
-  @patch('requests.get')
+  @patch('pydig.query', side_effect=lambda host, recordtype: ['alias.test.nl.', '1.2.3.4'] if recordtype == 'A'
+         else ['alias.test.nl.', '1.2.3.4', '2001:db8::1'])
+  def test_getip_cname(self, mock_pydigquery):
+    assert dnsquery.getip('cname.test.nl', 'ipv4', usecache=False) == (True, ['1.2.3.4'])
+    assert dnsquery.getip('cname.test.nl', 'ipv6', usecache=False) == (True, ['2001:db8::1'])
+
+  @patch('requests.Session.request')
   def test_gethttpstatus(self, mock_requestsget):
     mock_requestsget_response = MagicMock()
     mock_requestsget_response.status_code = 200
@@ -62,41 +107,254 @@ class TestDig(unittest.TestCase):
     assert verwachting == resultaat
     assert mock_requestsget.called
 
-  @patch('requests.get', side_effect=requests.ConnectionError)
+  @patch('requests.Session.request', side_effect=requests.ConnectionError)
   def test_gethttpstatus_error(self, mock_requestsget):
     verwachting = 'failed to connect'
     resultaat = sslcheck.gethttpstatus('www.vanderiethattem.nl', '1.2.3.4')
     assert resultaat == verwachting
     assert mock_requestsget.called
 
+  @patch('requests.Session.request')
+  @patch('ratelimit.limiter.acquire', return_value=None)
+  def test_gethttpstatus_ratelimit(self, mock_acquire, mock_requestsget):
+    assert sslcheck.gethttpstatus('test.nl', '1.2.3.4') == 'timed out'
+    assert mock_acquire.call_args.kwargs['timeout'] == httpprobe.HTTPTIMEOUT
+    assert not mock_requestsget.called
+
+  def test_httpsession(self):
+    eerste = httpprobe.httpsession('1.2.3.4', 'test.nl')
+    assert httpprobe.httpsession('1.2.3.4', 'TEST.nl') is eerste
+    assert httpprobe.httpsession('1.2.3.5', 'test.nl') is not eerste
+    with patch('httpprobe.httpsessionsmax', 1):
+      httpprobe.httpsession('1.2.3.6', 'test.nl')
+      assert len(httpprobe.httpsessions) == 1
+
   def test_getcertinfo(self):
-    resultaat = sslcheck.getcertinfo('vanderiethattem.nl')
+    resultaat = tlsprobe.getcertinfo('vanderiethattem.nl')
     assert resultaat.get('CN') == 'vanderiethattem.nl'
     assert resultaat.get('issuer', None) is not None
     assert resultaat.get('CN', None) is not None
 
   def test_getcertinfo_error(self):
     verwachting = {'error': 'Error getting cert'}
-    resultaat = sslcheck.getcertinfo('www.domeinzondercertificaat.nl')
+    resultaat = tlsprobe.getcertinfo('www.domeinzondercertificaat.nl')
     assert verwachting == resultaat
 
   def test_getcertinfo_error_ipv6(self):
     verwachting = {'error': 'Error getting cert'}
-    resultaat = sslcheck.getcertinfo('www.domeinzondercertificaat.nl', 'ipv6')
+    resultaat = tlsprobe.getcertinfo('www.domeinzondercertificaat.nl', 'ipv6')
     assert verwachting == resultaat
 
   def test_gettlsinfo(self):
     verwachting = {'TLSv1_2': True, 'TLSv1_3': True}
-    resultaat = sslcheck.gettlsinfo('www.ncsc.nl')
+    resultaat = tlsprobe.gettlsinfo('www.ncsc.nl')
     assert resultaat == verwachting
 
   @mark.skipif(IN_GITHUB_ACTIONS, reason="Test doesn't work in Github Actions.")
   def test_gettlsinfo_ipv6(self):
     verwachting = {'TLSv1_2': True, 'TLSv1_3': True}
-    resultaat = sslcheck.gettlsinfo('www.ncsc.nl', 'ipv6')
+    resultaat = tlsprobe.gettlsinfo('www.ncsc.nl', 'ipv6')
     assert resultaat == verwachting
 
   def test_gettlsinfo_error(self):
     verwachting = {'TLSv1_2': False, 'TLSv1_3': False}
-    resultaat = sslcheck.gettlsinfo('www.domeinzondercertificaat.nl')
+    resultaat = tlsprobe.gettlsinfo('www.domeinzondercertificaat.nl')
     assert resultaat == verwachting
+
+  def setUp(self):
+    dnsquery.dnscache.clear()
+    sslcheck.probecache.clear()
+
+  @patch('dnsquery.dodigresolver',
+         side_effect=lambda host, rectype, resolver, usecache, deadline: [resolver] if rectype == 'A' else [])
+  def test_digresolvers(self, mock_dodigresolver):
+    verwachting = {'1.1.1.1': {'A': ['1.1.1.1']}, '8.8.8.8': {'A': ['8.8.8.8']}}
+    resultaat = dict(dnsquery.digresolvers('test.nl', ['1.1.1.1', '8.8.8.8'], ['A', 'MX']))
+    assert resultaat == verwachting
+    assert mock_dodigresolver.call_count == 4
+
+  @patch('dnsquery.dodigresolver',
+         side_effect=lambda host, rectype, resolver, usecache, deadline:
+         time.sleep(1) or [] if rectype == 'MX' else [resolver])
+  def test_digresolvers_deadline(self, mock_dodigresolver):
+    verwachting = {None: {'A': [None], 'MX': ['timed out']}}
+    resultaat = dict(dnsquery.digresolvers('test.nl', [None], ['A', 'MX'], deadline=Deadline(0.2)))
+    assert resultaat == verwachting
+
+  @patch('sslcheck.getsslinfo', return_value=({'CN': 'test.nl', 'issuer': 'CA',
+                                                'validuntil': '2999-12-31 10:11:12'},
+                                               {'TLSv1_2': True, 'TLSv1_3': True}))
+  @patch('sslcheck.gethttpstatus', side_effect=lambda host, ipaddress, deadline: time.sleep(1))
+  @patch('pydig.query', return_value=['1.2.3.4'])
+  def test_getipinfo_deadline(self, mock_pydigquery, mock_gethttpstatus, mock_getsslinfo):
+    resultaat = sslcheck.getipinfo('test.nl', deadline=Deadline(0.2))
+    assert resultaat['addresses'][0]['httpreponse'] == 'timed out'
+    assert resultaat['addresses'][0]['cert']['CN'] == 'test.nl'
+
+  @patch('sslcheck.getsslinfo', return_value=({'CN': 'test.nl'}, {'TLSv1_3': True}))
+  @patch('sslcheck.gethttpstatus', return_value='200')
+  @patch('pydig.query', side_effect=lambda host, recordtype: ['1.2.3.4'] if recordtype == 'A' else [])
+  def test_getinfo_changefeed(self, mock_pydigquery, mock_gethttpstatus, mock_getsslinfo):
+    with patch('sslcheck.changefeed', ChangeFeed(':memory:')):
+      sslcheck.getinfo('feed.nl', usecache=False)
+      wijzigingen = sslcheck.changefeed.changes()['changes']
+    assert [(wijziging['host'], wijziging['section']) for wijziging in wijzigingen] == \
+           [('feed.nl', 'addresses'), ('feed.nl', 'cert'), ('feed.nl', 'tls')]
+
+  @patch('sslcheck.getsslinfo', return_value=({'CN': 'test.nl'}, {'TLSv1_3': True}))
+  @patch('sslcheck.gethttpstatus', return_value='200')
+  @patch('pydig.query', return_value=['1.2.3.4'])
+  def test_getipinfo_digpoolvol(self, mock_pydigquery, mock_gethttpstatus, mock_getsslinfo):
+    volpool = ThreadPoolExecutor(max_workers=1)
+    volpool.submit(time.sleep, 1)
+    with patch('dnsquery.digpool', volpool):
+      resultaat = sslcheck.getipinfo('volpool.nl', usecache=False, deadline=Deadline(0.5))
+    volpool.shutdown(wait=False)
+    assert resultaat['addresses'][0]['ip'] == '1.2.3.4'
+
+  @patch('sslcheck.getsslinfo', side_effect=lambda host, ipversion, deadline, ipaddress: time.sleep(1))
+  @patch('sslcheck.gethttpstatus', return_value='200')
+  @patch('pydig.query', side_effect=lambda host, recordtype: ['1.2.3.4'] if recordtype == 'A' else [])
+  def test_getinfo_deadline(self, mock_pydigquery, mock_gethttpstatus, mock_getsslinfo):
+    resultaat = sslcheck.getinfo('test.nl', deadline=Deadline(0.2))
+    ipv4data = resultaat['ipresponses']['ipv4data']
+    assert ipv4data['addresses'] == [{'ip': '1.2.3.4', 'httpreponse': '200',
+                                      'cert': {'error': 'timed out'},
+                                      'tls': {'TLSv1_2': 'timed out', 'TLSv1_3': 'timed out'}}]
+    assert resultaat['ipresponses']['ipv6data'] == {'addresses': []}
+    assert sslcheck.probecache.stats()['size'] == 0
+
+  @patch('sslcheck.getsslinfo', return_value=({'CN': 'test.nl', 'issuer': 'CA',
+                                                'validuntil': '2999-12-31 10:11:12'},
+                                               {'TLSv1_2': True, 'TLSv1_3': True}))
+  @patch('sslcheck.gethttpstatus', return_value='200')
+  @patch('pydig.query', side_effect=lambda host, recordtype: ['1.2.3.4', '1.2.3.5'] if recordtype == 'A' else [])
+  def test_getinfo_peradres(self, mock_pydigquery, mock_gethttpstatus, mock_getsslinfo):
+    resultaat = sslcheck.getinfo('test.nl', timings=True)
+    ipv4data = resultaat['ipresponses']['ipv4data']
+    assert [adres['ip'] for adres in ipv4data['addresses']] == ['1.2.3.4', '1.2.3.5']
+    assert all(adres['cert']['CN'] == 'test.nl' for adres in ipv4data['addresses'])
+    assert set(ipv4data['timings']['ssl']) == {'1.2.3.4', '1.2.3.5'}
+    assert resultaat['ipresponses']['ipv6data']['addresses'] == []
+    assert sorted(call.args[3] for call in mock_getsslinfo.call_args_list) == ['1.2.3.4', '1.2.3.5']
+
+  @patch('pydig.Resolver.query', side_effect=subprocess.CalledProcessError(9, 'dig'))
+  def test_dodigall_breaker(self, mock_query):
+    with patch('dnsquery.health', ResolverHealth(failurerate=0.5, cooldown=60)):
+      eerste = dnsquery.dodigall('test.nl', ['A'], '1.1.1.1')
+      dnsquery.dodigall('test.nl', ['A'], '1.1.1.1')
+      derde = dnsquery.dodigall('test.nl', ['A'], '1.1.1.1')
+      assert dnsquery.health.snapshot()['1.1.1.1']['open']
+    assert eerste == {'A': []}
+    assert derde == {'A': ['skipped']}
+    assert mock_query.call_count == 2
+
+  @patch('pydig.Resolver.query', return_value=['1.2.3.4'])
+  @patch('ratelimit.limiter.acquire', return_value=None)
+  def test_dodigall_ratelimit(self, mock_acquire, mock_query):
+    with patch('dnsquery.health', ResolverHealth(failurerate=0.5, cooldown=60)):
+      dnsquery.health.record('1.1.1.1', 5.0, False)
+      dnsquery.health.record('1.1.1.1', 5.0, False)
+      with patch('time.monotonic', return_value=time.monotonic() + 61):
+        resultaat = dnsquery.dodigall('beperkt.nl', ['A'], '1.1.1.1')
+        assert dnsquery.health.allow('1.1.1.1')
+    assert resultaat == {'A': ['timed out']}
+    assert not dnsquery.dnscache.get(('1.1.1.1', 'beperkt.nl', 'A'))[0]
+    mock_query.assert_not_called()
+
+  @patch('pydig.Resolver.__init__', return_value=None)
+  @patch('pydig.Resolver.query', return_value=['1.2.3.4'])
+  def test_dodigall_timeout(self, mock_query, mock_resolver):
+    with patch('dnsquery.health', ResolverHealth(maxtimeout=5.0)):
+      dnsquery.health.record('1.1.1.1', 0.5, True)
+      dnsquery.dodigall('test.nl', ['A'], '1.1.1.1')
+    mock_resolver.assert_called_once_with(nameservers=['1.1.1.1'], additional_args=['+time=2', '+tries=2'])
+
+  def test_getsslinfo(self):
+    certinfo, tlsinfo = sslcheck.getsslinfo('www.ncsc.nl')
+    assert certinfo.get('CN', None) is not None
+    assert tlsinfo == {'TLSv1_2': True, 'TLSv1_3': True}
+
+
+def mocksocket(version: str) -> MagicMock:
+  soc = MagicMock()
+  soc.__enter__.return_value = soc
+  soc.version.return_value = version
+  soc.getpeercert.return_value = {'subject': ((('commonName', 'test.nl'),),),
+                                  'issuer': ((('commonName', 'CA'),),),
+                                  'notAfter': 'Dec 29 10:11:12 2999 GMT'}
+  return soc
+
+
+class TestSslInfo(unittest.TestCase):
+  certinfo = {'CN': 'test.nl', 'issuer': 'CA', 'validuntil': '2999-12-29 10:11:12'}
+
+  @patch('tlsprobe.tlssupported', return_value=True)
+  @patch('tlsprobe.tlsconnect', return_value=mocksocket('TLSv1.3'))
+  def test_getsslinfo_tls13(self, mock_tlsconnect, mock_tlssupported):
+    resultaat = sslcheck.getsslinfo('test.nl')
+    assert resultaat == (self.certinfo, {'TLSv1_2': True, 'TLSv1_3': True})
+    mock_tlssupported.assert_called_once_with('test.nl', 'ipv4', 'TLSv1_2', 5.0, None)
+
+  @patch('tlsprobe.tlssupported')
+  @patch('tlsprobe.tlsconnect', return_value=mocksocket('TLSv1.2'))
+  def test_getsslinfo_tls12(self, mock_tlsconnect, mock_tlssupported):
+    resultaat = sslcheck.getsslinfo('test.nl', 'ipv6')
+    assert resultaat == (self.certinfo, {'TLSv1_2': True, 'TLSv1_3': False})
+    assert not mock_tlssupported.called
+
+  @patch('tlsprobe.tlssupported')
+  @patch('tlsprobe.tlsconnect', side_effect=ssl.SSLCertVerificationError)
+  def test_getsslinfo_verifyerror(self, mock_tlsconnect, mock_tlssupported):
+    resultaat = sslcheck.getsslinfo('test.nl')
+    assert resultaat == ({'error': 'Error getting cert'}, {'TLSv1_2': False, 'TLSv1_3': False})
+    assert not mock_tlssupported.called
+
+  @patch('tlsprobe.tlssupported', side_effect=[True, False])
+  @patch('tlsprobe.tlsconnect', side_effect=ssl.SSLError)
+  def test_getsslinfo_sslerror(self, mock_tlsconnect, mock_tlssupported):
+    resultaat = sslcheck.getsslinfo('test.nl')
+    assert resultaat == ({'error': 'Error getting cert'}, {'TLSv1_2': True, 'TLSv1_3': False})
+    assert mock_tlssupported.call_count == 2
+
+  @patch('tlsprobe.tlscontext')
+  @patch('socket.socket')
+  def test_tlsconnect_ipaddress(self, mock_socket, mock_tlscontext):
+    mock_tlscontext.return_value.wrap_socket.return_value.session = None
+    tlsprobe.tlsconnect('test.nl', 'ipv6', ipaddress='1:2::3:0')
+    mock_socket.return_value.connect.assert_called_once_with(('1:2::3:0', 443))
+    mock_tlscontext.return_value.wrap_socket.assert_called_once_with(mock_socket.return_value,
+                                                                     server_hostname='test.nl',
+                                                                     session=None)
+
+  @patch('tlsprobe.tlscontext')
+  @patch('socket.socket')
+  def test_tlsconnect_session(self, mock_socket, mock_tlscontext):
+    tlsprobe.tlssessions.clear()
+    sessie = mock_tlscontext.return_value.wrap_socket.return_value.session
+    sessie.timeout = 300
+    sessie.has_ticket = False
+    tlsprobe.tlsconnect('test.nl', ipaddress='1.2.3.4')
+    assert tlsprobe.tlssessions.get(('test.nl', 'ipv4', '1.2.3.4', 'default')) == (False, None)
+    sessie.has_ticket = True
+    tlsprobe.tlsconnect('test.nl', ipaddress='1.2.3.4')
+    assert tlsprobe.tlssessions.get(('test.nl', 'ipv4', '1.2.3.4', 'default')) == (True, sessie)
+    tlsprobe.tlssessions.clear()
+
+  @patch('socket.socket')
+  @patch('ratelimit.limiter.acquire', return_value=None)
+  def test_getsslinfo_ratelimit(self, mock_acquire, mock_socket):
+    resultaat = sslcheck.getsslinfo('test.nl', ipaddress='1.2.3.4')
+    assert resultaat == ({'error': 'timed out'}, {'TLSv1_2': 'timed out', 'TLSv1_3': 'timed out'})
+    assert tlsprobe.getcertinfo('test.nl', ipaddress='1.2.3.4') == {'error': 'timed out'}
+    assert tlsprobe.tlssupported('test.nl', 'ipv4', 'TLSv1_2', ipaddress='1.2.3.4') == 'timed out'
+    assert not mock_socket.called
+
+  @patch('tlsprobe.tlssupported')
+  @patch('tlsprobe.tlsconnect')
+  def test_getsslinfo_expired(self, mock_tlsconnect, mock_tlssupported):
+    deadline = Deadline(0.001)
+    time.sleep(0.01)
+    resultaat = sslcheck.getsslinfo('test.nl', deadline=deadline)
+    assert resultaat == ({'error': 'timed out'}, {'TLSv1_2': 'timed out', 'TLSv1_3': 'timed out'})
+    assert not mock_tlsconnect.called
@@ -0,0 +1,297 @@
+""" TLS connections for the certificate and TLS-version probes """
+import socket
+import ssl
+from datetime import datetime
+
+import metrics
+import ratelimit
+from cache import TTLCache
+from deadline import TIMEDOUT, Deadline
+
+TLSVERSIONS = {'TLSv1_2': ssl.TLSVersion.TLSv1_2, 'TLSv1_3': ssl.TLSVersion.TLSv1_3}
+TLSSESSIONS = 10000
+# The port of the probes; the benchmark points it at its local TLS servers.
+TLSPORT = 443
+CONNECTTIMEOUT = 5.0
+
+tlscontexts: dict[str, ssl.SSLContext] = {}
+tlssessions = TTLCache(TLSSESSIONS)
+
+
+class RateLimited(socket.timeout):
+  """
+  Raised by tlsconnect when the rate limit of the address does not allow a
+  connection within the timeout; no connection was attempted.
+  """
+
+
+def tlscontext(version: str = None) -> ssl.SSLContext:
+  """
+  Returns the shared SSL context for a TLS version.
+
+  The contexts are created once, so TLS sessions stored by tlsconnect can be
+  resumed on later connections with the same context.
+
+  Parameters:
+  version: str
+    The name of the only TLS version the context allows (a key of TLSVERSIONS),
+    or None for the default context that negotiates the highest version both
+    sides support.
+
+  Returns:
+  ssl.SSLContext
+    The SSL context.
+  """
+  name = version or 'default'
+  if name not in tlscontexts:
+    ctx = ssl.create_default_context()
+    if version:
+      ctx.minimum_version = TLSVERSIONS[version]
+      ctx.maximum_version = TLSVERSIONS[version]
+    tlscontexts[name] = ctx
+  return tlscontexts[name]
+
+
+def tlsconnect(host: str, ipversion: str = 'ipv4', version: str = None,
+               timeout: float = CONNECTTIMEOUT, ipaddress: str = None) -> ssl.SSLSocket:
+  """
+  Opens a TLS connection to port TLSPORT of a host, resuming an earlier TLS
+  session when one is known for the host, address and TLS version.
+
+  Every TLS version has its own context, so a session is only resumed by a later
+  connection with the same version, such as a probe of the next check. Only a
+  session with a ticket is stored. A TLSv1.3 server sends its ticket after the
+  handshake, and the probes never read from the connection, so TLSv1.3 sessions
+  are not stored; in practice the TLSv1.2 probes are the ones that are resumed.
+
+  With an address the connection goes to that address and the host is only
+  used for SNI and certificate verification; without one the host is resolved
+  by the system resolver. The connection first waits for the rate limit of the
+  address (see ratelimit), within the timeout.
+
+  Parameters:
+  host: str
+    The hostname of the server.
+  ipversion: str
+    The IP version to be used for the connection, 'ipv4' or 'ipv6'. Defaults to 'ipv4'.
+  version: str
+    The name of the only TLS version to allow, or None to negotiate the highest version.
+  timeout: float
+    The socket timeout in seconds. Defaults to CONNECTTIMEOUT.
+  ipaddress: str
+    The address to connect to. Defaults to the address the system resolver gives.
+
+  Returns:
+  ssl.SSLSocket
+    The connected socket; the caller must close it.
+
+  Raises:
+  IOError
+    If an error occurs during the connection or SSL handshake process, or
+    RateLimited if the rate limit does not allow a connection in time.
+  """
+  if ipversion == 'ipv6':
+    sock_type = socket.AF_INET6
+  else:
+    sock_type = socket.AF_INET
+  waited = ratelimit.limiter.acquire('ip', ipaddress or host, host, timeout=timeout)
+  if waited is None:
+    raise RateLimited('rate limited')
+  sessionkey = (host.lower(), ipversion, ipaddress, version or 'default')
+  _, session = tlssessions.get(sessionkey)
+  socks = socket.socket(sock_type)
+  socks.settimeout(max(timeout - waited, 0.001))
+  try:
+    with metrics.stage('connect', ipversion, host=host, ip=ipaddress or host,
+                       version=version or ''):
+      socks.connect((ipaddress or host, TLSPORT))
+    with metrics.stage('handshake', ipversion, host=host, ip=ipaddress or host,
+                       version=version or ''):
+      soc = tlscontext(version).wrap_socket(socks, server_hostname=host, session=session)
+  except IOError:
+    socks.close()
+    raise
+  if soc.session is not None and soc.session.has_ticket:
+    tlssessions.put(sessionkey, soc.session, soc.session.timeout)
+  return soc
+
+
+def parsecert(cert: dict) -> dict:
+  """
+  Extracts the common name, the issuer's common name and the end of the validity
+  period from a certificate as returned by SSLSocket.getpeercert().
+
+  Parameters:
+  cert: dict
+    The decoded certificate.
+
+  Returns:
+  dict
+    A dictionary with the keys 'CN', 'issuer' and 'validuntil'.
+  """
+  subject = dict(x[0] for x in cert['subject'])
+  issuer = dict(x[0] for x in cert['issuer'])
+  validdate = datetime.strptime(cert['notAfter'], '%b %d %H:%M:%S %Y %Z')
+  return {'CN': subject['commonName'],
+          'issuer': issuer['commonName'],
+          'validuntil': validdate.strftime('%Y-%m-%d %H:%M:%S')}
+
+
+def tlssupported(host: str, ipversion: str, version: str,
+                 timeout: float = CONNECTTIMEOUT, ipaddress: str = None) -> bool or str:
+  """
+  Tells whether a host accepts a connection with one specific TLS version.
+
+  Parameters:
+  host: str
+    The hostname of the server.
+  ipversion: str
+    The IP version to be used for the connection, 'ipv4' or 'ipv6'.
+  version: str
+    The name of the TLS version to test, a key of TLSVERSIONS.
+  timeout: float
+    The socket timeout in seconds. Defaults to CONNECTTIMEOUT.
+  ipaddress: str
+    The address to connect to, see tlsconnect.
+
+  Returns:
+  bool or str
+    True if the TLS handshake with this version succeeds, 'timed out' if the
+    rate limit did not allow a connection in time.
+  """
+  try:
+    with tlsconnect(host, ipversion, version, timeout, ipaddress):
+      return True
+  except RateLimited:
+    return TIMEDOUT
+  except IOError:
+    return False
+
+
+def getcertinfo(host: str, ipversion: str = 'ipv4', ipaddress: str = None) -> dict:
+  """
+  Retrieves the SSL certificate details of a given host specifying the IP version.
+
+  The function establishes a secure connection to the given host, fetches the SSL
+  certificate, and extracts information such as the common name (CN) of the
+  certificate, the issuer's common name, and the validity period of the certificate.
+  If an error occurs while attempting to establish a connection or retrieve the
+  certificate, an error message is included in the return dictionary.
+
+  Parameters:
+  host: str
+    The hostname of the server for which the SSL certificate information is retrieved.
+  ipversion: str
+    The IP version to be used for the connection. Defaults to 'ipv4'. Supported
+    options are 'ipv4' and 'ipv6'.
+  ipaddress: str
+    The address to connect to, as resolved by getip. Defaults to the address the
+    system resolver gives.
+
+  Returns:
+  dict
+    A dictionary containing the extracted certificate information or an error message
+    in case of failure; the error is 'timed out' when the rate limit did not allow a
+    connection in time.
+  """
+  try:
+    soc = tlsconnect(host, ipversion, ipaddress=ipaddress)
+  except RateLimited:
+    return {'error': TIMEDOUT}
+  except IOError:
+    return {'error': 'Error getting cert'}
+  with soc:
+    return parsecert(soc.getpeercert())
+
+
+def gettlsinfo(host: str, ipversion: str = 'ipv4', ipaddress: str = None) -> dict[str, bool]:
+  """
+Get the supported TLS versions for a given host.
+
+This function checks the provided host for its support for specific versions
+of TLS protocols by establishing secure sockets using SSL/TLS configurations
+with predefined minimum and maximum versions. It supports both IPv4 and IPv6
+connections as specified by the user.
+
+Arguments:
+    host (str): The hostname of the server to test for supported TLS versions.
+    ipversion (str): Specify whether to use 'ipv4' or 'ipv6' for the connection.
+        Defaults to 'ipv4'.
+    ipaddress (str): The address to connect to, as resolved by getip. Defaults to
+        the address the system resolver gives.
+
+Returns:
+    dict: A dictionary where the keys are strings representing the names of
+    the TLS versions and the values are booleans indicating support for that
+    version.
+"""
+  return {ver: tlssupported(host, ipversion, ver, ipaddress=ipaddress)
+          for ver in TLSVERSIONS}
+
+
+def getsslinfo(host: str, ipversion: str = 'ipv4', deadline: Deadline = None,
+               ipaddress: str = None) -> tuple[dict, dict[str, bool or str]]:
+  """
+  Gets the certificate details and the supported TLS versions of a host with as
+  few TLS handshakes as possible.
+
+  The first connection negotiates the highest TLS version and gives both the
+  certificate and one supported version. When TLSv1.2 is negotiated while TLSv1.3
+  was offered, the host does not support TLSv1.3. Only the versions that are still
+  unknown get a connection of their own. When the first connection fails on the
+  certificate or the network, every version would fail the same way, so no other
+  connections are made. The results are the same as those of getcertinfo and
+  gettlsinfo.
+
+  Every connection times out at the deadline at the latest. A certificate or TLS
+  version that is unknown when the deadline passes, or whose connection was not
+  allowed in time by the rate limit, is reported as 'timed out'.
+
+  Parameters:
+  host: str
+    The hostname of the server.
+  ipversion: str
+    The IP version to be used for the connection, 'ipv4' or 'ipv6'. Defaults to 'ipv4'.
+  deadline: Deadline
+    The deadline of the check. Defaults to no deadline.
+  ipaddress: str
+    The address to probe, see tlsconnect.
+
+  Returns:
+  tuple[dict, dict[str, bool or str]]
+    The certificate information as returned by getcertinfo and the TLS versions
+    as returned by gettlsinfo.
+  """
+  deadline = deadline or Deadline()
+  if deadline.expired():
+    return {'error': TIMEDOUT}, {ver: TIMEDOUT for ver in TLSVERSIONS}
+  certinfo = {'error': 'Error getting cert'}
+  tlsinfo = {}
+  try:
+    with tlsconnect(host, ipversion, timeout=deadline.timeout(CONNECTTIMEOUT),
+                    ipaddress=ipaddress) as soc:
+      certinfo = parsecert(soc.getpeercert())
+      negotiated = soc.version().replace('.', '_')
+      for ver, tlsversion in TLSVERSIONS.items():
+        if ver == negotiated:
+          tlsinfo[ver] = True
+        elif tlsversion > ssl.TLSVersion[negotiated]:
+          tlsinfo[ver] = False
+  except RateLimited:
+    certinfo = {'error': TIMEDOUT}
+    tlsinfo = {ver: TIMEDOUT for ver in TLSVERSIONS}
+  except socket.timeout:
+    if deadline.expired():
+      certinfo = {'error': TIMEDOUT}
+    tlsinfo = {ver: TIMEDOUT if deadline.expired() else False for ver in TLSVERSIONS}
+  except (ssl.SSLCertVerificationError, ConnectionError, socket.gaierror):
+    tlsinfo = {ver: False for ver in TLSVERSIONS}
+  except IOError:
+    pass
+  for ver in TLSVERSIONS:
+    if ver not in tlsinfo and deadline.expired():
+      tlsinfo[ver] = TIMEDOUT
+    elif ver not in tlsinfo:
+      tlsinfo[ver] = tlssupported(host, ipversion, ver, deadline.timeout(CONNECTTIMEOUT),
+                                  ipaddress)
+  return certinfo, {ver: tlsinfo[ver] for ver in TLSVERSIONS}